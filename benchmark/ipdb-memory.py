@@ -0,0 +1,73 @@
+'''
+IPDB memory footprint with many interfaces.
+
+Every case runs in a separate process: IPDB loads N synthetic
+RTM_NEWLINK messages, cloned from the first link of the system,
+and the RSS growth and the load time are reported::
+
+    python ipdb-memory.py [N ...]
+
+The default is 1000, 10000 and 50000 interfaces.
+'''
+import gc
+import sys
+import time
+import resource
+import multiprocessing
+from pyroute2 import IPDB
+
+
+def rss():
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def messages(template, count):
+    for index in range(count):
+        # every message uses its own buffer, as if received
+        # from the kernel
+        msg = template.__class__(bytearray(template.data))
+        msg.decode()
+        msg['index'] = 1000000 + index
+        msg['header']['sequence_number'] = 0
+        msg['event'] = 'RTM_NEWLINK'
+        msg['attrs'] = [x for x in msg['attrs']
+                        if x[0] not in ('IFLA_IFNAME', 'IFLA_MASTER')]
+        msg['attrs'].append(['IFLA_IFNAME', 'bench%i' % index])
+        yield msg
+
+
+def run(count, compact, ret):
+    with IPDB(compact_interfaces=compact) as ipdb:
+        template = ipdb.nl.get_links()[0]
+        gc.collect()
+        started_rss = rss()
+        started = time.time()
+        with ipdb.exclusive:
+            for msg in messages(template, count):
+                ipdb.interfaces._new(msg)
+        spent = time.time() - started
+        gc.collect()
+        ret.put((rss() - started_rss, spent))
+
+
+def main(counts):
+    print('%10s %8s %12s %10s %8s' % ('interfaces', 'compact',
+                                      'memory, MB', 'bytes/if',
+                                      'time, s'))
+    for count in counts:
+        for compact in (False, True):
+            ret = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=run,
+                                           args=(count, compact, ret))
+            proc.start()
+            (memory, spent) = ret.get()
+            proc.join()
+            print('%10i %8s %12.1f %10i %8.2f' % (count,
+                                                  compact,
+                                                  memory / 1048576.0,
+                                                  memory // count,
+                                                  spent))
+
+
+main([int(x) for x in sys.argv[1:]] or [1000, 10000, 50000])
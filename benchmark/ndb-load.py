@@ -0,0 +1,77 @@
+'''
+NDB route table load time.
+
+N synthetic RTM_NEWROUTE messages are loaded into an in-memory
+NDB schema row by row, with the batched UPSERT and as the initial
+dump bulk load, and then reloaded to benchmark the updates::
+
+    python ndb-load.py [N ...]
+
+The default is 1000 and 10000 routes.
+'''
+import sys
+import time
+import sqlite3
+import threading
+from socket import AF_INET
+from pyroute2.ndb import dbschema
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+
+
+def messages(count):
+    for index in range(count):
+        msg = rtmsg()
+        msg['header'] = {'type': 24}
+        msg['family'] = AF_INET
+        msg['dst_len'] = 32
+        msg['proto'] = 4
+        msg['scope'] = 0
+        msg['type'] = 1
+        msg['attrs'] = [('RTA_TABLE', 254),
+                        ('RTA_DST', '10.%i.%i.%i' % (index >> 16,
+                                                     (index >> 8) & 0xff,
+                                                     index & 0xff)),
+                        ('RTA_GATEWAY', '127.0.0.2'),
+                        ('RTA_OIF', 1)]
+        yield msg
+
+
+def run(count, mode):
+    schema = dbschema.init(sqlite3.connect(':memory:',
+                                           check_same_thread=False),
+                           'sqlite3',
+                           False,
+                           id(threading.current_thread()))
+    schema.upsert = mode != 'plain'
+    # routes refer to the interface
+    msg = ifinfmsg()
+    msg['header'] = {'type': 16}
+    msg['index'] = 1
+    msg['flags'] = 1
+    msg['attrs'] = [('IFLA_IFNAME', 'lo')]
+    schema.load_ifinfmsg('localhost', msg)
+    ret = []
+    for _ in range(2):
+        events = list(messages(count))
+        started = time.time()
+        if mode == 'bulk':
+            schema.bulk_start('localhost')
+        for msg in events:
+            schema.load_rtmsg('localhost', msg)
+        schema.bulk_end('localhost')
+        schema.commit()
+        ret.append(time.time() - started)
+    schema.close()
+    return ret
+
+
+def main(counts):
+    print('%10s %8s %10s %10s' % ('routes', 'mode', 'load, s', 'reload, s'))
+    for count in counts:
+        for mode in ('plain', 'upsert', 'bulk'):
+            print('%10i %8s %10.2f %10.2f' % ((count, mode) +
+                                              tuple(run(count, mode))))
+
+
+main([int(x) for x in sys.argv[1:]] or [1000, 10000])
@@ -0,0 +1,89 @@
+'''
+NDB events latency with a busy source.
+
+N synthetic RTM_NEWROUTE messages are enqueued for the 'busy'
+source, then one RTM_NEWLINK for the 'quiet' source. The benchmark
+reports when the quiet event is loaded and when the busy queue is
+drained, w/o shards and with a shard per source::
+
+    python ndb-shards.py [N ...]
+
+The default is 10000 routes. Requires the rights to open
+RTNL sockets.
+'''
+import sys
+import time
+import threading
+from socket import AF_INET
+from pyroute2 import NDB
+from pyroute2 import IPRoute
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+
+
+def messages(count):
+    for index in range(count):
+        msg = rtmsg()
+        msg['header'] = {'type': 24}
+        msg['family'] = AF_INET
+        msg['dst_len'] = 32
+        msg['proto'] = 4
+        msg['scope'] = 0
+        msg['type'] = 1
+        msg['attrs'] = [('RTA_TABLE', 254),
+                        ('RTA_DST', '10.%i.%i.%i' % (index >> 16,
+                                                     (index >> 8) & 0xff,
+                                                     index & 0xff)),
+                        ('RTA_GATEWAY', '127.0.0.2'),
+                        ('RTA_OIF', 1)]
+        yield msg
+
+
+def link():
+    msg = ifinfmsg()
+    msg['header'] = {'type': 16}
+    msg['index'] = 1
+    msg['flags'] = 1
+    msg['attrs'] = [('IFLA_IFNAME', 'lo'), ('IFLA_MTU', 1500)]
+    return msg
+
+
+def run(count, shards):
+    ndb = NDB(sources={'busy': IPRoute(), 'quiet': IPRoute()},
+              db_shards=shards)
+    loaded = {}
+
+    def handler(target, event):
+        if target not in loaded:
+            loaded[target] = time.time()
+
+    def evq(target):
+        if ndb.shards:
+            return ndb._shard_map[target].queue
+        return ndb._event_queue
+
+    ndb.register_handler(ifinfmsg, handler)
+    events = list(messages(count))
+    sync = {'busy': threading.Event(),
+            'quiet': threading.Event()}
+    started = time.time()
+    for msg in events:
+        evq('busy').put(('busy', (msg, )))
+    for target in ('busy', 'quiet'):
+        evq(target).put((target, (link(), sync[target])))
+    for event in sync.values():
+        event.wait()
+    ret = (loaded['quiet'] - started, loaded['busy'] - started)
+    ndb.close()
+    return ret
+
+
+def main(counts):
+    print('%10s %8s %10s %10s' % ('routes', 'shards', 'quiet, s', 'busy, s'))
+    for count in counts:
+        for shards in (0, 2):
+            print('%10i %8i %10.3f %10.3f' % ((count, shards) +
+                                              run(count, shards)))
+
+
+main([int(x) for x in sys.argv[1:]] or [10000])
@@ -29,6 +29,7 @@ from pyroute2.devlink import DL
 from pyroute2.conntrack import Conntrack
 from pyroute2.nftables.main import NFTables
 from pyroute2.netns.nslink import NetNS
+from pyroute2.netns.broker import NetNSBroker
 from pyroute2.netns.process.proxy import NSPopen
 from pyroute2.netlink.rtnl.iprsocket import IPRSocket
 from pyroute2.netlink.taskstats import TaskStats
@@ -98,6 +99,7 @@ classes = [IPRouteRequest,
            Conntrack,
            NFTables,
            NetNS,
+           NetNSBroker,
            NSPopen,
            IPRSocket,
            TaskStats,
@@ -11,8 +11,13 @@ ipdb_nl_async = True
 nlm_generator = False
 
 commit_barrier = 0
+# keep netns fds open in pyroute2.netns.cache, see the cache docs
+netns_fd_cache = False
 gc_timeout = 60
 db_transaction_limit = 10000
+db_batch_limit = 1000
+# log NDB queries slower than N seconds with their plans
+db_slow_query = None
 
 # save uname() on startup time: it is not so
 # highly possible that the kernel will be
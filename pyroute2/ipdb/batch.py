@@ -0,0 +1,430 @@
+'''
+Batched commit
+==============
+
+`IPDB.commit(batch=True)` compiles the pending transactions
+into netlink requests with `IPBatch`, sends them to the kernel
+as few datagrams and collects all the responses afterwards.
+The requests are sent in stages:
+
+1. new interfaces, one stage per dependency level: a VLAN
+   on top of a new interface goes to the next stage
+2. interface changes and IP addresses
+3. routes
+
+Every stage waits for all the ACKs and for the IPDB updates
+from the kernel at once. If any request fails, the applied
+requests are reverted in the reverse order, and the first
+error is raised.
+'''
+import errno
+import logging
+from pyroute2.common import AF_MPLS
+from pyroute2.iproute.linux import IPBatch
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.nlsocket import NetlinkSocket
+from pyroute2.ipdb.exceptions import CommitException
+from pyroute2.ipdb.exceptions import CreateException
+from pyroute2.ipdb.interfaces import Interface
+from pyroute2.ipdb.routes import BaseRoute
+from pyroute2.ipdb.transactional import Journal
+from pyroute2.ipdb.transactional import SYNC_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+
+class SeqPool(object):
+    '''
+    Allocate sequence numbers from the socket pool, but do not
+    release them until the responses are collected.
+    '''
+    def __init__(self, pool):
+        self.pool = pool
+        self.allocated = []
+
+    def alloc(self):
+        seq = self.pool.alloc()
+        self.allocated.append(seq)
+        return seq
+
+    def free(self, *argv, **kwarg):
+        pass
+
+
+class Pipeline(object):
+    '''
+    Compile requests into one buffer, send it and collect the
+    responses. Each request is `(method, argv, kwarg)` as for
+    the `IPRoute` API.
+    '''
+    # send the buffer in chunks not bigger than the default
+    # socket buffer
+    chunk_size = 65536
+
+    def __init__(self, nl):
+        self.nl = nl
+        self.compiler = IPBatch()
+        self.compiler.addr_pool = SeqPool(nl.addr_pool)
+        self.requests = []
+
+    def add(self, request, undo=None, ignore=()):
+        '''
+        Compile the request. `undo` is the request to revert the
+        change, `ignore` -- error codes to treat as a success,
+        but with nothing to revert.
+        '''
+        method, argv, kwarg = request
+        allocated = len(self.compiler.addr_pool.allocated)
+        size = len(self.compiler.batch)
+        try:
+            getattr(self.compiler, method)(*argv, **kwarg)
+        except Exception:
+            #
+            # release the sequence numbers the failed request may
+            # have allocated, and drop its partial data
+            #
+            for seq in self.compiler.addr_pool.allocated[allocated:]:
+                self.nl.addr_pool.free(seq, ban=0xff)
+            del self.compiler.addr_pool.allocated[allocated:]
+            del self.compiler.batch[size:]
+            raise
+        self.requests.append((self.compiler.addr_pool.allocated[-1],
+                              len(self.compiler.batch),
+                              undo,
+                              ignore))
+
+    def run(self):
+        '''
+        Send all the requests and return `(undo, error)` for
+        every request in the order of compilation.
+        '''
+        ret = []
+        if not self.requests:
+            return ret
+        with self.nl.backlog_lock:
+            for request in self.requests:
+                self.nl.backlog[request[0]] = []
+        data = self.compiler.batch
+        start = prev = 0
+        for (seq, end, undo, ignore) in self.requests:
+            # flush the chunk before the request that overflows it;
+            # a request bigger than the chunk size goes alone
+            if end - start > self.chunk_size and prev > start:
+                self.nl.sendto(bytes(data[start:prev]), (0, 0))
+                start = prev
+            prev = end
+        if start < len(data):
+            self.nl.sendto(bytes(data[start:]), (0, 0))
+        for (seq, end, undo, ignore) in self.requests:
+            error = None
+            try:
+                self.nl.get(msg_seq=seq)
+            except NetlinkError as e:
+                if e.code in ignore:
+                    undo = None
+                else:
+                    error = e
+            except Exception as e:
+                error = e
+            finally:
+                self.nl.addr_pool.free(seq, ban=0xff)
+            ret.append((undo, error))
+        self.compiler.reset()
+        self.requests = []
+        return ret
+
+
+class BatchCommit(object):
+    '''
+    Apply a list of `(target, transaction)` pairs as described
+    in the module docs. Only simple transactions may be batched,
+    see `eligible()`; the rest must go with the regular commit.
+    '''
+    # fields, that require special requests
+    special = ('bond_', 'brport_', 'br_', 'net_ns_fd', 'net_ns_pid',
+               'vlan_flags')
+
+    def __init__(self, ipdb, transactions):
+        self.ipdb = ipdb
+        self.nl = ipdb.nl
+        self.transactions = [x for x in transactions
+                             if x[0]['ipdb_scope'] != 'detached']
+        self.interfaces = [x for x in self.transactions
+                           if isinstance(x[0], Interface)]
+        self.routes = [x for x in self.transactions
+                       if isinstance(x[0], BaseRoute)]
+        self.new = dict([(id(x[0]), x) for x in self.interfaces
+                         if x[0]['ipdb_scope'] == 'create'])
+        # undo requests for the applied changes
+        self.applied = []
+        # snapshots of new interfaces, to restore on failure
+        self.created = []
+        # routes being removed
+        self.locked = []
+
+    def _parent(self, target):
+        # return a new interface, that the target is linked to
+        if not target._deferred_link:
+            return None
+        link = target._deferred_link[1]
+        parent = self.ipdb.interfaces.get(link)
+        if parent is not None and id(parent) in self.new:
+            return parent
+        return None
+
+    def _level(self, target):
+        level = 0
+        parent = self._parent(target)
+        while parent is not None:
+            level += 1
+            parent = self._parent(parent)
+        return level
+
+    def _eligible(self, target, tx):
+        if getattr(tx, 'partial', False) or target._commit_hooks:
+            return False
+        if isinstance(target, BaseRoute):
+            if target['family'] == AF_MPLS or \
+                    tx['multipath'] or target['multipath']:
+                return False
+            return (target['ipdb_scope'], tx['ipdb_scope']) in \
+                (('create', 'create'), ('system', 'remove'))
+        if not isinstance(target, Interface):
+            return False
+        scope = target['ipdb_scope']
+        if scope not in ('create', 'system') or tx['ipdb_scope'] != scope:
+            return False
+        if tx._delay_add_port or tx._delay_del_port:
+            return False
+        for key in ('ports', 'vlans'):
+            if (tx[key] - target[key]) or (target[key] - tx[key]):
+                return False
+        for key in tx:
+            if key in tx._linked_sets:
+                continue
+            if scope == 'create':
+                changed = tx[key] is not None
+            else:
+                changed = tx[key] != target.get(key)
+            if changed and key.startswith(self.special):
+                return False
+        if target._deferred_link:
+            link = target._deferred_link[1]
+            if not target._resolve_port(link) and \
+                    self._parent(target) is None:
+                return False
+        return True
+
+    def eligible(self):
+        '''
+        Check if all the transactions may be batched.
+        '''
+        if not isinstance(self.nl, NetlinkSocket):
+            return False
+        return all([self._eligible(*x) for x in self.transactions])
+
+    def _run(self, pipeline):
+        error = None
+        for (undo, e) in pipeline.run():
+            if e is None:
+                if undo is not None:
+                    self.applied.append(undo)
+            elif error is None:
+                error = e
+        if error is not None:
+            raise error
+
+    def _create(self):
+        levels = {}
+        for (target, tx) in self.interfaces:
+            if id(target) not in self.new:
+                continue
+            levels.setdefault(self._level(target), []).append((target, tx))
+        for level in sorted(levels):
+            pipeline = Pipeline(self.nl)
+            for (target, tx) in levels[level]:
+                self.created.append((target, target.pick(detached=True)))
+                target.set_target('ipdb_scope', 'system')
+                if target._deferred_link:
+                    key, link = target._deferred_link
+                    tx[key] = target._resolve_port(link)
+                    target._deferred_link = None
+                if target['address'] == '00:00:00:00:00:00':
+                    with target._direct_state:
+                        target['address'] = None
+                        target['broadcast'] = None
+                request = dict([(x, tx[x]) for x in tx
+                                if not x.startswith(self.special)])
+                pipeline.add(('link', ('add', ), request),
+                             ('link', ('del', ), {'ifname': tx['ifname']}))
+            self._run(pipeline)
+            for (target, tx) in levels[level]:
+                if not target.wait_target('ipdb_scope'):
+                    raise CreateException()
+                # see Interface.commit(): collect automatic addresses
+                for addr in self.ipdb.ipaddr[target['index']]:
+                    tx['ipaddr'].add(addr)
+
+    def _update(self):
+        pipeline = Pipeline(self.nl)
+        links = []
+        addrs = []
+        for (target, tx) in self.interfaces:
+            snapshot = Journal(target)
+            try:
+                removed, added = snapshot // tx
+            finally:
+                snapshot.close()
+            # link attributes
+            request = {}
+            for key in added:
+                if key not in target._virtual_fields and key != 'kind':
+                    request[key] = added[key]
+            if request.get('address') is not None:
+                request['address'] = request['address'].lower()
+            if any([x is not None for x in request.values()]):
+                undo = dict([(x, target.get(x)) for x in request])
+                for req in (request, undo):
+                    req['index'] = target['index']
+                    req['kind'] = target['kind']
+                if request.get('address', None) == '00:00:00:00:00:00':
+                    request.pop('address')
+                    request.pop('broadcast', None)
+                pipeline.add(('link', ('update', ), request),
+                             ('link', ('update', ), undo))
+                links.append((target, tx, request))
+            # IP addresses
+            ip2add = tx['ipaddr'] - target['ipaddr']
+            ip2remove = target['ipaddr'] - tx['ipaddr']
+            if not ip2add and not ip2remove:
+                continue
+            target['ipaddr'].set_target(tx['ipaddr'])
+            addrs.append((target, tx))
+            index = target['index']
+            # remove secondaries first, see Interface.commit()
+            for i in sorted(ip2remove,
+                            key=lambda x: target['ipaddr'][x]['flags'],
+                            reverse=True):
+                pipeline.add(('addr', ('delete', index, i[0], i[1]), {}),
+                             ('addr', ('add', index, i[0], i[1]), {}),
+                             ignore=(errno.EADDRNOTAVAIL, ))
+            for i in ip2add:
+                try:
+                    kwarg = dict([k for k in tx['ipaddr'][i].items()
+                                  if k[0] in ('broadcast',
+                                              'anycast',
+                                              'scope')])
+                except KeyError:
+                    kwarg = {}
+                pipeline.add(('addr', ('add', index, i[0], i[1]), kwarg),
+                             ('addr', ('delete', index, i[0], i[1]), {}),
+                             ignore=(errno.EEXIST, ))
+        self._run(pipeline)
+        for (target, tx, request) in links:
+            # setting ifalias doesn't cause netlink updates
+            if 'ifalias' in request:
+                target.reload()
+            tx.wait_all_targets()
+        for (target, tx) in addrs:
+            target._sync_ipv6(tx)
+            target['ipaddr'].target.wait(SYNC_TIMEOUT)
+            if not target['ipaddr'].target.is_set():
+                raise CommitException('ipaddr target is not set')
+
+    def _routes(self):
+        pipeline = Pipeline(self.nl)
+        added = []
+        wds = []
+        for (target, tx) in self.routes:
+            if tx['ipdb_scope'] == 'remove':
+                snapshot = target.pick()
+                with target._direct_state:
+                    target['ipdb_scope'] = 'locked'
+                self.locked.append(target)
+                wds.append(self.ipdb.watchdog('RTM_DELROUTE',
+                                              **target.wd_key(snapshot)))
+                pipeline.add(('route', ('delete', ), dict(snapshot)),
+                             ('route', ('add', ), dict(snapshot)))
+            else:
+                pipeline.add(('route', ('add', ), dict(tx)),
+                             ('route', ('delete', ), dict(tx)))
+                added.append(tx)
+        try:
+            self._run(pipeline)
+        except Exception:
+            for wd in wds:
+                wd.cancel()
+            raise
+        for tx in added:
+            tx.wait_all_targets()
+            for key in ('metrics', 'via'):
+                if tx[key] and tx[key]._targets:
+                    tx[key].wait_all_targets()
+        for wd in wds:
+            wd.wait()
+            if not wd.is_set:
+                raise CommitException('route removal is not confirmed')
+        for target in self.locked:
+            with target._direct_state:
+                target['ipdb_scope'] = 'detached'
+            target.detach()
+        self.locked = []
+        if self.routes:
+            self.ipdb.routes.gc()
+
+    def rollback(self):
+        '''
+        Revert all the applied requests in the reverse order.
+        '''
+        checks = []
+        pipeline = Pipeline(self.nl)
+        for undo in reversed(self.applied):
+            try:
+                pipeline.add(undo)
+            except Exception as e:
+                log.error('batch rollback: %s' % e)
+                continue
+            # what to wait for: (watchdog, target, keys)
+            check = (None, None, ())
+            if undo[0] == 'link' and undo[1] == ('del', ):
+                check = (self.ipdb.watchdog('RTM_DELLINK', **undo[2]),
+                         None,
+                         ())
+            elif undo[0] == 'link':
+                target = self.ipdb.interfaces[undo[2]['index']]
+                keys = [x for x in undo[2].items()
+                        if x[0] not in ('index', 'kind') and
+                        x[1] is not None]
+                for (key, value) in keys:
+                    target.set_target(key, value)
+                check = (None, target, [x[0] for x in keys])
+            checks.append(check)
+        for ((undo, error), (wd, target, keys)) in \
+                zip(pipeline.run(), checks):
+            if error is not None:
+                log.error('batch rollback: %s' % error)
+                if wd is not None:
+                    wd.cancel()
+                for key in keys:
+                    target._local_targets.pop(key, None)
+                continue
+            if wd is not None:
+                wd.wait()
+            for key in keys:
+                if not target.wait_target(key):
+                    log.error('batch rollback: %s is not reverted' % key)
+        for (target, snapshot) in self.created:
+            target._local_targets.pop('ipdb_scope', None)
+            target.load_dict(snapshot)
+        for target in self.locked:
+            with target._direct_state:
+                target['ipdb_scope'] = 'system'
+
+    def run(self):
+        try:
+            self._create()
+            self._update()
+            self._routes()
+        except Exception:
+            self.rollback()
+            raise
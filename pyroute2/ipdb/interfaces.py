@@ -13,9 +13,12 @@ from pyroute2.common import dqn2int
 from pyroute2.common import View
 from pyroute2.common import Dotkeys
 from pyroute2.netlink import rtnl
+from pyroute2.netlink import nla_slot
 from pyroute2.netlink.exceptions import NetlinkError
 from pyroute2.netlink.rtnl.ifinfmsg import IFF_MASK
 from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import IFA_F_TENTATIVE
+from pyroute2.ipdb.transactional import Journal
 from pyroute2.ipdb.transactional import Transactional
 from pyroute2.ipdb.transactional import with_transaction
 from pyroute2.ipdb.transactional import SYNC_TIMEOUT
@@ -62,6 +65,40 @@ def _br_time_check(x, y):
     return abs(x - y) < 5
 
 
+# NLA name -> field name, to share the strings among interfaces
+_nla_names = {}
+
+
+def _nla2name(name):
+    ret = _nla_names.get(name)
+    if ret is None:
+        ret = _nla_names[name] = ifinfmsg.nla2name(name)
+    return ret
+
+
+def _nla_raw(cell):
+    # nested, struct and unknown NLAs are kept as raw bytes,
+    # simple values are decoded right away
+    if not isinstance(cell, nla_slot):
+        return None
+    nla = cell.cell[1]
+    if nla.decoded or (len(nla.fields) == 1 and not nla.nla_map):
+        return None
+    return (type(nla),
+            nla._nla_init,
+            bytes(nla.data[nla.offset:nla.offset + nla.length]))
+
+
+def _nla_decode(raw):
+    (nla_class, init, data) = raw
+    nla = nla_class(data=data, length=len(data), init=init)
+    try:
+        nla.decode()
+        return nla.getvalue()
+    except Exception:
+        return data
+
+
 class Interface(Transactional):
     '''
     Objects of this class represent network interface and
@@ -116,6 +153,7 @@ class Interface(Transactional):
     _fields.append('bond_mode')
     _fields.extend(_get_data_fields())
     _fields.extend(_virtual_fields)
+    _linked_sets = set(('ipaddr', 'ports', 'vlans'))
 
     def __init__(self, ipdb, mode=None, parent=None, uid=None):
         '''
@@ -143,26 +181,29 @@ class Interface(Transactional):
         self._exception = None
         self._deferred_link = None
         self._tb = None
-        self._linked_sets.add('ipaddr')
-        self._linked_sets.add('ports')
-        self._linked_sets.add('vlans')
         self._freeze = None
-        self._delay_add_port = set()
-        self._delay_del_port = set()
+        self._delay_add_port = ()
+        self._delay_del_port = ()
         # 8<-----------------------------------
         # local setup: direct state is required
         with self._direct_state:
             for i in ('change', 'mask'):
                 del self[i]
-            self['ipaddr'] = self.ipdb._ipaddr_set()
-            self['ports'] = LinkedSet()
-            self['vlans'] = LinkedSet()
+            if not self._sparse:
+                # sparse interfaces create linked sets on demand
+                for key in self._linked_sets:
+                    self[key] = self._linked_set(key)
             self['ipdb_priority'] = 0
         # 8<-----------------------------------
 
     def __hash__(self):
         return self['index']
 
+    def _linked_set(self, key):
+        if key == 'ipaddr':
+            return self.ipdb._ipaddr_set()
+        return LinkedSet()
+
     @property
     def if_master(self):
         '''
@@ -223,19 +264,19 @@ class Interface(Transactional):
             if data[key] is None:
                 continue
             if key == 'ipaddr':
-                for addr in self['ipaddr']:
+                for addr in tuple(self['ipaddr']):
                     self.del_ip(*addr)
                 for addr in data[key]:
                     if isinstance(addr, basestring):
                         addr = (addr, )
                     self.add_ip(*addr)
             elif key == 'ports':
-                for port in self['ports']:
+                for port in tuple(self['ports']):
                     self.del_port(port)
                 for port in data[key]:
                     self.add_port(port)
             elif key == 'vlans':
-                for vlan in self['vlans']:
+                for vlan in tuple(self['vlans']):
                     self.del_vlan(vlan)
                 for vlan in data[key]:
                     if vlan != 1:
@@ -291,9 +332,9 @@ class Interface(Transactional):
                 # `__getitem__()` on nla_slot triggers the
                 # NLA decoding, if the nla is referenced:
                 #
-                norm = ifinfmsg.nla2name(cell[0])
+                norm = _nla2name(cell[0])
                 if norm not in self.cleanup:
-                    self[norm] = cell[1]
+                    self._load_nla(norm, cell)
             # load interface kind
             linkinfo = dev.get_attr('IFLA_LINKINFO')
             if linkinfo is not None:
@@ -349,6 +390,9 @@ class Interface(Transactional):
 
             self['ipdb_scope'] = 'system'
 
+    def _load_nla(self, name, cell):
+        self[name] = cell[1]
+
     def wait_ip(self, *argv, **kwarg):
         return self['ipaddr'].wait_ip(*argv, **kwarg)
 
@@ -437,6 +481,8 @@ class Interface(Transactional):
         '''
         ifindex = self._resolve_port(port)
         if not ifindex:
+            if not self._delay_add_port:
+                self._delay_add_port = set()
             self._delay_add_port.add(port)
         else:
             self['ports'].unlink(ifindex)
@@ -449,6 +495,8 @@ class Interface(Transactional):
         '''
         ifindex = self._resolve_port(port)
         if not ifindex:
+            if not self._delay_del_port:
+                self._delay_del_port = set()
             self._delay_del_port.add(port)
         else:
             self['ports'].unlink(ifindex)
@@ -510,6 +558,29 @@ class Interface(Transactional):
         else:
             return self.ipdb.interfaces.get(port, {}).get('index', None)
 
+    def _sync_ipv6(self, transaction):
+        if (not self['flags'] & 1) or hasattr(self.ipdb.nl, 'netns'):
+            # 1. flush old IPv6 addresses
+            for addr in list(self['ipaddr'].ipv6):
+                self['ipaddr'].remove(addr)
+            # 2. reload addresses
+            #
+            # skip not requested tentative addresses, like
+            # link local ones on a new interface: the kernel
+            # sends no updates for them until DAD is done,
+            # so they would break the IP target
+            for addr in self.nl.get_addr(index=self['index'],
+                                         family=AF_INET6):
+                if addr['flags'] & IFA_F_TENTATIVE and \
+                        (addr.get_attr('IFA_ADDRESS'),
+                         addr['prefixlen']) not in \
+                        transaction['ipaddr']:
+                    continue
+                self.ipdb.ipaddr._new(addr)
+            # if there are tons of IPv6 addresses, it may take a
+            # really long time, and that's bad, but it's broken in
+            # the kernel :|
+
     def commit(self,
                tid=None,
                transaction=None,
@@ -663,18 +734,25 @@ class Interface(Transactional):
             for addr in self.ipdb.ipaddr[self['index']]:
                 transaction['ipaddr'].add(addr)
 
-        # now we have our index and IP set and all other stuff
-        snapshot = self.pick()
-
         # make snapshots of all dependent routes
+        #
+        # the snapshots are copy-on-write journals, that are
+        # materialised only if the rollback is required
         if commit_phase == 1 and hasattr(self.ipdb, 'routes'):
+            for route in getattr(self, 'routes', ()):
+                route[1].close()
             self.routes = []
             for record in self.ipdb.routes.filter({'oif': self['index']}):
                 # For MPLS routes the key is an integer
                 # They should match anyways
                 if getattr(record['key'], 'table', None) != 255:
-                    self.routes.append((record['route'],
-                                        record['route'].pick()))
+                    route = record['route']
+                    if not isinstance(route, Transactional):
+                        # a compact route, get the route object
+                        route = (self.ipdb.routes
+                                 .tables[record['key'].table]
+                                 [record['key']])
+                    self.routes.append((route, Journal(route)))
 
         # resolve all delayed ports
         def resolve_ports(transaction, ports, callback, self, drop):
@@ -702,6 +780,8 @@ class Interface(Transactional):
                       transaction.del_port,
                       self, drop and notx)
 
+        # now we have our index and IP set and all other stuff
+        snapshot = Journal(self)
         try:
             removed, added = snapshot // transaction
 
@@ -936,17 +1016,7 @@ class Interface(Transactional):
                 # that all is a dirtiest hack ever, pls do
                 # something with it
                 #
-                if (not self['flags'] & 1) or hasattr(self.ipdb.nl, 'netns'):
-                    # 1. flush old IPv6 addresses
-                    for addr in list(self['ipaddr'].ipv6):
-                        self['ipaddr'].remove(addr)
-                    # 2. reload addresses
-                    for addr in self.nl.get_addr(index=self['index'],
-                                                 family=AF_INET6):
-                        self.ipdb.ipaddr._new(addr)
-                    # if there are tons of IPv6 addresses, it may take a
-                    # really long time, and that's bad, but it's broken in
-                    # the kernel :|
+                self._sync_ipv6(transaction)
 
                 # 8<--------------------------------------
                 self['ipaddr'].target.wait(SYNC_TIMEOUT)
@@ -970,23 +1040,16 @@ class Interface(Transactional):
                         request[key] = added[key]
 
                 request['index'] = self['index']
-                run(nl.link, 'update', **request)
-
-                countdown = 10
-                while countdown:
-                    # wait until the interface will disappear
-                    # from the current network namespace --
-                    # up to 1 second (make it configurable?)
-                    try:
-                        self.nl.get_links(self['index'])
-                    except NetlinkError as e:
-                        if e.code == errno.ENODEV:
-                            break
-                        raise
-                    except Exception:
-                        raise
-                    countdown -= 1
-                    time.sleep(0.1)
+                wd = self.ipdb.watchdog('RTM_DELLINK', index=self['index'])
+                try:
+                    run(nl.link, 'update', **request)
+                except Exception:
+                    wd.cancel()
+                    raise
+                # wait until the interface will disappear
+                # from the current network namespace --
+                # up to 1 second (make it configurable?)
+                wd.wait(timeout=1)
 
             # 8<---------------------------------------------
             # Interface removal
@@ -1032,7 +1095,8 @@ class Interface(Transactional):
                 if newif:
                     drop = False
                 try:
-                    self.commit(transaction=init if newif else snapshot,
+                    self.commit(transaction=init if newif
+                                else snapshot.pick(),
                                 commit_phase=2,
                                 commit_mask=commit_mask,
                                 newif=newif)
@@ -1056,6 +1120,9 @@ class Interface(Transactional):
             for key in ('ipaddr', 'ports', 'vlans'):
                 self[key].clear_target()
 
+        finally:
+            snapshot.close()
+
         # raise partial commit exceptions
         if transaction.partial and transaction.errors:
             error = PartialCommitException('partial commit error')
@@ -1076,7 +1143,7 @@ class Interface(Transactional):
                 with route[0]._direct_state:
                     route[0]['ipdb_scope'] = 'restore'
                 try:
-                    route[0].commit(transaction=route[1],
+                    route[0].commit(transaction=route[1].pick(),
                                     commit_phase=2,
                                     commit_mask=2)
                 except RuntimeError as x:
@@ -1139,6 +1206,72 @@ class Interface(Transactional):
         return self
 
 
+class CompactInterface(Interface):
+    '''
+    Interface with a smaller memory footprint, used with
+    `IPDB(compact_interfaces=True)`.
+
+    Fields that are None are not stored, see `Transactional`.
+    Linked sets, like `ports`, are created on the first access.
+    Nested, struct and unknown NLAs, like `IFLA_MAP`, are kept
+    as raw bytes and decoded on every access. Such attributes
+    are not copied to transactions.
+    '''
+    _sparse = True
+    _raw = None
+
+    def __missing__(self, key):
+        if self._raw and key in self._raw:
+            return _nla_decode(self._raw[key])
+        elif key in self._linked_sets:
+            with self._write_lock:
+                if key not in self:
+                    Dotkeys.__setitem__(self, key, self._linked_set(key))
+                return dict.__getitem__(self, key)
+        return Interface.__missing__(self, key)
+
+    def __getattr__(self, key):
+        if key[:1] != '_':
+            try:
+                return self.__missing__(key)
+            except KeyError:
+                pass
+        raise AttributeError(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+        try:
+            value = self.__missing__(key)
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def _load_nla(self, name, cell):
+        raw = _nla_raw(cell)
+        if raw is None:
+            if self._raw:
+                self._raw.pop(name, None)
+            self[name] = cell[1]
+        else:
+            if self._raw is None:
+                self._raw = {}
+            self._raw[name] = raw
+            if name in self:
+                self[name] = None
+
+    def dump(self, not_none=True):
+        with self._write_lock:
+            res = Interface.dump(self, not_none)
+            for key in self._linked_sets:
+                if key not in res:
+                    res[key] = ()
+            for key in tuple(self._raw or ()):
+                if key not in res:
+                    res[key] = self.get(key)
+            return res
+
+
 class InterfacesDict(Dotkeys):
 
     def __init__(self, ipdb):
@@ -1146,15 +1279,16 @@ class InterfacesDict(Dotkeys):
         self._event_map = {'RTM_NEWLINK': self._new,
                            'RTM_DELLINK': self._del}
 
-    def _register(self):
-        links = self.ipdb.nl.get_links()
+    def _register(self, nl=None):
+        nl = nl or self.ipdb.nl
+        links = nl.get_links()
         # iterate twice to map port/master relations
         for link in links:
             self._new(link, skip_master=True)
         for link in links:
             self._new(link)
         # load bridge vlan information
-        links = self.ipdb.nl.get_vlans()
+        links = nl.get_vlans()
         for link in links:
             self._new(link)
 
@@ -1177,8 +1311,9 @@ class InterfacesDict(Dotkeys):
                     raise CreateException("interface %s exists" %
                                           ifname)
             else:
-                device = self[ifname] = Interface(ipdb=self.ipdb,
-                                                  mode='snapshot')
+                device = self[ifname] = \
+                    self.ipdb._interface_class(ipdb=self.ipdb,
+                                               mode='snapshot')
                 # delay link resolve?
                 for key in kwarg:
                     # any /.+link$/ attr
@@ -1251,7 +1386,7 @@ class InterfacesDict(Dotkeys):
             # scenario #1, new interface
             device = \
                 self[index] = \
-                self[ifname] = Interface(ipdb=self.ipdb)
+                self[ifname] = self.ipdb._interface_class(ipdb=self.ipdb)
         elif (index not in self) and (ifname in self):
             # scenario #2, index change
             old_index = self[ifname]['index']
@@ -1339,8 +1474,8 @@ class AddressesDict(dict):
         self._event_map = {'RTM_NEWADDR': self._new,
                            'RTM_DELADDR': self._del}
 
-    def _register(self):
-        for msg in self.ipdb.nl.get_addr():
+    def _register(self, nl=None):
+        for msg in (nl or self.ipdb.nl).get_addr():
             self._new(msg)
 
     def reload(self):
@@ -1397,8 +1532,8 @@ class NeighboursDict(dict):
         self._event_map = {'RTM_NEWNEIGH': self._new,
                            'RTM_DELNEIGH': self._del}
 
-    def _register(self):
-        for msg in self.ipdb.nl.get_neighbours():
+    def _register(self, nl=None):
+        for msg in (nl or self.ipdb.nl).get_neighbours():
             self._new(msg)
 
     def _new(self, msg):
@@ -8,6 +8,17 @@ from socket import AF_INET
 from socket import AF_INET6
 from pyroute2.common import basestring
 
+_empty = frozenset()
+
+
+def _check_default_target(self):
+    if self._ct is not None:
+        if set(filter(self.target_filter, self)) == \
+                set(filter(self.target_filter, self._ct)):
+            self._ct = None
+            return True
+    return False
+
 
 class LinkedSet(set):
     '''
@@ -18,27 +29,42 @@ class LinkedSet(set):
     Target filter is a function, that returns `True` if a set
     member should be counted in target checks (target methods
     see below), or `False` if it should be ignored.
+
+    Most of the sets are never used in transactions, so the
+    default target event is created on the first access, and
+    the set of excluded keys -- on the first `unlink()`. Links
+    and journals are tuples, replaced on every change.
     '''
+    __slots__ = ('lock',
+                 '_target',
+                 'targets',
+                 '_ct',
+                 'raw',
+                 'links',
+                 'journals',
+                 'exclusive')
+
     def target_filter(self, x):
         return True
 
     def __init__(self, *argv, **kwarg):
         set.__init__(self, *argv, **kwarg)
-
-        def _check_default_target(self):
-            if self._ct is not None:
-                if set(filter(self.target_filter, self)) == \
-                        set(filter(self.target_filter, self._ct)):
-                    self._ct = None
-                    return True
-            return False
         self.lock = threading.RLock()
-        self.target = threading.Event()
-        self.targets = {self.target: _check_default_target}
+        self._target = None
+        self.targets = {}
         self._ct = None
         self.raw = OrderedDict()
-        self.links = []
-        self.exclusive = set()
+        self.links = ()
+        self.journals = ()
+        self.exclusive = _empty
+
+    @property
+    def target(self):
+        with self.lock:
+            if self._target is None:
+                self._target = threading.Event()
+                self.targets[self._target] = _check_default_target
+            return self._target
 
     def __getitem__(self, key):
         return self.raw[key]
@@ -103,15 +129,20 @@ class LinkedSet(set):
         to store RTM_NEWADDR RTNL messages along with
         human-readable ip addr representation.
         '''
+        journals = ()
         with self.lock:
             if cascade and (key in self.exclusive):
                 return
             if key not in self:
                 self.raw[key] = raw
                 super(LinkedSet, self).add(key)
+                journals = self.journals
+                for journal in journals:
+                    journal.add(key)
                 for link in self.links:
                     link.add(key, raw, cascade=True)
             self.check_target()
+        self.journals_changed(journals)
 
     def remove(self, key, raw=None, cascade=False):
         '''
@@ -122,17 +153,24 @@ class LinkedSet(set):
             if cascade and (key in self.exclusive):
                 return
             super(LinkedSet, self).remove(key)
-            self.raw.pop(key, None)
+            raw = self.raw.pop(key, None)
+            journals = self.journals
+            for journal in journals:
+                journal.remove(key, raw)
             for link in self.links:
                 if key in link:
                     link.remove(key, cascade=True)
             self.check_target()
+        self.journals_changed(journals)
 
     def unlink(self, key):
         '''
         Exclude key from cascade updates.
         '''
-        self.exclusive.add(key)
+        with self.lock:
+            if self.exclusive is _empty:
+                self.exclusive = set()
+            self.exclusive.add(key)
 
     def relink(self, key):
         '''
@@ -147,15 +185,74 @@ class LinkedSet(set):
         '''
         if not isinstance(link, LinkedSet):
             raise TypeError()
-        self.links.append(link)
+        with self.lock:
+            self.links += (link, )
 
     def disconnect(self, link):
-        self.links.remove(link)
+        with self.lock:
+            links = list(self.links)
+            links.remove(link)
+            self.links = tuple(links)
+
+    def add_journal(self, journal):
+        with self.lock:
+            self.journals += (journal, )
+
+    def remove_journal(self, journal):
+        with self.lock:
+            self.journals = tuple(x for x in self.journals
+                                  if x is not journal)
+
+    def journals_changed(self, journals):
+        # out of the set lock: the snapshot journal takes the
+        # object lock, see `Journal.changed()`
+        for journal in journals:
+            if journal.snapshot is not None:
+                journal.snapshot.changed()
 
     def __repr__(self):
         return repr(tuple(self))
 
 
+class LinkedSetJournal(object):
+    '''
+    Changes of a `LinkedSet` since the journal is attached, used
+    by copy-on-write snapshots. Only the delta is recorded, the
+    set itself is not copied.
+    '''
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.added = set()
+        self.removed = {}
+
+    def add(self, key):
+        if key in self.removed:
+            del self.removed[key]
+        else:
+            self.added.add(key)
+
+    def remove(self, key, raw=None):
+        if key in self.added:
+            self.added.remove(key)
+        else:
+            self.removed[key] = raw
+
+    def revert(self, current):
+        '''
+        Return the set state before the recorded changes. If
+        there are no changes, return the set itself.
+        '''
+        if not (self.added or self.removed):
+            return current
+        ret = type(current)(current)
+        for key in self.added:
+            if key in ret:
+                ret.remove(key)
+        for (key, raw) in self.removed.items():
+            ret.add(key, raw=raw)
+        return ret
+
+
 class IPaddrSet(LinkedSet):
     '''
     LinkedSet child class with different target filter. The
@@ -166,6 +263,8 @@ class IPaddrSet(LinkedSet):
     IPv6 addresses, but it may be changed with the `ignore_link_local`
     argument.
     '''
+    __slots__ = ()
+
     @property
     def ipv4(self):
         ret = IPaddrSet()
@@ -234,6 +333,8 @@ class IPaddrSet(LinkedSet):
 
 
 class SortedIPaddrSet(IPaddrSet):
+    __slots__ = ()
+
     def __init__(self, *argv, **kwarg):
         super(SortedIPaddrSet, self).__init__(*argv, **kwarg)
         if argv and isinstance(argv[0], SortedIPaddrSet):
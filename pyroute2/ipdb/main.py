@@ -77,6 +77,95 @@ fixed, so a new module was started, NDB, that aims to replace
 IPDB, but it isn't yet production ready. IPDB is still more
 feature rich and in some sense more stable.
 
+On hosts with big routing tables use the compact route storage::
+
+    ipdb = IPDB(compact_routes=True)
+
+In this mode routes loaded from the kernel are stored as packed
+records, not as transactional objects. Iteration, `filter()` and
+`lookup()` return them as read-only `CompactRoute` snapshots,
+while `ipdb.routes[...]` turns the route into a normal `Route`
+object, that can be changed. Routes with multipath, encap or MPLS
+attributes are always stored as `Route` objects.
+
+On hosts with thousands of interfaces, e.g. container hosts with
+veth pairs, use the compact interfaces::
+
+    ipdb = IPDB(compact_interfaces=True)
+
+Compact interfaces do not store the fields that are None, so a
+missing field reads as None, but `'master' in interface` is False
+while the interface has no master. Nested and unknown attributes,
+like `map`, are kept as raw bytes, decoded on access and are not
+copied to transactions. In any mode the thread local transaction
+state is created on the first transaction, but every interface
+still has its own write lock, and every linked set, like `ipaddr`
+or `ports`, its own lock. The footprint can be measured with
+`benchmark/ipdb-memory.py`.
+
+Startup time
+------------
+
+By default IPDB loads every section, like interfaces or routes,
+on the first access to it. With a full routing table the first
+access to `ipdb.routes` may take minutes. The progressive mode
+starts loading all the sections at once, every one in its own
+thread with its own netlink socket::
+
+    ipdb = IPDB(progressive=True)
+    # interfaces are loaded, routes may be still loading
+    ipdb.interfaces.ready.wait()
+    ...
+    ipdb.routes.ready.wait()
+
+Events that arrive while a section is being loaded are buffered
+and applied after the dump. Every section has the `ready` event,
+that is set once the section is loaded, in any mode. If the dump
+fails, `ready` is set anyway, and the section `error` attribute
+keeps the exception::
+
+    ipdb.routes.ready.wait()
+    if ipdb.routes.error is not None:
+        ...
+
+Batched commit
+--------------
+
+`ipdb.commit()` without arguments commits all the pending
+transactions one by one, waiting for every netlink response.
+With hundreds of changes use the batched mode::
+
+    for x in range(100):
+        (ipdb
+         .create(ifname='bv%i' % x, kind='veth', peer='bp%i' % x)
+         .add_ip('10.%i.0.1/24' % x)
+         .up())
+    ipdb.commit(batch=True)
+
+All the requests are sent in a few netlink pipelines: new
+interfaces first, then interface changes and addresses, then
+routes. If any request fails, all the changes are reverted.
+Transactions with ports, bond or bridge options, netns moves,
+interface removal or multipath routes can not be batched; if
+there is any, `commit()` falls back to the regular mode.
+
+Events coalescing
+-----------------
+
+During link flaps or routing reconvergence the same object may
+change many times per second. To deliver to the post-callbacks
+and to the event queues only the latest state of every object,
+enable coalescing per event class::
+
+    # collect route updates for 0.5 seconds; links and neighbours
+    # -- while there are events in the queue
+    ipdb = IPDB(coalesce={'route': 0.5, 'link': 0, 'neigh': 0})
+
+Event classes: `link`, `addr`, `neigh` and `route`. The number of
+suppressed events is reported by `ipdb.callback_stats()` and by the
+`suppressed` attribute of the event queue. IPDB itself still
+processes all the events.
+
 IPDB and other software
 -----------------------
 
@@ -500,6 +589,16 @@ all the routes matching the spec::
     # get all IPv6 routes from some table
     ipdb.routes.table[tnum].filter({'family': AF_INET6})
 
+Filters on `dst`, `oif`, `gateway`, `proto`, `table` and `family`
+use hash indexes. To find the route to an address, use the longest
+prefix match lookup::
+
+    # the route, that the main table uses for 10.0.0.1
+    ipdb.routes.lookup('10.0.0.1')
+
+    # the same for some other table
+    ipdb.routes.lookup('10.0.0.1', table=100)
+
 Route metrics
 ~~~~~~~~~~~~~
 
@@ -712,6 +811,7 @@ The class API
 -------------
 '''
 import sys
+import time
 import atexit
 import logging
 import traceback
@@ -723,6 +823,7 @@ except ImportError:
     import Queue as queue  # The module is called 'Queue' in Python2
 
 from functools import partial
+from itertools import product
 from pprint import pprint
 from pyroute2 import config
 from pyroute2.common import uuid32
@@ -730,9 +831,12 @@ from pyroute2.common import basestring
 from pyroute2.iproute import IPRoute
 from pyroute2.netlink.rtnl import RTM_GETLINK, RTMGRP_DEFAULTS
 from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.coalesce import Coalescer
+from pyroute2.netlink.nlsocket import CallbackIndex
 from pyroute2.ipdb import rules
 from pyroute2.ipdb import routes
 from pyroute2.ipdb import interfaces
+from pyroute2.ipdb.batch import BatchCommit
 from pyroute2.ipdb.routes import BaseRoute
 from pyroute2.ipdb.exceptions import ShutdownException
 from pyroute2.ipdb.transactional import SYNC_TIMEOUT
@@ -743,26 +847,42 @@ from pyroute2.ipdb.utils import test_reachable_icmp
 log = logging.getLogger(__name__)
 
 
+def _freeze(value):
+    # make a hashable key from a field value, like a list of MPLS
+    # labels, so it can be used in the watchdogs table
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
 class Watchdog(object):
+    '''
+    Wait for an event with the given fields, e.g.::
+
+        wd = ipdb.watchdog('RTM_DELLINK', ifname='eth0')
+        ...
+        wd.wait()
+
+    A field matches if either the message header field or the
+    NLA with the same name is equal to the value. Watchdogs are
+    kept in a table keyed by the event, field names and values,
+    so the message wakes only the watchdogs that wait for it.
+    '''
     def __init__(self, ipdb, action, kwarg):
         self.event = threading.Event()
         self.is_set = False
         self.ipdb = ipdb
+        self.action = action
+        self.fields = tuple(sorted(kwarg))
+        self.key = tuple(_freeze(kwarg[x]) for x in self.fields)
+        # register the watchdog prior to other things
+        self.ipdb._wd_register(self)
 
-        def cb(ipdb, msg, _action):
-            if _action != action:
-                return
-
-            for key in kwarg:
-                if (msg.get(key, None) != kwarg[key]) and \
-                        (msg.get_attr(msg.name2nla(key)) != kwarg[key]):
-                    return
-
-            self.is_set = True
-            self.event.set()
-        self.cb = cb
-        # register callback prior to other things
-        self.uuid = self.ipdb.register_callback(self.cb)
+    def set(self):
+        self.is_set = True
+        self.event.set()
 
     def wait(self, timeout=SYNC_TIMEOUT):
         ret = self.event.wait(timeout=timeout)
@@ -770,7 +890,74 @@ class Watchdog(object):
         return ret
 
     def cancel(self):
-        self.ipdb.unregister_callback(self.uuid)
+        self.ipdb._wd_unregister(self)
+
+
+class CallbackPool(object):
+    '''
+    Run post-callbacks in a pool of threads. Messages are
+    sharded by the object key: the interface index, the route
+    destination etc. Thus all the events of one object are
+    processed by one worker in the order of arrival, while
+    events of different objects are processed in parallel.
+    '''
+    def __init__(self, ipdb, workers, qsize=8192):
+        self.ipdb = ipdb
+        self.queues = [queue.Queue(maxsize=qsize) for _ in range(workers)]
+        self.locks = [threading.RLock() for _ in range(workers)]
+        self.threads = []
+        for worker in range(workers):
+            t = threading.Thread(target=self._serve,
+                                 args=(worker, ),
+                                 name='IPDB cb worker %i' % worker)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    @staticmethod
+    def key(msg):
+        event = msg.get('event')
+        if event in ('RTM_NEWLINK', 'RTM_DELLINK',
+                     'RTM_NEWADDR', 'RTM_DELADDR'):
+            return msg.get('index')
+        elif event in ('RTM_NEWNEIGH', 'RTM_DELNEIGH'):
+            return msg.get('ifindex')
+        elif event in ('RTM_NEWROUTE', 'RTM_DELROUTE'):
+            return (msg.get('family'),
+                    msg.get_attr('RTA_TABLE', msg.get('table')),
+                    _freeze(msg.get_attr('RTA_DST')),
+                    msg.get('dst_len'))
+        return event
+
+    def put(self, msg):
+        self.queues[hash(self.key(msg)) % len(self.queues)].put(msg)
+
+    def _serve(self, worker):
+        while True:
+            msg = self.queues[worker].get()
+            if msg is None:
+                return
+            with self.locks[worker]:
+                self.ipdb._run_callbacks(msg, concurrent=True)
+
+    def sync(self):
+        # wait until every worker is done with the current message
+        #
+        # a worker holds its lock while running callbacks, so it
+        # must not wait for the others: two callbacks unregistering
+        # themselves on different workers would deadlock
+        if threading.current_thread() in self.threads:
+            return
+        for lock in self.locks:
+            with lock:
+                pass
+
+    def depth(self):
+        return [x.qsize() for x in self.queues]
+
+    def stop(self):
+        for x in self.queues:
+            x.put(None)
 
 
 class _evq_context(object):
@@ -782,6 +969,17 @@ class _evq_context(object):
         self._qsize = qsize
         self._block = block
         self._timeout = timeout
+        self._pending = []
+        self._coalescer = None
+        if ipdb._coalesce:
+            self._coalescer = Coalescer(ipdb._coalesce)
+
+    @property
+    def suppressed(self):
+        # coalesced events counters
+        if self._coalescer is None:
+            return {}
+        return self._coalescer.suppressed
 
     def __enter__(self):
         # Context manager protocol
@@ -809,8 +1007,17 @@ class _evq_context(object):
 
     def __next__(self):
         # Iterator protocol -- Python 3.x
-        msg = self._ipdb._evq.get(self._block, self._timeout)
-        self._ipdb._evq.task_done()
+        if not self._pending:
+            evq = self._ipdb._evq
+            msg = evq.get(self._block, self._timeout)
+            evq.task_done()
+            if self._coalescer is None:
+                self._pending = [msg]
+            else:
+                batch = self._coalescer.drain(evq, msg)
+                self._pending = [x[1] for x in self._coalescer
+                                 .collapse([(None, x) for x in batch])]
+        msg = self._pending.pop(0)
         if isinstance(msg, Exception):
             raise msg
         return msg
@@ -828,7 +1035,9 @@ class IPDB(object):
                  sndbuf=1048576, rcvbuf=1048576,
                  nl_bind_groups=RTMGRP_DEFAULTS,
                  ignore_rtables=None, callbacks=None,
-                 sort_addresses=False, plugins=None):
+                 sort_addresses=False, plugins=None,
+                 compact_routes=False, progressive=False,
+                 cb_workers=0, coalesce=None, compact_interfaces=False):
         plugins = plugins or ['interfaces', 'routes', 'rules']
         pmap = {'interfaces': interfaces,
                 'routes': routes,
@@ -837,6 +1046,13 @@ class IPDB(object):
         self.txdrop = False
         self._stdout = sys.stdout
         self._ipaddr_set = SortedIPaddrSet if sort_addresses else IPaddrSet
+        self._compact_routes = compact_routes
+        if compact_interfaces:
+            self._interface_class = interfaces.CompactInterface
+        else:
+            self._interface_class = interfaces.Interface
+        self._progressive = progressive
+        self._generation = 0
         self._event_map = {}
         self._deferred = {}
         self._ensure = []
@@ -860,11 +1076,28 @@ class IPDB(object):
         # see also 'register_callback'
         self._post_callbacks = {}
         self._pre_callbacks = {}
+        # callbacks registered by the event and fields
+        self._post_index = CallbackIndex()
+        self._pre_index = CallbackIndex()
+        # callback uuid -> [calls, total time, max time]
+        self._cb_stats = {}
+        self._cb_stats_lock = threading.Lock()
+        self._cb_pool = None
+        if cb_workers:
+            self._cb_pool = CallbackPool(self, cb_workers)
+        # see also 'Events coalescing'
+        self._coalesce = coalesce
+        self._cb_coalescer = Coalescer(coalesce) if coalesce else None
+        # see also 'watchdog':
+        # event -> field names -> field values -> [watchdog, ...]
+        self._watchdogs = {}
+        self._wd_lock = threading.Lock()
 
         # local event queues
         # - callbacks event queue
         self._cbq = queue.Queue(maxsize=8192)
         self._cbq_drop = 0
+        self._cbq_dropped = 0
         # - users event queue
         self._evq = None
         self._evq_lock = threading.Lock()
@@ -990,6 +1223,13 @@ class IPDB(object):
                         delattr(self, plugin['name'])
                         self._loaded.remove(plugin['name'])
 
+            # start loading all the sections in background
+            self._generation += 1
+            if self._progressive:
+                for module in self._plugins:
+                    if module.spec[0]['name'] in self._deferred:
+                        self._load_progressive(module.spec)
+
             # start service threads
             for tspec in (('_mthread', '_serve_main', 'IPDB main event loop'),
                           ('_cthread', '_serve_cb', 'IPDB cb event loop')):
@@ -1004,25 +1244,98 @@ class IPDB(object):
     def __getattribute__(self, name):
         deferred = super(IPDB, self).__getattribute__('_deferred')
         if name in deferred:
-            register = []
-            spec = deferred[name]
-            for plugin in spec:
-                obj = plugin['class'](self, **plugin['kwarg'])
-                setattr(self, plugin['name'], obj)
-                register.append(obj)
-                self._loaded.add(plugin['name'])
-                del deferred[plugin['name']]
-            for obj in register:
+            for obj in self._create_plugins(deferred[name]):
                 if hasattr(obj, '_register'):
                     obj._register()
-                if hasattr(obj, '_event_map'):
-                    for event in obj._event_map:
-                        if event not in self._event_map:
-                            self._event_map[event] = []
-                        self._event_map[event].append(obj._event_map[event])
+                self._register_events(obj)
+                obj.ready.set()
         return super(IPDB, self).__getattribute__(name)
 
-    def register_callback(self, callback, mode='post'):
+    def _create_plugins(self, spec):
+        ret = []
+        for plugin in spec:
+            obj = plugin['class'](self, **plugin['kwarg'])
+            obj.ready = threading.Event()
+            obj.error = None
+            setattr(self, plugin['name'], obj)
+            ret.append(obj)
+            self._loaded.add(plugin['name'])
+            del self._deferred[plugin['name']]
+        return ret
+
+    def _register_events(self, obj):
+        for event in getattr(obj, '_event_map', {}):
+            if event not in self._event_map:
+                self._event_map[event] = []
+            self._event_map[event].append(obj._event_map[event])
+
+    def _load_progressive(self, spec):
+        ###
+        # Load the section in a separate thread with its own
+        # socket. Until the dump is done, the section events
+        # are buffered, and applied after the dump.
+        ###
+        buf = []
+        with self.exclusive:
+            generation = self._generation
+            register = self._create_plugins(spec)
+            events = set()
+            for obj in register:
+                events.update(getattr(obj, '_event_map', {}))
+            for event in events:
+                if event not in self._event_map:
+                    self._event_map[event] = []
+                self._event_map[event].append(buf.append)
+
+        def load():
+            error = None
+            nl = None
+            try:
+                nl = self.nl.clone()
+                for obj in register:
+                    if hasattr(obj, '_register'):
+                        obj._register(nl)
+            except Exception as e:
+                error = e
+            finally:
+                if nl is not None:
+                    nl.close()
+            try:
+                with self.exclusive:
+                    if generation != self._generation or self._stop:
+                        return
+                    if error is not None:
+                        log.error('failed to load %s: %s',
+                                  spec[0]['name'], error)
+                    for event in events:
+                        self._event_map[event].remove(buf.append)
+                    for obj in register:
+                        self._register_events(obj)
+                    for msg in buf:
+                        for obj in register:
+                            func = (getattr(obj, '_event_map', {})
+                                    .get(msg['event']))
+                            if func is not None:
+                                func(msg)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                #
+                # never leave the waiters hanging, the error is
+                # available as the section `error` attribute
+                #
+                for obj in register:
+                    obj.error = error
+                    obj.ready.set()
+
+        t = threading.Thread(target=load,
+                             name='IPDB %s loader' % spec[0]['name'])
+        t.setDaemon(True)
+        t.start()
+
+    def register_callback(self, callback, mode='post',
+                          event=None, **fields):
         '''
         IPDB callbacks are routines executed on a RT netlink
         message arrival. There are two types of callbacks:
@@ -1042,6 +1355,18 @@ class IPDB(object):
         occasionally, so for a short time there can exist
         stopped threads.
 
+        By default all the "post" callbacks run in one thread,
+        message by message, so one slow callback delays all
+        the rest. With `IPDB(cb_workers=N)` they run in a pool
+        of N threads. All the events of one object, e.g. of one
+        interface or one route, are processed by the same worker
+        in the order of arrival, but events of different objects
+        are processed in parallel, so in this mode callbacks must
+        be thread safe. `unregister_callback()` waits for the
+        workers to finish the callback, unless it is called from a
+        callback: then other workers may still be running it.
+        Latency and queue depth are reported by `callback_stats()`.
+
         ...
 
         "Pre" callbacks are synchronous routines, executed
@@ -1077,6 +1402,16 @@ class IPDB(object):
 
             index = msg['index']
             interface = ipdb.interfaces[index]
+
+        Every callback is called for every message. With many
+        callbacks it is cheaper to register them by the event
+        and, optionally, by the key fields, like `index`, `table`
+        or `family`. A field matches if either the message field
+        or the NLA with the same name is equal to the value. Such
+        callbacks are looked up in an index and called only for
+        the matching messages::
+
+            ipdb.register_callback(cb, event='RTM_NEWLINK', index=2)
         '''
         lock = threading.Lock()
 
@@ -1087,27 +1422,81 @@ class IPDB(object):
         safe.hook = callback
         safe.lock = lock
         safe.uuid = uuid32()
+        safe.registered = True
 
         if mode == 'post':
-            self._post_callbacks[safe.uuid] = safe
+            cbchain = self._post_callbacks
+            cbindex = self._post_index
         elif mode == 'pre':
-            self._pre_callbacks[safe.uuid] = safe
+            cbchain = self._pre_callbacks
+            cbindex = self._pre_index
         else:
             raise KeyError('Unknown callback mode')
+        if event is None:
+            cbchain[safe.uuid] = safe
+        else:
+            cbindex.add(event, fields, safe)
         return safe.uuid
 
     def unregister_callback(self, cuid, mode='post'):
         if mode == 'post':
             cbchain = self._post_callbacks
+            cbindex = self._post_index
         elif mode == 'pre':
             cbchain = self._pre_callbacks
+            cbindex = self._pre_index
         else:
             raise KeyError('Unknown callback mode')
-        safe = cbchain[cuid]
-        with safe.lock:
-            ret = cbchain.pop(cuid)
+        if cuid in cbchain:
+            safe = cbchain[cuid]
+            with safe.lock:
+                ret = cbchain.pop(cuid)
+        else:
+            ret = cbindex.remove(lambda x: x.uuid == cuid)
+            if ret is None:
+                raise KeyError(cuid)
+            # wait for the running callback, if any
+            with ret.lock:
+                pass
+        with self._cb_stats_lock:
+            # the workers skip the callback from now on, and
+            # a running callback must not restore the stats
+            ret.registered = False
+        if mode == 'post' and self._cb_pool is not None:
+            # pool workers do not use the callback lock; called
+            # from a callback, this doesn't wait for other workers
+            self._cb_pool.sync()
+        with self._cb_stats_lock:
+            self._cb_stats.pop(cuid, None)
         return ret
 
+    def callback_stats(self):
+        '''
+        Return the post-callbacks statistics::
+
+            {'queue': 0,         # messages in the callbacks queue
+             'dropped': 0,       # dropped on the queue overflow
+             'suppressed': {},   # coalesced, per event class
+             'workers': [0, 0],  # messages in the worker queues
+             'callbacks': {cuid: {'calls': 10,
+                                  'time': 0.1,   # total, seconds
+                                  'max': 0.05}}}
+        '''
+        with self._cb_stats_lock:
+            callbacks = dict([(x[0], {'calls': x[1][0],
+                                      'time': x[1][1],
+                                      'max': x[1][2]})
+                              for x in self._cb_stats.items()])
+        if self._cb_coalescer is not None:
+            suppressed = dict(self._cb_coalescer.suppressed)
+        else:
+            suppressed = {}
+        return {'queue': self._cbq.qsize(),
+                'dropped': self._cbq_dropped,
+                'suppressed': suppressed,
+                'workers': self._cb_pool.depth() if self._cb_pool else [],
+                'callbacks': callbacks}
+
     def eventqueue(self, qsize=8192, block=True, timeout=None):
         '''
         Initializes event queue and returns event queue context manager.
@@ -1278,7 +1667,7 @@ class IPDB(object):
         if not ok:
             raise TypeError('no transaction started')
 
-    def commit(self, transactions=None, phase=1):
+    def commit(self, transactions=None, phase=1, batch=False):
         # what to commit: either from transactions argument, or from
         # started transactions on existing objects
         if transactions is None:
@@ -1342,6 +1731,16 @@ class IPDB(object):
         # 5. routes
         transactions = tx_ipdb_prio + tx_main + tx_prio1 + tx_prio2 + tx_prio3
 
+        if batch and phase == 1:
+            pipeline = BatchCommit(self, transactions)
+            if pipeline.eligible():
+                try:
+                    pipeline.run()
+                finally:
+                    for (target, tx) in transactions:
+                        target.drop(tx.uid)
+                return self
+
         try:
             for (target, tx) in transactions:
                 if target['ipdb_scope'] == 'detached':
@@ -1383,6 +1782,47 @@ class IPDB(object):
     def watchdog(self, wdops='RTM_NEWLINK', **kwarg):
         return Watchdog(self, wdops, kwarg)
 
+    def _wd_register(self, wd):
+        with self._wd_lock:
+            (self._watchdogs
+             .setdefault(wd.action, {})
+             .setdefault(wd.fields, {})
+             .setdefault(wd.key, [])
+             .append(wd))
+
+    def _wd_unregister(self, wd):
+        with self._wd_lock:
+            fields = self._watchdogs.get(wd.action, {})
+            keys = fields.get(wd.fields, {})
+            wds = keys.get(wd.key, [])
+            if wd in wds:
+                wds.remove(wd)
+            if not wds:
+                keys.pop(wd.key, None)
+            if not keys:
+                fields.pop(wd.fields, None)
+            if not fields:
+                self._watchdogs.pop(wd.action, None)
+
+    def _wd_check(self, msg):
+        # wake up the watchdogs waiting for the message; the cost
+        # depends on the number of distinct field sets, not on the
+        # number of watchdogs
+        with self._wd_lock:
+            fields = self._watchdogs.get(msg.get('event', None))
+            if not fields:
+                return
+            for (names, keys) in fields.items():
+                values = []
+                for name in names:
+                    candidates = set((_freeze(msg.get(name, None)), ))
+                    candidates.add(_freeze(msg
+                                           .get_attr(msg.name2nla(name))))
+                    values.append(candidates)
+                for key in product(*values):
+                    for wd in keys.get(key, ()):
+                        wd.set()
+
     def _serve_cb(self):
         ###
         # Callbacks thread working on a dedicated event queue.
@@ -1391,15 +1831,48 @@ class IPDB(object):
         while not self._stop:
             msg = self._cbq.get()
             self._cbq.task_done()
-            if isinstance(msg, ShutdownException):
-                return
-            elif isinstance(msg, Exception):
-                raise msg
-            for cb in tuple(self._post_callbacks.values()):
-                try:
+            if self._cb_coalescer is None:
+                batch = [msg]
+            else:
+                batch = self._cb_coalescer.drain(self._cbq, msg)
+                batch = [x[1] for x in self._cb_coalescer
+                         .collapse([(None, x) for x in batch])]
+            for msg in batch:
+                if isinstance(msg, ShutdownException):
+                    if self._cb_pool is not None:
+                        self._cb_pool.stop()
+                    return
+                elif isinstance(msg, Exception):
+                    raise msg
+                if self._cb_pool is not None:
+                    self._cb_pool.put(msg)
+                else:
+                    self._run_callbacks(msg)
+
+    def _run_callbacks(self, msg, concurrent=False):
+        callbacks = tuple(self._post_callbacks.values())
+        if self._post_index:
+            callbacks += tuple(self._post_index.lookup(msg.get('event'),
+                                                       msg))
+        for cb in callbacks:
+            if not cb.registered:
+                continue
+            started = time.time()
+            try:
+                if concurrent:
+                    cb.hook(self, msg, msg['event'])
+                else:
                     cb(self, msg, msg['event'])
-                except:
-                    pass
+            except:
+                pass
+            spent = time.time() - started
+            with self._cb_stats_lock:
+                if not cb.registered:
+                    continue
+                stats = self._cb_stats.setdefault(cb.uuid, [0, 0, 0])
+                stats[0] += 1
+                stats[1] += spent
+                stats[2] = max(stats[2], spent)
 
     def _serve_main(self):
         ###
@@ -1442,7 +1915,11 @@ class IPDB(object):
             for msg in messages:
                 # Run pre-callbacks
                 # NOTE: pre-callbacks are synchronous
-                for (cuid, cb) in tuple(self._pre_callbacks.items()):
+                callbacks = tuple(self._pre_callbacks.values())
+                if self._pre_index:
+                    callbacks += tuple(self._pre_index
+                                       .lookup(msg.get('event'), msg))
+                for cb in callbacks:
                     try:
                         cb(self, msg, msg['event'])
                     except:
@@ -1454,6 +1931,10 @@ class IPDB(object):
                         for func in self._event_map[event]:
                             func(msg)
 
+                    # Watchdogs
+                    if self._watchdogs:
+                        self._wd_check(msg)
+
                     # Post-callbacks
                     try:
                         self._cbq.put_nowait(msg)
@@ -1463,6 +1944,7 @@ class IPDB(object):
                             self._cbq_drop = 0
                     except queue.Full:
                         self._cbq_drop += 1
+                        self._cbq_dropped += 1
                     except Exception:
                         log.error('Emergency shutdown, cleanup manually')
                         raise RuntimeError('Emergency shutdown')
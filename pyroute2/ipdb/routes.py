@@ -4,13 +4,17 @@ import struct
 import logging
 import traceback
 import threading
+from array import array
+from binascii import hexlify
 from collections import namedtuple
 from socket import AF_UNSPEC
 from socket import AF_INET6
 from socket import AF_INET
 from socket import inet_pton
 from socket import inet_ntop
+from socket import error as socket_error
 from pyroute2.common import AF_MPLS
+from pyroute2.common import Dotkeys
 from pyroute2.common import basestring
 from pyroute2.netlink import rtnl
 from pyroute2.netlink import nlmsg
@@ -92,6 +96,9 @@ class NextHopSet(LinkedSet):
         skey = key[:req] + (None, ) * (len(fields) - req)
         if skey in self.raw:
             del self.raw[skey]
+        # a key with the raw next hop, e.g. on revert
+        if isinstance(prime, tuple) and raw is not None:
+            prime = raw
         return super(NextHopSet, self).add(key, raw=prime)
 
     def remove(self, prime, raw=None, cascade=False):
@@ -165,6 +172,28 @@ MPLSNHKey = namedtuple('MPLSNHKey',
 MPLSNHKey._required = 2
 
 
+def _ipnet(family, dst):
+    '''
+    Convert the route dst into `(dst_len, prefix)` for the LPM index,
+    where prefix is an int of dst_len most significant bits. Return
+    None, if dst is not an IP network.
+    '''
+    if dst == 'default':
+        return (0, 0)
+    if not isinstance(dst, basestring):
+        return None
+    addr, _, mask = dst.partition('/')
+    try:
+        raw = inet_pton(family, addr)
+        bits = len(raw) * 8
+        dst_len = int(mask) if mask else bits
+    except (socket_error, ValueError, TypeError):
+        return None
+    if not 0 <= dst_len <= bits:
+        return None
+    return (dst_len, int(hexlify(raw), 16) >> (bits - dst_len))
+
+
 def _normalize_ipaddr(x, y):
     if isinstance(y, basestring) and y.find(':') > -1:
         y = inet_ntop(AF_INET6, inet_pton(AF_INET6, y))
@@ -448,6 +477,9 @@ class BaseRoute(Transactional):
             devop = 'add'
 
         # work on an existing route
+        #
+        # a full copy, not a `Journal`: it is small, it is the
+        # rollback transaction and keeps the nested metrics
         snapshot = self.pick()
         added, removed = transaction // snapshot
         added.pop('ipdb_scope', None)
@@ -490,21 +522,15 @@ class BaseRoute(Transactional):
                 if old_key != new_key:
                     # assume we can not move routes between tables (yet ;)
                     if self['family'] == AF_MPLS:
-                        route_index = self.ipdb.routes.tables['mpls'].idx
+                        rtable = self.ipdb.routes.tables['mpls']
                     else:
-                        route_index = (self.ipdb
-                                       .routes
-                                       .tables[self['table'] or 254]
-                                       .idx)
+                        rtable = (self.ipdb
+                                  .routes
+                                  .tables[self['table'] or 254])
                     # re-link the route record
-                    if new_key in route_index:
+                    if new_key in rtable.idx:
                         raise CommitException('route idx conflict')
-                    else:
-                        route_index[new_key] = {'key': new_key,
-                                                'route': self}
-                    # wipe the old key, if needed
-                    if old_key in route_index:
-                        del route_index[old_key]
+                    rtable.relink(old_key, new_key, self)
                 self.nl.route(devop, **transaction)
                 # delete old record, if required
                 if (old_key != new_key) and (devop == 'set'):
@@ -847,24 +873,393 @@ class MPLSRoute(BaseRoute):
             return ret
 
 
+class CompactRoute(Dotkeys):
+    '''
+    Read-only snapshot of a route from `RouteStore`. To change
+    the route, get it as `ipdb.routes[...]`.
+    '''
+
+    @property
+    def local_tx(self):
+        return {}
+
+    def review(self):
+        raise TypeError('no transaction started')
+
+    def drop(self, *argv, **kwarg):
+        raise TypeError('no transaction started')
+
+
+class RouteStore(object):
+    '''
+    Compact column storage for routes loaded from the kernel.
+
+    Every route takes one slot in the columns. Integer fields are
+    packed into `array('q')`, gateways and all the other attributes
+    are interned, so routes via the same gateway share one object.
+    The interned values are refcounted and dropped with the last
+    route that uses them.
+    '''
+    int_fields = ('family', 'dst_len', 'src_len', 'tos', 'table',
+                  'proto', 'scope', 'type', 'flags', 'oif', 'priority')
+    str_fields = ('dst', 'src', 'gateway', 'prefsrc', 'extra')
+    # routes with these attributes are not stored
+    skip_fields = ('multipath', 'encap', 'encap_type', 'via', 'newdst')
+    route_fields = frozenset(BaseRoute._fields)
+    none = -(1 << 63)
+
+    def __init__(self):
+        self.columns = {}
+        for field in self.int_fields:
+            self.columns[field] = array('q')
+        for field in self.str_fields:
+            self.columns[field] = []
+        self.interned = {}  # value -> [value, refcount]
+        self.gctime = {}
+        self.free = []
+
+    def __len__(self):
+        return len(self.columns['family']) - len(self.free)
+
+    def parse(self, msg):
+        '''
+        Get route fields from a rtmsg. Return None, if the route
+        can not be stored in the compact form.
+        '''
+        family = msg.get('family')
+        if family not in (AF_INET, AF_INET6):
+            return None
+        # IPv6 multipath notifications, see BaseRoute.load_netlink()
+        if family == AF_INET6 and \
+                msg.get('header', {}).get('flags', 0) == NLM_F_CREATE:
+            return None
+        ret = dict([(x[0], msg.get(x[0])) for x in rtmsg.fields])
+        extra = []
+        for cell in msg['attrs']:
+            norm = rtmsg.nla2name(cell[0])
+            if norm in self.skip_fields:
+                return None
+            if norm in BaseRoute.cleanup:
+                continue
+            value = cell[1]
+            if norm == 'metrics':
+                value = tuple([(rtmsg.metrics.nla2name(x[0]), x[1])
+                               for x in value['attrs']])
+            if norm in self.columns:
+                ret[norm] = value
+            else:
+                extra.append((norm, value))
+        if msg.get_attr('RTA_DST'):
+            ret['dst'] = '%s/%s' % (msg.get_attr('RTA_DST'), msg['dst_len'])
+        else:
+            ret['dst'] = 'default'
+        if extra:
+            ret['extra'] = tuple(sorted(extra))
+        return ret
+
+    def put(self, fields, slot=None):
+        '''
+        Store the route fields into a new or an existing slot.
+        Raise `TypeError` if some values can not be interned.
+        '''
+        values = {}
+        try:
+            for field in self.str_fields:
+                value = fields.get(field)
+                if value is not None and field != 'dst':
+                    value = self.intern(value)
+                values[field] = value
+        except TypeError:
+            for (field, value) in values.items():
+                if field != 'dst':
+                    self.unref(value)
+            raise
+        if slot is not None:
+            self.unref_slot(slot)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.columns['family'])
+                for field in self.int_fields:
+                    self.columns[field].append(0)
+                for field in self.str_fields:
+                    self.columns[field].append(None)
+        for field in self.int_fields:
+            value = fields.get(field)
+            self.columns[field][slot] = self.none if value is None else value
+        for field in self.str_fields:
+            self.columns[field][slot] = values[field]
+        self.gctime.pop(slot, None)
+        return slot
+
+    def release(self, slot):
+        self.unref_slot(slot)
+        for field in self.str_fields:
+            self.columns[field][slot] = None
+        self.gctime.pop(slot, None)
+        self.free.append(slot)
+
+    def intern(self, value):
+        ref = self.interned.get(value)
+        if ref is None:
+            ref = self.interned[value] = [value, 0]
+        ref[1] += 1
+        return ref[0]
+
+    def unref(self, value):
+        if value is None:
+            return
+        ref = self.interned.get(value)
+        if ref is None:
+            return
+        ref[1] -= 1
+        if ref[1] <= 0:
+            del self.interned[value]
+
+    def unref_slot(self, slot):
+        for field in self.str_fields:
+            if field != 'dst':
+                self.unref(self.columns[field][slot])
+
+    def get(self, slot, field):
+        if field in self.columns and field != 'extra':
+            value = self.columns[field][slot]
+            if value == self.none:
+                return None
+            return value
+        if field == 'ipdb_scope':
+            return 'gc' if slot in self.gctime else 'system'
+        if field == 'ipdb_priority':
+            return 0
+        for (key, value) in self.columns['extra'][slot] or ():
+            if key == field:
+                return dict(value) if key == 'metrics' else value
+        return None
+
+    def fields(self, slot):
+        '''
+        Return all not None route fields as a dict.
+        '''
+        ret = {}
+        for field in self.columns:
+            if field == 'extra':
+                continue
+            value = self.get(slot, field)
+            if value is not None:
+                ret[field] = value
+        for (key, value) in self.columns['extra'][slot] or ():
+            ret[key] = dict(value) if key == 'metrics' else value
+        return ret
+
+    def view(self, slot):
+        ret = CompactRoute.fromkeys(BaseRoute._fields)
+        ret.update(self.fields(slot))
+        ret['ipdb_scope'] = self.get(slot, 'ipdb_scope')
+        ret['ipdb_priority'] = 0
+        return ret
+
+    def match(self, slot, target):
+        for key, value in tuple(target.items()):
+            if (key not in self.route_fields) or \
+                    (value != self.get(slot, key)):
+                return False
+        return True
+
+
 class RoutingTable(object):
+    '''
+    Routes of one routing table.
+
+    The primary index `idx` maps route keys to records. Secondary
+    indexes are maintained along with it:
+
+    * `fdx` -- hash indexes `{field: {value: {key: record}}}` for
+      the fields in `indexed`, used by `filter()`
+    * `ldx` -- longest prefix match index
+      `{family: {dst_len: {prefix: {key: record}}}}`, used by
+      `lookup()`
+
+    With `IPDB(compact_routes=True)` routes loaded from the kernel
+    are kept in `store` as slots, and all the indexes refer to the
+    slot numbers instead of records. Such routes are returned as
+    `CompactRoute` snapshots by iteration, `filter()` and `lookup()`,
+    and are turned into `Route` objects on `describe()`, e.g. with
+    `ipdb.routes[...]`.
+    '''
 
     route_class = Route
+    indexed = ('dst', 'oif', 'gateway', 'proto', 'table', 'family')
 
     def __init__(self, ipdb, prime=None):
         self.ipdb = ipdb
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
         self.idx = {}
         self.kdx = {}
+        self.fdx = dict([(x, {}) for x in self.indexed])
+        self.ldx = {}
+        self.store = None
+        if getattr(ipdb, '_compact_routes', False) and \
+                self.route_class is Route:
+            self.store = RouteStore()
+
+    def _get(self, entry, field):
+        if isinstance(entry, int):
+            return self.store.get(entry, field)
+        return entry['route'].get(field)
+
+    def _alive(self, entry):
+        return self._get(entry, 'ipdb_scope') != 'gc'
+
+    def _record(self, key, entry):
+        if isinstance(entry, int):
+            return {'route': self.store.view(entry),
+                    'key': key}
+        return entry
+
+    def _values(self, entry):
+        values = dict([(x, self._get(entry, x)) for x in self.indexed])
+        if values['family'] in (AF_INET, AF_INET6):
+            values['ipnet'] = _ipnet(values['family'], values['dst'])
+        return values
+
+    def _index(self, key, entry):
+        values = self._values(entry)
+        for field in self.indexed:
+            self.fdx[field].setdefault(values[field], {})[key] = entry
+        net = values.get('ipnet')
+        if net is not None:
+            (self.ldx
+             .setdefault(values['family'], {})
+             .setdefault(net[0], {})
+             .setdefault(net[1], {}))[key] = entry
+        if not isinstance(entry, int):
+            # keep the indexed values to drop the record later
+            entry['indexed'] = values
+
+    def _unindex(self, key, entry):
+        if isinstance(entry, int):
+            values = self._values(entry)
+        else:
+            values = entry.pop('indexed', None)
+            if values is None:
+                return
+        for field in self.indexed:
+            bucket = self.fdx[field].get(values[field])
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self.fdx[field][values[field]]
+        net = values.get('ipnet')
+        if net is not None:
+            lpm = self.ldx[values['family']]
+            bucket = lpm[net[0]][net[1]]
+            bucket.pop(key, None)
+            if not bucket:
+                del lpm[net[0]][net[1]]
+                if not lpm[net[0]]:
+                    del lpm[net[0]]
+
+    def _drop(self, key):
+        entry = self.idx.pop(key)
+        self._unindex(key, entry)
+        if isinstance(entry, int):
+            self.store.release(entry)
+
+    def _materialize(self, key, slot):
+        with self.lock:
+            if self.idx.get(key) != slot:
+                return self._found(key, True)
+            route = self.route_class(self.ipdb)
+            with route._direct_state:
+                for (field, value) in self.store.fields(slot).items():
+                    route[field] = value
+                route['ipdb_scope'] = self.store.get(slot, 'ipdb_scope')
+            route._gctime = self.store.gctime.get(slot)
+            self._unindex(key, slot)
+            self.store.release(slot)
+            record = {'route': route,
+                      'key': key}
+            self.idx[key] = record
+            self._index(key, record)
+            return record
+
+    def _found(self, key, materialize):
+        entry = self.idx[key]
+        if isinstance(entry, int):
+            if materialize:
+                return self._materialize(key, entry)
+            return self._record(key, entry)
+        return entry
+
+    def _load_compact(self, key, msg):
+        entry = self.idx.get(key)
+        if entry is not None and not isinstance(entry, int):
+            return False
+        fields = self.store.parse(msg)
+        if entry is not None and \
+                (fields is None or
+                 (msg['family'] == AF_INET6 and
+                  msg.get('header', {}).get('flags', 0) == NLM_F_MULTI)):
+            # let BaseRoute.load_netlink() handle it, e.g. the next
+            # hop of an IPv6 multipath route
+            self._materialize(key, entry)
+            return False
+        if fields is None:
+            return False
+        if fields['dst'] == key.dst:
+            # share the string with the key
+            fields['dst'] = key.dst
+        if entry is not None:
+            self._unindex(key, entry)
+        try:
+            slot = self.store.put(fields, entry)
+        except TypeError:
+            # not hashable attributes
+            if entry is not None:
+                self._index(key, entry)
+                self._materialize(key, entry)
+            return False
+        self.idx[key] = slot
+        self._index(key, slot)
+        return True
+
+    def relink(self, old_key, new_key, route):
+        '''
+        Move the route in the index to the new key.
+        '''
+        with self.lock:
+            if old_key in self.idx:
+                self._drop(old_key)
+            record = {'route': route,
+                      'key': new_key}
+            self.idx[new_key] = record
+            self._index(new_key, record)
+
+    def mark_gc(self, key):
+        '''
+        Mark the route for the garbage collection.
+        '''
+        entry = self.idx.get(key)
+        if entry is None:
+            return
+        if isinstance(entry, int):
+            self.store.gctime[entry] = time.time()
+        else:
+            with entry['route']._direct_state:
+                entry['route']['ipdb_scope'] = 'gc'
+                entry['route']._gctime = time.time()
 
     def __nogc__(self):
-        return self.filter(lambda x: x['route']['ipdb_scope'] != 'gc')
+        for (key, entry) in tuple(self.idx.items()):
+            if self._alive(entry):
+                yield self._record(key, entry)
 
     def __repr__(self):
         return repr([x['route'] for x in self.__nogc__()])
 
     def __len__(self):
-        return len(self.keys())
+        return sum(1 for x in tuple(self.idx.values()) if self._alive(x))
 
     def __iter__(self):
         for record in self.__nogc__():
@@ -872,28 +1267,42 @@ class RoutingTable(object):
 
     def gc(self):
         now = time.time()
-        for route in self.filter({'ipdb_scope': 'gc'}):
-            if now - route['route']._gctime < 2:
+        for (key, entry) in tuple(self.idx.items()):
+            if self._alive(entry):
                 continue
+            if isinstance(entry, int):
+                gctime = self.store.gctime.get(entry)
+            else:
+                gctime = entry['route']._gctime
+            if now - (gctime or 0) < 2:
+                continue
+            route = self._record(key, entry)['route']
             try:
-                self.ipdb.nl.route('get', **route['route'])
-                with route['route']._direct_state:
-                    route['route']['ipdb_scope'] = 'system'
+                self.ipdb.nl.route('get', **route)
+                if isinstance(entry, int):
+                    self.store.gctime.pop(entry, None)
+                else:
+                    with route._direct_state:
+                        route['ipdb_scope'] = 'system'
             except:
-                del self.idx[route['key']]
+                with self.lock:
+                    if key in self.idx:
+                        self._drop(key)
 
     def keys(self, key='dst'):
         with self.lock:
-            return [x['route'][key] for x in self.__nogc__()]
+            return [self._get(x, key) for x in tuple(self.idx.values())
+                    if self._alive(x)]
 
     def items(self):
         for key in self.keys():
-            yield (key, self[key])
+            yield (key, self.describe(key, materialize=False)['route'])
 
     def filter(self, target, oneshot=False):
         #
         if isinstance(target, types.FunctionType):
-            return filter(target, [x for x in tuple(self.idx.values())])
+            return filter(target, [self._record(*x) for x
+                                   in tuple(self.idx.items())])
 
         if isinstance(target, basestring):
             target = {'dst': target}
@@ -901,37 +1310,95 @@ class RoutingTable(object):
         if not isinstance(target, dict):
             raise TypeError('target type not supported: %s' % type(target))
 
+        # pick the smallest candidate set from the hash indexes,
+        # the full match is checked below anyways
+        candidates = self.idx
+        for key in self.indexed:
+            if key not in target:
+                continue
+            try:
+                bucket = self.fdx[key].get(target[key])
+            except TypeError:
+                # unhashable value
+                continue
+            if not bucket:
+                return []
+            if len(bucket) < len(candidates):
+                candidates = bucket
+
         ret = []
-        for record in tuple(self.idx.values()):
-            for key, value in tuple(target.items()):
-                if (key not in record['route']) or \
-                        (value != record['route'][key]):
-                    break
-            else:
-                ret.append(record)
-                if oneshot:
-                    return ret
+        for (key, entry) in tuple(candidates.items()):
+            if isinstance(entry, int):
+                if not self.store.match(entry, target):
+                    continue
+                entry = self._record(key, entry)
+            elif not self._match(entry['route'], target):
+                continue
+            ret.append(entry)
+            if oneshot:
+                return ret
 
         return ret
 
-    def describe(self, target, forward=False):
+    @staticmethod
+    def _match(route, target):
+        for key, value in tuple(target.items()):
+            if (key not in route) or (value != route[key]):
+                return False
+        return True
+
+    def lookup(self, addr, family=None):
+        '''
+        Longest prefix match: return the route to the IP address.
+        Of several routes to the same network the one with the
+        lowest priority value wins::
+
+            ipdb.routes.tables[254].lookup('10.0.0.1')
+
+        Raise `KeyError` if there is no route.
+        '''
+        if family is None:
+            family = AF_INET6 if addr.find(':') > -1 else AF_INET
+        raw = inet_pton(family, addr)
+        bits = len(raw) * 8
+        value = int(hexlify(raw), 16)
+        lpm = self.ldx.get(family, {})
+        for dst_len in sorted(tuple(lpm), reverse=True):
+            bucket = lpm.get(dst_len, {}).get(value >> (bits - dst_len))
+            if not bucket:
+                continue
+            best = None
+            for (key, entry) in tuple(bucket.items()):
+                if not self._alive(entry):
+                    continue
+                priority = self._get(entry, 'priority') or 0
+                if best is None or priority < best[0]:
+                    best = (priority, key, entry)
+            if best is not None:
+                return self._record(best[1], best[2])['route']
+        raise KeyError('route not found')
+
+    def describe(self, target, forward=False, materialize=True):
         # match the route by index -- a bit meaningless,
         # but for compatibility
         if isinstance(target, int):
-            keys = [x['key'] for x in self.__nogc__()]
-            return self.idx[keys[target]]
+            keys = [x[0] for x in tuple(self.idx.items())
+                    if self._alive(x[1])]
+            return self._found(keys[target], materialize)
 
         # match the route by key
         if isinstance(target, (tuple, list)):
             # full match
-            return self.idx[RouteKey(*target)]
+            return self._found(RouteKey(*target), materialize)
 
         if isinstance(target, nlmsg):
-            return self.idx[Route.make_key(target)]
+            return self._found(Route.make_key(target), materialize)
 
         # match the route by filter
         ret = self.filter(target, oneshot=True)
         if ret:
+            if isinstance(self.idx.get(ret[0]['key']), int):
+                return self._found(ret[0]['key'], materialize)
             return ret[0]
 
         if not forward:
@@ -963,11 +1430,15 @@ class RoutingTable(object):
 
     def __delitem__(self, key):
         with self.lock:
-            item = self.describe(key, forward=False)
-            del self.idx[self.route_class.make_key(item['route'])]
+            item = self.describe(key, forward=False, materialize=False)
+            self._drop(self.route_class.make_key(item['route']))
 
     def load(self, msg):
         key = self.route_class.make_key(msg)
+        if self.store is not None:
+            with self.lock:
+                if self._load_compact(key, msg):
+                    return key
         self[key] = msg
         return key
 
@@ -989,13 +1460,17 @@ class RoutingTable(object):
 
             key = self.route_class.make_key(record['route'])
             if record['key'] is None:
-                self.idx[key] = {'route': record['route'],
-                                 'key': key}
+                record = {'route': record['route'],
+                          'key': key}
             else:
-                self.idx[key] = record
+                self._unindex(record['key'], record)
                 if record['key'] != key:
-                    del self.idx[record['key']]
+                    self.idx.pop(record['key'], None)
                     record['key'] = key
+            if self.idx.get(key, record) is not record:
+                self._drop(key)
+            self.idx[key] = record
+            self._index(key, record)
 
     def __getitem__(self, key):
         with self.lock:
@@ -1004,7 +1479,7 @@ class RoutingTable(object):
     def __contains__(self, key):
         try:
             with self.lock:
-                self.describe(key, forward=False)
+                self.describe(key, forward=False, materialize=False)
             return True
         except KeyError:
             return False
@@ -1017,7 +1492,7 @@ class MPLSTable(RoutingTable):
     def keys(self):
         return self.idx.keys()
 
-    def describe(self, target, forward=False):
+    def describe(self, target, forward=False, materialize=True):
         # match by key
         if isinstance(target, int):
             return self.idx[target]
@@ -1041,15 +1516,16 @@ class RoutingTableSet(object):
                            'RTM_DELLINK': self.gc_mark_link,
                            'RTM_DELADDR': self.gc_mark_addr}
 
-    def _register(self):
-        for msg in self.ipdb.nl.get_routes(family=AF_INET,
-                                           match={'family': AF_INET}):
+    def _register(self, nl=None):
+        nl = nl or self.ipdb.nl
+        for msg in nl.get_routes(family=AF_INET,
+                                 match={'family': AF_INET}):
             self.load_netlink(msg)
-        for msg in self.ipdb.nl.get_routes(family=AF_INET6,
-                                           match={'family': AF_INET6}):
+        for msg in nl.get_routes(family=AF_INET6,
+                                 match={'family': AF_INET6}):
             self.load_netlink(msg)
-        for msg in self.ipdb.nl.get_routes(family=AF_MPLS,
-                                           match={'family': AF_MPLS}):
+        for msg in nl.get_routes(family=AF_MPLS,
+                                 match={'family': AF_MPLS}):
             self.load_netlink(msg)
 
     def add(self, spec=None, **kwarg):
@@ -1130,12 +1606,14 @@ class RoutingTableSet(object):
         if msg['event'] == 'RTM_DELROUTE':
             try:
                 # locate the record
-                record = self.tables[table][msg]
+                record = (self.tables[table]
+                          .describe(msg, materialize=False)['route'])
                 # delete the record
                 if record['ipdb_scope'] not in ('locked', 'shadow'):
                     del self.tables[table][msg]
-                    with record._direct_state:
-                        record['ipdb_scope'] = 'detached'
+                    if isinstance(record, Transactional):
+                        with record._direct_state:
+                            record['ipdb_scope'] = 'detached'
             except Exception as e:
                 # just ignore this failure for now
                 log.debug("delroute failed for %s", e)
@@ -1190,16 +1668,18 @@ class RoutingTableSet(object):
             net = struct.unpack('>I', inet_pton(family, addr))[0] &\
                 (0xffffffff << (32 - msg['prefixlen']))
 
-            # now iterate all registered routes and mark those with
-            # gateway from that network
-            for record in self.filter({'family': family}):
-                gw = record['route'].get('gateway')
-                if gw:
+            # now iterate all registered gateways and mark routes
+            # via gateways from that network
+            for table in tuple(self.tables.values()):
+                for gw, bucket in tuple(table.fdx['gateway'].items()):
+                    if not gw or gw.find(':') > -1:
+                        continue
                     gwnet = struct.unpack('>I', inet_pton(family, gw))[0] & net
-                    if gwnet == net:
-                        with record['route']._direct_state:
-                            record['route']['ipdb_scope'] = 'gc'
-                            record['route']._gctime = time.time()
+                    if gwnet != net:
+                        continue
+                    for (key, entry) in tuple(bucket.items()):
+                        if table._get(entry, 'family') == family:
+                            table.mark_gc(key)
 
         elif family == AF_INET6:
             # Unlike IPv4, IPv6 route updates are sent after addr
@@ -1216,14 +1696,11 @@ class RoutingTableSet(object):
         if msg['family'] != 0:
             return
 
-        for record in self.filter({'oif': msg['index']}):
-            with record['route']._direct_state:
-                record['route']['ipdb_scope'] = 'gc'
-                record['route']._gctime = time.time()
-        for record in self.filter({'iif': msg['index']}):
-            with record['route']._direct_state:
-                record['route']['ipdb_scope'] = 'gc'
-                record['route']._gctime = time.time()
+        for table in tuple(self.tables.values()):
+            for record in table.filter({'oif': msg['index']}):
+                table.mark_gc(record['key'])
+            for record in table.filter({'iif': msg['index']}):
+                table.mark_gc(record['key'])
 
     def gc(self):
         for table in self.tables.keys():
@@ -1240,7 +1717,12 @@ class RoutingTableSet(object):
     def filter(self, target):
         # FIXME: turn into generator!
         ret = []
-        for table in tuple(self.tables.values()):
+        tables = tuple(self.tables.items())
+        if isinstance(target, dict) and 'table' in target:
+            # MPLS routes have no own table ids
+            tables = [x for x in tables if x[0] in (target['table'],
+                                                    'mpls')]
+        for _, table in tables:
             if table is not None:
                 ret.extend(table.filter(target))
         return ret
@@ -1252,6 +1734,13 @@ class RoutingTableSet(object):
         table = table or 254
         return self.tables[table][dst]
 
+    def lookup(self, addr, table=None):
+        '''
+        Return the longest prefix match route to the IP address.
+        '''
+        table = table or 254
+        return self.tables[table].lookup(addr)
+
     def keys(self, table=254, family=AF_UNSPEC):
         return [x['dst'] for x in self.tables[table]
                 if (x.get('family') == family) or
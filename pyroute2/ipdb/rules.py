@@ -131,6 +131,9 @@ class Rule(Transactional):
             devop = 'add'
 
         # work on an existing route
+        #
+        # a full copy, not a `Journal`: rules have no linked
+        # sets, and the copy is the rollback transaction
         snapshot = self.pick()
         added, removed = transaction // snapshot
         added.pop('ipdb_scope', None)
@@ -224,10 +227,11 @@ class RulesDict(dict):
         self._event_map = {'RTM_NEWRULE': self.load_netlink,
                            'RTM_DELRULE': self.load_netlink}
 
-    def _register(self):
-        for msg in self.ipdb.nl.get_rules(family=AF_INET):
+    def _register(self, nl=None):
+        nl = nl or self.ipdb.nl
+        for msg in nl.get_rules(family=AF_INET):
             self.load_netlink(msg)
-        for msg in self.ipdb.nl.get_rules(family=AF_INET6):
+        for msg in nl.get_rules(family=AF_INET6):
             self.load_netlink(msg)
 
     def __getitem__(self, key):
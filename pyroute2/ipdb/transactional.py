@@ -5,6 +5,7 @@ import threading
 from pyroute2.common import uuid32
 from pyroute2.common import Dotkeys
 from pyroute2.ipdb.linkedset import LinkedSet
+from pyroute2.ipdb.linkedset import LinkedSetJournal
 from pyroute2.ipdb.exceptions import CommitException
 
 # How long should we wait on EACH commit() checkpoint: for ipaddr,
@@ -81,10 +82,132 @@ def with_transaction(f):
     return update(decorated)
 
 
+class Journal(object):
+    '''
+    Copy-on-write snapshot of a `Transactional` object.
+
+    The journal doesn't copy the object. Instead it records the
+    old values of the fields and the linked set deltas as they
+    change after the journal is created. The full snapshot is
+    created by `pick()` only when it is really required, e.g.
+    to revert the object or to roll back a commit.
+
+    The journal must be closed with `close()` when not needed.
+    A sealed journal of a snapshot, see `drop()`, makes the full
+    copy on the first change and closes itself.
+    '''
+    def __init__(self, target, uid=None):
+        self.target = target
+        self.uid = uid or uuid32()
+        self.fields = {}
+        self.sets = {}
+        self.sealed = False
+        with target._write_lock:
+            for key in target._linked_sets:
+                journal = LinkedSetJournal(self)
+                target[key].add_journal(journal)
+                self.sets[key] = journal
+            target._journals.append(self)
+
+    def record(self, key, value):
+        # only the first change matters
+        if key not in self.fields:
+            self.fields[key] = value
+
+    def changed(self):
+        if not self.sealed:
+            return
+        target = self.target
+        with target._write_lock:
+            self.sealed = False
+            if target._snapshots.get(self.uid) is self:
+                target._snapshots[self.uid] = self.pick()
+            self.close()
+
+    def close(self):
+        target = self.target
+        with target._write_lock:
+            if self in target._journals:
+                target._journals.remove(self)
+            for (key, journal) in self.sets.items():
+                target[key].remove_journal(journal)
+
+    def keys(self):
+        return set(self.target._fields) | set(self.target._linked_sets)
+
+    def get(self, key, default=None):
+        if key in self.sets:
+            return self.sets[key].revert(self.target[key])
+        elif key in self.fields:
+            return self.fields[key]
+        elif key in self.target._fields:
+            return dict.get(self.target, key, default)
+        return default
+
+    def __getitem__(self, key):
+        if key not in self.sets and key not in self.target._fields:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __contains__(self, key):
+        return key in self.sets or key in self.target._fields
+
+    def __floordiv__(self, vs):
+        # the same as `Transactional.__floordiv__()`, but
+        # without a copy of the object
+        left = {}
+        right = {}
+        with self.target._direct_state:
+            with vs._direct_state:
+                for key in self.keys() | set(vs.keys()):
+                    if self.get(key, None) != vs.get(key, None):
+                        left[key] = self.get(key)
+                        right[key] = vs.get(key)
+                        continue
+                    if key not in self:
+                        right[key] = vs[key]
+                    elif key not in vs:
+                        left[key] = self[key]
+                for key in self.target._linked_sets:
+                    current = self.get(key)
+                    ldiff = type(current)(current - vs[key])
+                    rdiff = type(vs[key])(vs[key] - current)
+                    left[key] = ldiff or set()
+                    right[key] = rdiff or set()
+                for key in self.target._nested:
+                    left[key], right[key] = self.get(key) // vs[key]
+        return left, right
+
+    def dump(self):
+        return self.pick().dump()
+
+    def pick(self):
+        '''
+        Create the full snapshot.
+        '''
+        target = self.target
+        with target._write_lock:
+            res = target.pick(detached=True)
+            # not all the classes pass uid to the constructor,
+            # and `uid` may be a field as well
+            dict.__setattr__(res, 'uid', self.uid)
+            for (key, value) in self.fields.items():
+                if key in target._fields:
+                    res[key] = value
+            for (key, journal) in self.sets.items():
+                res[key] = journal.revert(res[key])
+            return res
+
+
 class Transactional(Dotkeys):
     '''
     Utility class that implements common transactional logic.
+
+    Sparse objects, with `_sparse = True`, do not store fields
+    that are None: a missing field reads as None, and setting a
+    field to None removes it.
     '''
+    _sparse = False
     _fields = []
     _virtual_fields = []
     _fields_cmp = {}
@@ -110,12 +233,15 @@ class Transactional(Dotkeys):
             self._mode = mode or 'implicit'
         #
         self.nlmsg = None
-        self.uid = uid or uuid32()
+        # `uid` may be a field as well
+        dict.__setattr__(self, 'uid', uid or uuid32())
         self.last_error = None
         self._commit_hooks = []
         self._sids = []
-        self._ts = threading.local()
+        # thread local state, created on the first transaction
+        self._ts = None
         self._snapshots = {}
+        self._journals = []
         self.global_tx = {}
         self._targets = {}
         self._local_targets = {}
@@ -123,8 +249,33 @@ class Transactional(Dotkeys):
         self._direct_state = State(self._write_lock)
         self._linked_sets = self._linked_sets or set()
         #
-        for i in self._fields:
-            Dotkeys.__setitem__(self, i, None)
+        if not self._sparse:
+            for i in self._fields:
+                Dotkeys.__setitem__(self, i, None)
+
+    def __missing__(self, key):
+        if self._sparse and key in self._fields_set():
+            return None
+        raise KeyError(key)
+
+    def __getattr__(self, key):
+        # called only when `Dotkeys.__getattribute__()` fails
+        if key[:1] != '_' and self._sparse and key in self._fields_set():
+            return None
+        raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        if self._sparse and key in self._fields_set() and \
+                key not in self.__dict__:
+            self[key] = value
+        else:
+            Dotkeys.__setattr__(self, key, value)
+
+    @classmethod
+    def _fields_set(cls):
+        if '_fields_frozen' not in cls.__dict__:
+            cls._fields_frozen = frozenset(cls._fields)
+        return cls._fields_frozen
 
     @property
     def ro(self):
@@ -308,25 +459,32 @@ class Transactional(Dotkeys):
     def revert(self, sid):
         with self._write_lock:
             assert sid in self._snapshots
-            self.local_tx[sid] = self._snapshots[sid]
-            self.global_tx[sid] = self._snapshots[sid]
-            self.current_tx = self._snapshots[sid]
+            t = self._snapshots.pop(sid)
+            if isinstance(t, Journal):
+                journal = t
+                t = journal.pick()
+                journal.close()
+            self.local_tx[sid] = t
+            self.global_tx[sid] = t
+            self.current_tx = t
             self._sids.remove(sid)
-            del self._snapshots[sid]
             return self
 
     def snapshot(self, sid=None):
         '''
-        Create new snapshot
+        Create new snapshot. The snapshot is copy-on-write,
+        see `Journal`.
         '''
         if self._parent:
             raise RuntimeError("Can't init snapshot from a nested object")
         if (self.ipdb is not None) and self.ipdb._stop:
             raise RuntimeError("Can't create snapshots on released IPDB")
-        t = self.pick(detached=True, uid=sid)
-        self._snapshots[t.uid] = t
-        self._sids.append(t.uid)
-        for key, value in t.items():
+        with self._write_lock:
+            t = Journal(self, uid=sid)
+            self._snapshots[t.uid] = t
+            self._sids.append(t.uid)
+            nested = [dict.get(self, x) for x in self._fields]
+        for value in nested:
             if isinstance(value, Transactional):
                 value.snapshot(sid=t.uid)
         return t.uid
@@ -334,19 +492,29 @@ class Transactional(Dotkeys):
     def last_snapshot(self):
         if not self._sids:
             raise TypeError('create a snapshot first')
-        return self._snapshots[self._sids[-1]]
+        t = self._snapshots[self._sids[-1]]
+        if isinstance(t, Journal):
+            t = t.pick()
+        return t
 
     ##
     # Current tx
+    def _thread_state(self):
+        if self._ts is None:
+            self._ts = threading.local()
+        return self._ts
+
     def _set_current_tx(self, tx):
         with self._write_lock:
-            self._ts.current = tx
+            self._thread_state().current = tx
 
     def _get_current_tx(self):
         '''
         The current active transaction (thread-local)
         '''
         with self._write_lock:
+            if self._ts is None:
+                return None
             if not hasattr(self._ts, 'current'):
                 self._ts.current = None
             return self._ts.current
@@ -357,9 +525,10 @@ class Transactional(Dotkeys):
     # Local tx registry
     def _get_local_tx(self):
         with self._write_lock:
-            if not hasattr(self._ts, 'tx'):
-                self._ts.tx = {}
-            return self._ts.tx
+            ts = self._thread_state()
+            if not hasattr(ts, 'tx'):
+                ts.tx = {}
+            return ts.tx
 
     local_tx = property(_get_local_tx)
 
@@ -377,6 +546,8 @@ class Transactional(Dotkeys):
     def _begin(self, tid=None):
         if (self.ipdb is not None) and self.ipdb._stop:
             raise RuntimeError("Can't start transaction on released IPDB")
+        # the transaction is a writable copy, connected to the
+        # linked sets, so it can not be a `Journal`
         t = self.pick(detached=False, uid=tid)
         self.local_tx[t.uid] = t
         self.global_tx[t.uid] = t
@@ -448,6 +619,11 @@ class Transactional(Dotkeys):
             # finally -- delete the transaction
             del self.local_tx[tx.uid]
             del self.global_tx[tx.uid]
+            # the transaction is over: the snapshot journals copy
+            # the object on the next change and stop recording
+            for t in self._snapshots.values():
+                if isinstance(t, Journal):
+                    t.sealed = True
 
     ##
     # Property ops: set/get/delete
@@ -461,8 +637,15 @@ class Transactional(Dotkeys):
             if value is not None:
                 transaction._targets[key] = threading.Event()
         else:
+            # record the old value for copy-on-write snapshots
+            for journal in tuple(self._journals):
+                journal.record(key, dict.get(self, key))
+                journal.changed()
             # set the item
-            Dotkeys.__setitem__(self, key, value)
+            if value is None and self._sparse:
+                dict.pop(self, key, None)
+            else:
+                Dotkeys.__setitem__(self, key, value)
 
             # update on local targets
             with self._write_lock:
@@ -488,6 +671,8 @@ class Transactional(Dotkeys):
             transaction = self.current_tx
             if key in transaction:
                 del transaction[key]
+        elif self._sparse:
+            dict.pop(self, key, None)
         else:
             Dotkeys.__delitem__(self, key)
 
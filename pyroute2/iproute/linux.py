@@ -42,6 +42,7 @@ from pyroute2.netlink.rtnl import RTM_GETNEIGH
 from pyroute2.netlink.rtnl import RTM_DELNEIGH
 from pyroute2.netlink.rtnl import RTM_SETLINK
 from pyroute2.netlink.rtnl import RTM_GETNEIGHTBL
+from pyroute2.netlink.rtnl import RTM_GETNSID
 from pyroute2.netlink.rtnl import TC_H_ROOT
 from pyroute2.netlink.rtnl import rt_type
 from pyroute2.netlink.rtnl import rt_scope
@@ -60,6 +61,7 @@ from pyroute2.netlink.rtnl.fibmsg import fibmsg
 from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
 from pyroute2.netlink.rtnl.ifinfmsg import IFF_NOARP
 from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pyroute2.netlink.rtnl.nsidmsg import nsidmsg
 from pyroute2.netlink.rtnl.iprsocket import IPRSocket
 from pyroute2.netlink.rtnl.iprsocket import IPBatchSocket
 from pyroute2.netlink.rtnl.riprsocket import RawIPRSocket
@@ -274,6 +276,28 @@ class RTNL_API(object):
         msg['family'] = family
         return self.nlm_request(msg, RTM_GETNEIGHTBL)
 
+    def get_netnsid(self, nsid=None, pid=None, fd=None):
+        '''
+        Get the id of a network namespace, given by an open `fd`
+        or by a `pid` of a process within it, as seen from the
+        current netns. Returns -1 if no id is assigned::
+
+            fd = os.open('/var/run/netns/test', os.O_RDONLY)
+            ipr.get_netnsid(fd=fd)
+
+        Please notice, that the fd must be open in the process,
+        that owns the netlink socket.
+        '''
+        msg = nsidmsg()
+        if nsid is not None:
+            msg['attrs'].append(['NETNSA_NSID', nsid])
+        if pid is not None:
+            msg['attrs'].append(['NETNSA_PID', pid])
+        if fd is not None:
+            msg['attrs'].append(['NETNSA_FD', fd])
+        for msg in self.nlm_request(msg, RTM_GETNSID, NLM_F_REQUEST):
+            return msg.get_attr('NETNSA_NSID')
+
     def get_addr(self, family=AF_UNSPEC, match=None, **kwarg):
         '''
         Dump addresses.
@@ -8,6 +8,10 @@ import threading
 import traceback
 from functools import partial
 from collections import OrderedDict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 from socket import (AF_INET,
                     inet_pton)
 from pyroute2 import config
@@ -30,6 +34,25 @@ from pyroute2.ndb.address import Address
 
 log = logging.getLogger(__name__)
 MAX_ATTEMPTS = 5
+#
+# SQLite3 storage profiles, the PRAGMAs to set up
+#
+# With a profile fetch() doesn't commit, instead the NDB main
+# loop commits after every events batch, see NDB(db_profile=...)
+#
+profiles = {'memory': (('journal_mode', 'MEMORY'),
+                       ('synchronous', 'OFF'),
+                       ('cache_size', -65536),
+                       ('temp_store', 'MEMORY')),
+            'file-wal': (('journal_mode', 'WAL'),
+                         ('synchronous', 'NORMAL'),
+                         ('cache_size', -65536),
+                         ('temp_store', 'MEMORY')),
+            'file-mmap': (('journal_mode', 'WAL'),
+                          ('synchronous', 'NORMAL'),
+                          ('mmap_size', 268435456),
+                          ('cache_size', -65536),
+                          ('temp_store', 'MEMORY'))}
 
 
 def db_lock(method):
@@ -46,6 +69,9 @@ class DBSchema(object):
     event_map = None
     key_defaults = None
     snapshots = None  # <table_name>: <obj_weakref>
+    replicas = None  # Queue() of read-only connections, see fetch_replica()
+    journal = False  # RTNL objects rollback journal, see save_journal()
+    shard = None  # the shard index, see NDB(db_shards=...)
 
     spec = OrderedDict()
     # main tables
@@ -102,6 +128,19 @@ class DBSchema(object):
                           'RTA_TABLE'),
                'nh': ('route_id',
                       'nh_id')}
+    #
+    # secondary indices for the objects lookups and the reports,
+    # see NDB(db_indices=...)
+    #
+    secondary = {'interfaces': (('target', 'IFLA_IFNAME'),
+                                ('target', 'index'),
+                                ('IFLA_ADDRESS', )),
+                 'addresses': (('IFA_ADDRESS', ), ),
+                 'neighbours': (('target', 'NDA_DST'), ),
+                 'routes': (('target', 'RTA_OIF'),
+                            ('target', 'RTA_DST'),
+                            ('RTA_GATEWAY', )),
+                 'nh': (('route_id', ), )}
 
     foreign_keys = {'addresses': [{'fields': ('f_target',
                                               'f_tflags',
@@ -173,8 +212,13 @@ class DBSchema(object):
                                                'f_index'),
                              'parent': 'interfaces'}]}
 
-    def __init__(self, connection, mode, rtnl_log, tid):
+    def __init__(self, connection, mode, rtnl_log, tid, profile=None,
+                 secondary=None):
         self.mode = mode
+        self.profile = profile
+        if secondary:
+            self.secondary = dict(self.secondary)
+            self.secondary.update(secondary)
         self.thread = tid
         self.connection = connection
         self.rtnl_log = rtnl_log
@@ -183,14 +227,27 @@ class DBSchema(object):
         self.db_lock = threading.RLock()
         self._cursor = None
         self._counter = 0
+        self._batch = None
+        self._extractors = {}
+        self._bulk = set()
+        self._bulk_seq = 0
         self.share_cursor()
         if self.mode == 'sqlite3':
             # SQLite3
             self.connection.execute('PRAGMA foreign_keys = ON')
+            if profile is not None:
+                for pragma in profiles[profile]:
+                    self.connection.execute('PRAGMA %s = %s' % pragma)
             self.plch = '?'
+            # native UPSERT is supported since SQLite 3.24
+            self.upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
         elif self.mode == 'psycopg2':
             # PostgreSQL
+            if profile is not None:
+                raise NotImplementedError('storage profiles are '
+                                          'SQLite3 only')
             self.plch = '%s'
+            self.upsert = True
         else:
             raise NotImplementedError('database provider not supported')
         self.gctime = self.ctime = time.time()
@@ -331,6 +388,66 @@ class DBSchema(object):
         # the same issue with the placeholders
         #
         f_idx_match = ['%s.%s = %s' % (table, x, self.plch) for x in f_idx]
+        #
+        # the UPSERT statement for the batched load, the values
+        # are taken from the conflicting row, so every row needs
+        # only one set of the parameters
+        #
+        # f_flags = excluded.f_flags, ...
+        #
+        # the index fields are equal on conflict, and not updating
+        # them saves the f_tflags triggers and the foreign keys
+        # cascade on every update
+        #
+        f_excluded = ['%s = excluded.%s' % (x, x) for x in f_names
+                      if x not in f_idx]
+        upsert = ('INSERT INTO %s (%s) VALUES (%s) '
+                  'ON CONFLICT (%s) DO %s'
+                  % (table,
+                     ','.join(f_names),
+                     ','.join(plchs),
+                     ','.join(f_idx),
+                     ('UPDATE SET %s' % ','.join(f_excluded))
+                     if f_excluded else 'NOTHING'))
+        #
+        # the bulk load: rows go to the staging table w/o indices
+        # and constraints, see bulk_start()
+        #
+        bulk = ('INSERT INTO %s_bulk (%s,f_bulk_seq) VALUES (%s,%s)'
+                % (table,
+                   ','.join(f_names),
+                   ','.join(plchs),
+                   self.plch))
+        #
+        # ... and then are merged into the table with one request;
+        # only the last row for every key is taken, and the foreign
+        # keys are checked here, so the rows w/o parents are dropped
+        # instead of failing the whole request
+        #
+        # NULL fields satisfy a foreign key, as in SQL
+        #
+        checks = ['bulk.f_target = %s' % self.plch,
+                  'bulk.f_bulk_seq IN (SELECT max(f_bulk_seq) FROM %s_bulk '
+                  'WHERE f_target = %s GROUP BY %s)'
+                  % (table, self.plch, ','.join(f_idx))]
+        for key in self.foreign_keys.get(table, ()):
+            nulls = ['bulk.%s IS NULL' % x for x in key['fields']]
+            match = ['parent.%s = bulk.%s' % x for x
+                     in zip(key['parent_fields'], key['fields'])]
+            checks.append('(%s OR EXISTS (SELECT 1 FROM %s AS parent '
+                          'WHERE %s))' % (' OR '.join(nulls),
+                                          key['parent'],
+                                          ' AND '.join(match)))
+        merge = ('INSERT INTO %s (%s) SELECT %s FROM %s_bulk AS bulk '
+                 'WHERE %s ON CONFLICT (%s) DO %s'
+                 % (table,
+                    ','.join(f_names),
+                    ','.join(['bulk.%s' % x for x in f_names]),
+                    table,
+                    ' AND '.join(checks),
+                    ','.join(f_idx),
+                    ('UPDATE SET %s' % ','.join(f_excluded))
+                    if f_excluded else 'NOTHING'))
 
         return {'names': names,
                 'all_names': all_names,
@@ -340,15 +457,96 @@ class DBSchema(object):
                 'plchs': ','.join(plchs),
                 'fset': ','.join(f_set),
                 'knames': ','.join(f_idx),
-                'fidx': ' AND '.join(f_idx_match)}
+                'fidx': ' AND '.join(f_idx_match),
+                'upsert': upsert,
+                'bulk': bulk,
+                'merge': merge}
+
+    def compile_extractor(self, table, ctable, mclass):
+        #
+        # Compile the columns extraction for the message class.
+        #
+        # Returns a function event -> (values, index values), w/o
+        # the first two columns. The first NLA with the name wins,
+        # as with get_attr(); header fields are looked up directly.
+        #
+        idx = self.compiled[table]['idx']
+        kidx = self.compiled[ctable or table]['idx']
+        defaults = self.key_defaults[table]
+        header = set([x[0] for x in getattr(mclass, 'fields', ())])
+        columns = []
+        for fname in self.spec[table]:
+            name = fname[-1]
+            columns.append((fname[:-1],
+                            name,
+                            len(fname) == 1 and name in header,
+                            defaults.get(name) if name in kidx else None,
+                            name in idx))
+        columns = tuple(columns)
+
+        def nlas(node):
+            ret = {}
+            for cell in node.get('attrs', ()):
+                if cell[0] not in ret:
+                    ret[cell[0]] = cell
+            return ret
+
+        def extract(event):
+            values = []
+            ivalues = []
+            # a map of sub-NLAs
+            nodes = {(): (event, nlas(event))}
+            for path, name, field, default, key in columns:
+                if path not in nodes:
+                    # descend
+                    node = event
+                    for step in path:
+                        node = node.get_attr(step)
+                        if node is None:
+                            break
+                    nodes[path] = (node,
+                                   None if node is None else nlas(node))
+                node, attrs = nodes[path]
+                # the event has no such sub-NLA
+                if node is None:
+                    values.append(None)
+                    continue
+                if field:
+                    value = node.get(name)
+                else:
+                    # NLA have priority
+                    cell = attrs.get(name)
+                    value = (cell is not None and cell[1]) or node.get(name)
+                if value is None:
+                    value = default
+                if key:
+                    ivalues.append(value)
+                values.append(value)
+            return values, ivalues
+
+        return extract
+
+    def extract(self, table, event, ctable=None):
+        #
+        # Return the row values for the event, w/o f_target and
+        # f_tflags, and the index values; the columns extraction
+        # is compiled once per message class
+        #
+        key = (table, ctable, event.__class__)
+        if key not in self._extractors:
+            self._extractors[key] = self.compile_extractor(*key)
+        return self._extractors[key](event)
 
     @db_lock
     def execute(self, *argv, **kwarg):
+        if self._batch is not None:
+            self.flush_batch()
         if self._cursor:
             cursor = self._cursor
         else:
             cursor = self.connection.cursor()
             self._counter = config.db_transaction_limit + 1
+        started = time.time()
         try:
             for _ in range(MAX_ATTEMPTS):
                 try:
@@ -372,24 +570,60 @@ class DBSchema(object):
             if self._counter > config.db_transaction_limit:
                 self.connection.commit()  # no performance optimisation yet
                 self._counter = 0
+        if config.db_slow_query is not None:
+            self.log_slow(time.time() - started, argv)
         return cursor
 
+    def explain(self, *argv):
+        #
+        # Return the query plan
+        #
+        if self.mode == 'sqlite3':
+            req = 'EXPLAIN QUERY PLAN %s' % argv[0]
+        else:
+            req = 'EXPLAIN %s' % argv[0]
+        cursor = self.connection.cursor()
+        cursor.execute(req, *argv[1:])
+        return cursor.fetchall()
+
+    def log_slow(self, spent, argv):
+        #
+        # Log the queries that run longer than config.db_slow_query
+        # seconds together with their plans
+        #
+        if spent < config.db_slow_query:
+            return
+        try:
+            plan = '\n'.join([str(x) for x in self.explain(*argv)])
+        except Exception as e:
+            plan = 'EXPLAIN error: %s' % e
+        log.warning('slow query, %.3fs: %s\n%s'
+                    % (spent, ' '.join(argv[0].split()), plan))
+
     def fetch(self, *argv, **kwarg):
         #
         # fetch() always requires a separate cursor, so there is
         # no need to lock the DB
         #
-        try:
-            self.connection.commit()
-        except sqlite3.OperationalError:
-            #
-            # Ignore commit errors for SQLite3:
-            # -- OperationalError: cannot commit - no transaction is activea
-            #
-            pass
+        self.flush_batch()
+        #
+        # with a storage profile the main loop sets the transaction
+        # boundaries, see profiles
+        #
+        if self.profile is None:
+            try:
+                self.connection.commit()
+            except sqlite3.OperationalError:
+                #
+                # Ignore commit errors for SQLite3:
+                # -- OperationalError: cannot commit - no transaction
+                #    is active
+                #
+                pass
         #
         # FIXME: How many tries should we do here? A good question to SQLite3
         #
+        started = time.time()
         for _ in range(MAX_ATTEMPTS):
             cursor = self.connection.cursor()
             try:
@@ -409,12 +643,61 @@ class DBSchema(object):
         else:
             raise Exception('DB fetch error')
 
+        for record in self.iterate(cursor, argv, time.time() - started):
+            yield record
+
+    def iterate(self, cursor, argv, spent):
+        #
+        # Iterate the records; with config.db_slow_query count
+        # the time spent in the DB, not in the consumer
+        #
+        if config.db_slow_query is None:
+            while True:
+                record_set = cursor.fetchmany()
+                if not record_set:
+                    return
+                for record in record_set:
+                    yield record
         while True:
+            started = time.time()
             record_set = cursor.fetchmany()
+            spent += time.time() - started
             if not record_set:
-                return
+                break
             for record in record_set:
                 yield record
+        self.log_slow(spent, argv)
+
+    def fetch_replica(self, *argv, **kwarg):
+        #
+        # Run a read-only query on a free replica connection, so
+        # the query doesn't lock the DB; replicas see the data as
+        # of the last loaded events batch. Fall back to fetch()
+        # if there is no free replica or the request fails.
+        #
+        cursor = None
+        started = time.time()
+        if self.replicas is not None:
+            try:
+                connection = self.replicas.get_nowait()
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(*argv, **kwarg)
+                except Exception:
+                    log.debug('fetch_replica: %s' % traceback.format_exc())
+                    cursor = None
+                    self.replicas.put(connection)
+            except queue.Empty:
+                pass
+        if cursor is None:
+            for record in self.fetch(*argv, **kwarg):
+                yield record
+            return
+        try:
+            for record in self.iterate(cursor, argv, time.time() - started):
+                yield record
+        finally:
+            self.replicas.put(connection)
 
     @db_lock
     def fetchall(self, *argv, **kwarg):
@@ -431,20 +714,75 @@ class DBSchema(object):
 
     @db_lock
     def unshare_cursor(self):
+        self.flush_batch()
         self._cursor = None
         self._counter = 0
         self.connection.commit()
 
     @db_lock
     def close(self):
+        self.flush_batch()
         self.purge_snapshots()
         self.connection.commit()
         self.connection.close()
+        while self.replicas is not None and not self.replicas.empty():
+            self.replicas.get().close()
 
     @db_lock
     def commit(self):
+        self.flush_batch()
         return self.connection.commit()
 
+    @db_lock
+    def flush_batch(self):
+        #
+        # Load the pending rows with one executemany(); any other
+        # DB request flushes the batch first, so the order of the
+        # requests is preserved
+        #
+        if self._batch is None:
+            return
+        table, statement, rows = self._batch
+        self._batch = None
+        try:
+            (self._cursor or self.connection.cursor()).executemany(statement,
+                                                                   rows)
+        except Exception:
+            #
+            # UPSERT is idempotent, so just reload the batch row by
+            # row to drop only the failed records
+            #
+            for row in rows:
+                try:
+                    self.execute(statement, row)
+                except Exception:
+                    log.warning('load_netlink: %s' % traceback.format_exc())
+
+    @db_lock
+    def bulk_start(self, target):
+        #
+        # Start the bulk load for the target: the rows go to the
+        # staging tables w/o indices, triggers and foreign keys,
+        # until bulk_end(). Used for the initial dump.
+        #
+        if self.upsert:
+            self._bulk.add(target)
+
+    @db_lock
+    def bulk_end(self, target):
+        #
+        # Merge the staging tables, the spec order is the foreign
+        # keys order: parent tables go first
+        #
+        if target not in self._bulk:
+            return
+        self.flush_batch()
+        self._bulk.remove(target)
+        for table in self.spec:
+            self.execute(self.compiled[table]['merge'], (target, target))
+            self.execute('DELETE FROM %s_bulk WHERE f_target = %s'
+                         % (table, self.plch), (target, ))
+
     @db_lock
     def create_ifinfo_view(self, table, ctxid=None):
         iftable = 'interfaces'
@@ -470,6 +808,34 @@ class DBSchema(object):
                          main.f_target = data.f_target
                      ''' % (table[7:], ','.join(req), iftable, table))
 
+    @db_lock
+    def attach(self, specs):
+        #
+        # Sharded mode: attach the shard DBs and shadow the tables
+        # and views with TEMP views over all the shards -- TEMP
+        # objects go first in the names resolution
+        #
+        if self.mode != 'sqlite3':
+            raise NotImplementedError('sharding is SQLite3 only')
+        self.connection.commit()
+        # do not wait for the table locks of the shared cache
+        self.execute('PRAGMA read_uncommitted = 1')
+        for idx, spec in enumerate(specs):
+            self.execute('ATTACH DATABASE %s AS shard%i'
+                         % (self.plch, idx), (spec, ))
+        names = []
+        for table in self.spec:
+            names.append(table)
+            if table.startswith('ifinfo_'):
+                names.append(table[7:])
+            if self.rtnl_log:
+                names.append('%s_log' % table)
+        for name in names:
+            req = ['SELECT * FROM shard%i.%s' % (idx, name)
+                   for idx in range(len(specs))]
+            self.execute('CREATE TEMP VIEW %s AS %s'
+                         % (name, ' UNION ALL '.join(req)))
+
     @db_lock
     def create_table(self, table):
         req = ['f_target TEXT NOT NULL',
@@ -513,6 +879,17 @@ class DBSchema(object):
         req = ','.join(req)
         req = ('CREATE TABLE IF NOT EXISTS '
                '%s (%s)' % (table, req))
+        #
+        # create the staging table for the bulk load, only
+        # the column types, see bulk_start()
+        #
+        if self.upsert:
+            bulk = (['f_target TEXT', 'f_tflags BIGINT'] +
+                    ['f_%s %s' % (x[0][-1], x[1].split()[0]) for x
+                     in self.spec[table].items()] +
+                    ['f_bulk_seq BIGINT'])
+            self.execute('CREATE TABLE IF NOT EXISTS '
+                         '%s_bulk (%s)' % (table, ','.join(bulk)))
         # self.execute('DROP TABLE IF EXISTS %s %s'
         #              % (table, 'CASCADE' if self.mode == 'psycopg2' else ''))
         self.execute(req)
@@ -522,6 +899,24 @@ class DBSchema(object):
         req = ('CREATE UNIQUE INDEX IF NOT EXISTS '
                '%s_idx ON %s (%s)' % (table, table, index))
         self.execute(req)
+        #
+        # index the child keys, otherwise the foreign keys cascades
+        # scan the table, see save_deps() and save_journal()
+        #
+        for key in self.foreign_keys.get(table, ()):
+            if index.startswith(','.join(key['fields'])):
+                continue
+            self.execute('CREATE INDEX IF NOT EXISTS %s_%s_fidx ON %s (%s)'
+                         % (table,
+                            '_'.join(key['fields']),
+                            table,
+                            ','.join(key['fields'])))
+        for keys in self.secondary.get(table, ()):
+            self.execute('CREATE INDEX IF NOT EXISTS %s_%s_sidx ON %s (%s)'
+                         % (table,
+                            '_'.join(keys),
+                            table,
+                            ','.join(['f_%s' % x for x in keys])))
 
         #
         # create table for the transaction buffer: there go the system
@@ -547,6 +942,7 @@ class DBSchema(object):
 
     @db_lock
     def mark(self, target, mark):
+        self.bulk_end(target)
         for table in self.spec:
             self.execute('''
                          UPDATE %s SET f_tflags = %s
@@ -561,6 +957,78 @@ class DBSchema(object):
                          DELETE FROM %s WHERE f_target = %s
                          ''' % (table, self.plch),
                          (target, ))
+            if target in self._bulk:
+                self.execute('''
+                             DELETE FROM %s_bulk WHERE f_target = %s
+                             ''' % (table, self.plch),
+                             (target, ))
+        self._bulk.discard(target)
+
+    @db_lock
+    def create_changes(self, table):
+        #
+        # Log the row changes of the table to <table>_changes with
+        # triggers, see fetch_changes(). The internal f_tflags is
+        # not logged, and updates that change only it are ignored.
+        #
+        if self.mode != 'sqlite3':
+            raise NotImplementedError('subscriptions are SQLite3 only')
+        fields = ['f_%s' % x for x
+                  in self.compiled[table]['all_names'] if x != 'tflags']
+        old = ['old_%s' % x for x in fields]
+        new = ['new_%s' % x for x in fields]
+        self.execute('CREATE TABLE IF NOT EXISTS %s_changes '
+                     '(f_change TEXT, %s)' % (table, ','.join(old + new)))
+        changed = ' OR '.join(['OLD.%s IS NOT NEW.%s' % (x, x)
+                               for x in fields])
+        triggers = (('insert', '', new,
+                     ['NEW.%s' % x for x in fields]),
+                    ('update', 'WHEN %s' % changed, old + new,
+                     ['OLD.%s' % x for x in fields] +
+                     ['NEW.%s' % x for x in fields]),
+                    ('delete', '', old,
+                     ['OLD.%s' % x for x in fields]))
+        for (event, when, columns, values) in triggers:
+            self.execute('''
+                         CREATE TRIGGER IF NOT EXISTS %s_changes_%s
+                         AFTER %s ON %s FOR EACH ROW %s
+                             BEGIN
+                                 INSERT INTO %s_changes (f_change,%s)
+                                 VALUES ('%s',%s);
+                             END
+                         ''' % (table, event,
+                                event.upper(), table, when,
+                                table, ','.join(columns),
+                                event, ','.join(values)))
+
+    @db_lock
+    def drop_changes(self, table):
+        for event in ('insert', 'update', 'delete'):
+            self.execute('DROP TRIGGER IF EXISTS %s_changes_%s'
+                         % (table, event))
+        self.execute('DROP TABLE IF EXISTS %s_changes' % table)
+
+    @db_lock
+    def fetch_changes(self, table):
+        #
+        # Return and clear the logged changes:
+        #   [(change, old_values, new_values), ...]
+        #
+        # change is 'insert', 'update' or 'delete', the values
+        # go in the spec order w/o f_tflags, or are None
+        #
+        size = len(self.compiled[table]['all_names']) - 1
+        ret = []
+        for record in self.fetchall('SELECT * FROM %s_changes '
+                                    'ORDER BY rowid' % table):
+            old = record[1:size + 1]
+            new = record[size + 1:]
+            ret.append((record[0],
+                        old if record[0] != 'insert' else None,
+                        new if record[0] != 'delete' else None))
+        if ret:
+            self.execute('DELETE FROM %s_changes' % table)
+        return ret
 
     @db_lock
     def save_deps(self, objid, wref, iclass):
@@ -641,6 +1109,59 @@ class DBSchema(object):
                          ''' % (table, objid, self.plch),
                          [tflags])
             self.snapshots['%s_%s' % (table, objid)] = wref
+        if self.shard is not None:
+            # the schema changes lock the shard for the readers
+            self.connection.commit()
+
+    @db_lock
+    def save_journal(self, obj, tables):
+        #
+        # Journal the object and its dependencies: mark the rows
+        # like save_deps() does, but save them in memory instead
+        # of the snapshot tables. With the target the requests use
+        # the unique indices, so the cost depends on the number of
+        # the rows, not on the tables size.
+        #
+        # -> {table: [record, ...]}
+        #
+        uuid = uuid32()
+        conditions = ['f_target = %s' % self.plch]
+        values = [obj['target']]
+        for key in self.indices[obj.table]:
+            conditions.append('f_%s = %s' % (key, self.plch))
+            values.append(obj.get(obj.iclass.nla2name(key)))
+        conditions = ' AND '.join(conditions)
+        tflags = self.fetchone('SELECT f_tflags FROM %s WHERE %s'
+                               % (obj.table, conditions), values)[0]
+        self.execute('UPDATE %s SET f_tflags = %s WHERE %s'
+                     % (obj.utable, self.plch, conditions),
+                     [uuid] + values)
+        journal = {}
+        for table in tables:
+            records = self.fetchall('SELECT * FROM %s '
+                                    'WHERE f_target = %s AND f_tflags = %s'
+                                    % (table, self.plch, self.plch),
+                                    (obj['target'], uuid))
+            journal[table] = [x[:1] + (tflags, ) + x[2:] for x in records]
+        self.execute('UPDATE %s SET f_tflags = %s WHERE %s'
+                     % (obj.utable, self.plch, conditions),
+                     [tflags] + values)
+        return journal
+
+    @db_lock
+    def journal_diff(self, table, journal):
+        #
+        # Return the journal records missing in the table, same as
+        # SELECT * FROM <table>_<ctxid> EXCEPT SELECT * FROM <table>
+        # for the snapshots
+        #
+        op = 'IS' if self.mode == 'sqlite3' else 'IS NOT DISTINCT FROM'
+        req = ('SELECT count(*) FROM %s WHERE %s'
+               % (table, ' AND '.join(['f_%s %s %s' % (x, op, self.plch)
+                                       for x
+                                       in self.compiled[table]['all_names']])))
+        return [x for x in journal.get(table, ())
+                if not self.fetchone(req, x)[0]]
 
     @db_lock
     def purge_snapshots(self):
@@ -731,12 +1252,27 @@ class DBSchema(object):
                           % (self.plch, self.plch, key_query),
                           (gc_mark, target) + route[:-1]))
 
-    @db_lock
-    def load_ndmsg(self, target, event):
+    def ignored(self, event):
         #
-        # ignore events with ifindex == 0
+        # The events that are not loaded to the DB
         #
-        if event['ifindex'] == 0:
+        if isinstance(event, ifinfmsg):
+            #
+            # ignore wireless updates and AF_BRIDGE events, bypass
+            # the latter for now
+            #
+            return bool(event.get_attr('IFLA_WIRELESS') or
+                        event['family'] == AF_BRIDGE)
+        elif isinstance(event, ndmsg):
+            #
+            # ignore events with ifindex == 0
+            #
+            return event['ifindex'] == 0
+        return False
+
+    @db_lock
+    def load_ndmsg(self, target, event):
+        if self.ignored(event):
             return
 
         self.load_netlink('neighbours', target, event)
@@ -752,18 +1288,7 @@ class DBSchema(object):
                          'f_RTA_OIF = %s OR f_RTA_IIF = %s'
                          % (self.plch, self.plch, self.plch),
                          (target, event['index'], event['index']))
-        #
-        # ignore wireless updates
-        #
-        if event.get_attr('IFLA_WIRELESS'):
-            return
-        #
-        # AF_BRIDGE events
-        #
-        if event['family'] == AF_BRIDGE:
-            #
-            # bypass for now
-            #
+        if self.ignored(event):
             return
 
         self.load_netlink('interfaces', target, event)
@@ -924,68 +1449,47 @@ class DBSchema(object):
                 values.append(value)
             self.execute('DELETE FROM %s WHERE'
                          ' %s' % (table, ' AND '.join(conditions)), values)
+            if target in self._bulk:
+                self.execute('DELETE FROM %s_bulk WHERE'
+                             ' %s' % (table, ' AND '.join(conditions)),
+                             values)
         else:
             #
             # Create or set an object
             #
+            compiled = self.compiled[table]
+            values, ivalues = self.extract(table, event, ctable)
             # field values
-            values = [target, 0]
+            values = [target, 0] + values
             # index values
-            ivalues = [target, 0]
-            compiled = self.compiled[table]
-            # a map of sub-NLAs
-            nodes = {}
-
-            # fetch values (exc. the first two columns)
-            for fname, ftype in self.spec[table].items():
-                node = event
-
-                # if the field is located in a sub-NLA
-                if len(fname) > 1:
-                    # see if we tried to get it already
-                    if fname[:-1] not in nodes:
-                        # descend
-                        for steg in fname[:-1]:
-                            node = node.get_attr(steg)
-                            if node is None:
-                                break
-                        nodes[fname[:-1]] = node
-                    # lookup the sub-NLA in the map
-                    node = nodes[fname[:-1]]
-                    # the event has no such sub-NLA
-                    if node is None:
-                        values.append(None)
-                        continue
-
-                # NLA have priority
-                value = node.get_attr(fname[-1]) or node.get(fname[-1])
-                if value is None and \
-                        fname[-1] in self.compiled[ctable or table]['idx']:
-                    value = self.key_defaults[table][fname[-1]]
-                if fname[-1] in compiled['idx']:
-                    ivalues.append(value)
-                values.append(value)
+            ivalues = [target, 0] + ivalues
+
+            if self.upsert:
+                #
+                # batch consecutive rows of the same table, the batch
+                # is loaded with UPSERT, see flush_batch(), or goes
+                # to the staging table, see bulk_start()
+                #
+                if target in self._bulk:
+                    statement = compiled['bulk']
+                    self._bulk_seq += 1
+                    values.append(self._bulk_seq)
+                else:
+                    statement = compiled['upsert']
+                if self._batch is not None and \
+                        self._batch[:2] != (table, statement):
+                    self.flush_batch()
+                if self._batch is None:
+                    self._batch = (table, statement, [])
+                self._batch[2].append(values)
+                if len(self._batch[2]) >= config.db_batch_limit:
+                    self.flush_batch()
+                return
 
             try:
-                if self.mode == 'psycopg2':
-                    #
-                    # run UPSERT -- the DB provider must support it
-                    #
-                    (self
-                     .execute('INSERT INTO %s (%s) VALUES (%s) '
-                              'ON CONFLICT (%s) '
-                              'DO UPDATE SET %s WHERE %s'
-                              % (table,
-                                 compiled['fnames'],
-                                 compiled['plchs'],
-                                 compiled['knames'],
-                                 compiled['fset'],
-                                 compiled['fidx']),
-                              (values + values + ivalues)))
-                    #
-                elif self.mode == 'sqlite3':
+                if self.mode == 'sqlite3':
                     #
-                    # SQLite3 >= 3.24 actually has UPSERT, but ...
+                    # SQLite3 < 3.24, no UPSERT
                     #
                     # We can not use here INSERT OR REPLACE as well, since
                     # it drops (almost always) records with foreign key
@@ -1021,8 +1525,8 @@ class DBSchema(object):
                 log.warning('load_netlink: %s' % traceback.format_exc())
 
 
-def init(connection, mode, rtnl_log, tid):
-    ret = DBSchema(connection, mode, rtnl_log, tid)
+def init(connection, mode, rtnl_log, tid, profile=None, secondary=None):
+    ret = DBSchema(connection, mode, rtnl_log, tid, profile, secondary)
     ret.event_map = {ifinfmsg: [ret.load_ifinfmsg],
                      ifaddrmsg: [partial(ret.load_netlink, 'addresses')],
                      ndmsg: [ret.load_ndmsg],
@@ -126,6 +126,166 @@ PostgreSQL access requires psycopg2 module::
               db_spec={'dbname': 'test',
                        'host': 'db1.example.com'})
 
+Storage profiles
+----------------
+
+By default NDB commits the DB before every query. A storage profile
+sets up SQLite3 PRAGMAs and commits once per events batch, so other
+processes can read a file DB w/o stalling NDB::
+
+    # in-memory DB, no journal and sync
+    ndb = NDB(db_profile='memory')
+
+    # file DB in the WAL mode, external readers don't block NDB
+    ndb = NDB(db_spec='ndb.db', db_profile='file-wal')
+
+    # the same plus memory-mapped I/O
+    ndb = NDB(db_spec='ndb.db', db_profile='file-mmap')
+
+    # meanwhile in another process
+    db = sqlite3.connect('ndb.db')
+    db.execute('SELECT f_IFLA_IFNAME FROM interfaces').fetchall()
+
+See `pyroute2.ndb.dbschema.profiles` for the PRAGMAs.
+
+Read replicas
+-------------
+
+Reports like `dump()`, `summary()` and `ndb.query` may use a pool of
+read-only DB connections, so long reports don't block the events
+loading and vice versa::
+
+    # an in-memory DB with a shared cache
+    ndb = NDB(db_replicas=2)
+
+    # a file DB requires the WAL mode
+    ndb = NDB(db_spec='ndb.db', db_profile='file-wal', db_replicas=2)
+
+The replicas see the DB as of the last loaded events batch. With a
+file DB or PostgreSQL it is a consistent snapshot, while the in-memory
+replicas read uncommitted data. `RTNL_Object` instances always use the
+main connection. If all the replicas are busy, a report falls back to
+the main connection.
+
+Indices
+-------
+
+Every table has a unique index on the object key. Secondary indices
+speed up lookups like `ndb.interfaces[{'ifname': 'eth0'}]` and the
+reports joins, see `pyroute2.ndb.dbschema.DBSchema.secondary` for
+the defaults. The indices may be set per table, an empty list disables
+the defaults::
+
+    ndb = NDB(db_indices={'routes': [('target', 'RTA_PRIORITY')],
+                          'neighbours': []})
+
+To find the queries that need an index, log the slow ones together
+with their plans::
+
+    from pyroute2 import config
+    config.db_slow_query = 0.1  # seconds
+
+    ndb.schema.explain('SELECT * FROM routes WHERE f_RTA_OIF = ?', (2, ))
+
+Rollback journal
+----------------
+
+Before applying changes `commit()` saves the object and the related
+objects, like addresses and routes of an interface, to roll back on
+errors. By default NDB copies them to snapshot tables in the DB, and
+the tables are dropped by the GC. The journal mode keeps the rows in
+memory on the snapshot object, so the commit cost depends on the
+object dependencies, not on the DB size::
+
+    ndb = NDB(db_journal=True)
+
+Topology
+--------
+
+`ndb.query` reports the cluster graph: nodes, l2, l3 and point to
+point edges. By default every report joins the DB tables; with
+`topology=True` NDB maintains the graph in memory as the events
+come, the reports don't touch the DB, and the edges changes may be
+subscribed to::
+
+    ndb = NDB(sources=..., topology=True)
+    ndb.query.l3_edges()
+    ndb.topology.subscribe(lambda kind, action, record: ...)
+
+See `pyroute2.ndb.topology` for details.
+
+Subscriptions
+-------------
+
+Instead of polling `dump()`, one can subscribe to the table changes.
+The changes are delivered after every events batch, as
+`(change, old, new)` tuples: `change` is 'insert', 'update' or
+'delete', `old` and `new` are dicts of the row fields, or None::
+
+    def callback(change, old, new):
+        ...
+
+    # the callback runs in a separate thread
+    sub = ndb.routes.subscribe(match={'oif': 2}, callback=callback)
+    ...
+    sub.close()
+
+    # or read the changes from the queue
+    with ndb.interfaces.subscribe(maxsize=100) as sub:
+        (change, old, new) = sub.get(timeout=5)
+
+The filter matches either old or new values, so the rows leaving
+the filter are reported as well. Every subscription has a bounded
+queue; if the subscriber can't keep up, the new changes are dropped
+and counted in `sub.dropped`. The changes are logged with triggers,
+only for the tables with subscriptions. SQLite3 only.
+
+Shards
+------
+
+By default all the sources feed one events queue, and one busy
+source delays the events of all the others. In the sharded mode
+every shard has an own events queue, thread and SQLite3 DB, and
+the sources are distributed among the shards::
+
+    ndb = NDB(sources=..., db_shards=4)
+
+    # per shard metrics: the sources, the queue depth and
+    # the ingestion lag, seconds
+    for shard in ndb.shards:
+        shard.stats()
+
+A new source goes to the shard with the least sources. The shard
+DBs are attached to `ndb.schema`, where views with `UNION ALL` over
+all the shards shadow the tables, so the reports and `ndb.query`
+see all the sources. `RTNL_Object` instances use the shard of the
+key target, 'localhost' by default; `ndb.get_schema(target)`
+returns the shard schema of a connected target, and `ndb.schema`
+for the unknown ones.
+
+The shards isolate the sources, but the events parsing still runs
+under the GIL, so the ingestion doesn't scale on cores. With a file
+DB the shards are the `db_spec.N` files, use the 'file-wal' profile
+to read them w/o locks. SQLite3 only, no read replicas; the number
+of shards is limited by the SQLite3 attached DBs limit, 10 by
+default.
+
+Events coalescing
+-----------------
+
+During link flaps or routing reconvergence NDB may spend most of
+the time writing to the DB the states that are already stale. To
+process only the latest state of every object, enable coalescing
+per event class, see `pyroute2.netlink.rtnl.coalesce`::
+
+    # collect route updates for 0.5 seconds; neighbours -- while
+    # there are events in the queue
+    ndb = NDB(coalesce={'route': 0.5, 'neigh': 0})
+    ...
+    ndb.coalescer.suppressed  # -> {'route': 10234, 'neigh': 76}
+
+Coalescing applies to all the event handlers, including ones
+registered with `register_handler()`.
 
 '''
 import json
@@ -139,7 +299,9 @@ import traceback
 from functools import partial
 from pyroute2 import config
 from pyroute2 import IPRoute
+from pyroute2.common import uuid32
 from pyroute2.netlink.nlsocket import NetlinkMixin
+from pyroute2.netlink.rtnl.coalesce import Coalescer
 from pyroute2.ndb import dbschema
 from pyroute2.ndb.interface import (Interface,
                                     Bridge,
@@ -148,7 +310,10 @@ from pyroute2.ndb.address import Address
 from pyroute2.ndb.route import Route
 from pyroute2.ndb.neighbour import Neighbour
 from pyroute2.ndb.query import Query
+from pyroute2.ndb.topology import Topology
 from pyroute2.ndb.report import Report
+from pyroute2.ndb.subscription import Subscription
+from pyroute2.ndb.shard import Shard
 try:
     import queue
 except ImportError:
@@ -183,6 +348,14 @@ class MarkFailed(Exception):
     pass
 
 
+class BulkStart(Exception):
+    pass
+
+
+class BulkEnd(Exception):
+    pass
+
+
 class DBMExitException(Exception):
     pass
 
@@ -270,6 +443,54 @@ class Factory(dict):
     def values(self):
         raise NotImplementedError()
 
+    def subscribe(self, match=None, callback=None, maxsize=1024):
+        '''
+        Subscribe to the table changes, see the module docs. The
+        changes are delivered to the callback in a separate thread
+        or, w/o a callback, may be read with `get()`.
+
+        :param match: a dict of the fields to match
+        :param callback: `callback(change, old, new)`
+        :param maxsize: the changes queue size
+        '''
+        iclass = self.classes[self.table]
+        table = iclass.table
+        if table not in self.ndb.schema.spec:
+            # vlan, bridge: the view over ifinfo_* and interfaces
+            table = 'ifinfo_%s' % table
+        cls = self.ndb.schema.classes[table]
+        norm_names = self.ndb.schema.compiled[table]['norm_names']
+        names = norm_names[:1] + norm_names[2:]
+        spec = {}
+        for key, value in (match or {}).items():
+            if key not in names:
+                key = cls.nla2name(key)
+            if key not in names:
+                raise KeyError('key %s not found' % key)
+            spec[key] = value
+        subscription = Subscription(self.ndb, table, names,
+                                    spec, callback, maxsize)
+        self.ndb._subscribe(subscription)
+        return subscription
+
+    def _fetch(self, req, values, pre=None, post=None):
+        #
+        # reports go to a read replica, if any; the statements to
+        # run before and after the request require the main DB
+        #
+        schema = self.ndb.schema
+        if schema.replicas is not None and not (pre or post):
+            for record in schema.fetch_replica(req, values):
+                yield record
+            return
+        with schema.db_lock:
+            for stmt in pre or []:
+                schema.execute(stmt)
+            for record in schema.execute(req, values):
+                yield record
+            for stmt in post or []:
+                schema.execute(stmt)
+
     def _dump(self, match=None):
         iclass = self.classes[self.table]
         cls = iclass.msg_class or self.ndb.schema.classes[iclass.table]
@@ -291,26 +512,17 @@ class Factory(dict):
             spec = ''
         if iclass.dump and iclass.dump_header:
             yield iclass.dump_header
-            with self.ndb.schema.db_lock:
-                for stmt in iclass.dump_pre:
-                    self.ndb.schema.execute(stmt)
-                for record in (self
-                               .ndb
-                               .schema
-                               .execute(iclass.dump + spec, values)):
-                    yield record
-                for stmt in iclass.dump_post:
-                    self.ndb.schema.execute(stmt)
+            for record in self._fetch(iclass.dump + spec,
+                                      values,
+                                      iclass.dump_pre,
+                                      iclass.dump_post):
+                yield record
         else:
             yield ('target', 'tflags') + tuple([cls.nla2name(x) for x in keys])
-            with self.ndb.schema.db_lock:
-                for record in (self
-                               .ndb
-                               .schema
-                               .execute('SELECT * FROM %s AS rs %s'
-                                        % (iclass.view or iclass.table, spec),
-                                        values)):
-                    yield record
+            for record in self._fetch('SELECT * FROM %s AS rs %s'
+                                      % (iclass.view or iclass.table, spec),
+                                      values):
+                yield record
 
     def _csv(self, match=None, dump=None):
         if dump is None:
@@ -334,7 +546,7 @@ class Factory(dict):
             for record in (self
                            .ndb
                            .schema
-                           .fetch(iclass.summary)):
+                           .fetch_replica(iclass.summary)):
                 yield record
         else:
             header = tuple(['f_%s' % x for x in
@@ -345,9 +557,9 @@ class Factory(dict):
             for record in (self
                            .ndb
                            .schema
-                           .fetch('SELECT %s FROM %s'
-                                  % (key_fields,
-                                     iclass.view or iclass.table))):
+                           .fetch_replica('SELECT %s FROM %s'
+                                          % (key_fields,
+                                             iclass.view or iclass.table))):
                 yield record
 
     def csv(self, *argv, **kwarg):
@@ -426,13 +638,16 @@ class Source(object):
                     #
                     self.nl.bind(async_cache=True, clone_socket=True)
                     #
-                    # Initial load -- enqueue the data
+                    # Initial load -- enqueue the data, it goes to
+                    # the DB as one bulk load
                     #
-                    self.evq.put((self.target, (SchemaFlush(), )))
+                    self.evq.put((self.target, (SchemaFlush(),
+                                                BulkStart())))
                     self.evq.put((self.target, self.nl.get_links()))
                     self.evq.put((self.target, self.nl.get_addr()))
                     self.evq.put((self.target, self.nl.get_neighbours()))
                     self.evq.put((self.target, self.nl.get_routes()))
+                    self.evq.put((self.target, (BulkEnd(), )))
                     self.started.set()
                     self.shutdown.clear()
                     self.status = 'running'
@@ -501,8 +716,26 @@ class NDB(object):
                  sources=None,
                  db_provider='sqlite3',
                  db_spec=':memory:',
-                 rtnl_log=False):
-
+                 rtnl_log=False,
+                 coalesce=None,
+                 db_profile=None,
+                 db_replicas=0,
+                 db_indices=None,
+                 db_journal=False,
+                 db_shards=0,
+                 topology=False):
+
+        if db_profile is not None and \
+                (db_provider != 'sqlite3' or
+                 db_profile not in dbschema.profiles):
+            raise ValueError('storage profile not supported')
+        if db_replicas and db_provider == 'sqlite3' and \
+                db_spec != ':memory:' and \
+                dict(dbschema.profiles.get(db_profile, ())) \
+                .get('journal_mode') != 'WAL':
+            raise ValueError('read replicas require the WAL mode')
+        if db_shards and (db_provider != 'sqlite3' or db_replicas):
+            raise ValueError('sharding requires SQLite3 w/o replicas')
         self.ctime = self.gctime = time.time()
         self.schema = None
         self._db = None
@@ -510,7 +743,14 @@ class NDB(object):
         self._dbm_ready = threading.Event()
         self._global_lock = threading.Lock()
         self._event_map = None
+        self._event_map_lock = threading.Lock()
         self._event_queue = queue.Queue()
+        self.coalescer = Coalescer(coalesce) if coalesce else None
+        self.topology = Topology() if topology else None
+        self._subscriptions = {}  # table -> [Subscription(), ...]
+        self._subscriptions_lock = threading.Lock()
+        self.shards = []
+        self._shard_map = {}  # target -> Shard()
         #
         # fix sources prime
         if sources is None:
@@ -524,6 +764,12 @@ class NDB(object):
         self._db_provider = db_provider
         self._db_spec = db_spec
         self._db_rtnl_log = rtnl_log
+        self._db_profile = db_profile
+        self._db_replicas = db_replicas
+        self._db_indices = db_indices
+        self._db_journal = db_journal
+        self._db_shards = db_shards
+        self._db_uri = None
         atexit.register(self.close)
         self._rtnl_objects = set()
         self._dbm_ready.clear()
@@ -537,7 +783,7 @@ class NDB(object):
         self.neighbours = Factory(self, 'neighbours')
         self.vlans = Factory(self, 'vlan')
         self.bridges = Factory(self, 'bridge')
-        self.query = Query(self.schema)
+        self.query = Query(self.schema, topology=self.topology)
 
     def __enter__(self):
         return self
@@ -546,13 +792,76 @@ class NDB(object):
         self.close()
 
     def register_handler(self, event, handler):
-        if event not in self._event_map:
-            self._event_map[event] = []
-        self._event_map[event].append(handler)
+        #
+        # the map is shared by the main loop and the shards
+        #
+        with self._event_map_lock:
+            self._event_map.setdefault(event, []).append(handler)
 
     def execute(self, *argv, **kwarg):
         return self.schema.execute(*argv, **kwarg)
 
+    def get_schema(self, target):
+        '''
+        Return the DB schema that loads the target events: the
+        shard schema in the sharded mode, `ndb.schema` otherwise.
+
+        :param target: node name or UUID
+        '''
+        shard = self._shard_map.get(target)
+        if shard is None:
+            return self.schema
+        return shard.schema
+
+    def _shard(self, target):
+        #
+        # assign a shard to the connected target: a target stays
+        # in the same shard; the new ones go to the shard with the
+        # least sources
+        #
+        if target not in self._shard_map:
+            self._shard_map[target] = min(self.shards,
+                                          key=lambda x: len(x.sources))
+        return self._shard_map[target]
+
+    def _schemas(self):
+        if self.shards:
+            return [x.schema for x in self.shards]
+        return [self.schema]
+
+    def _subscribe(self, subscription):
+        with self._subscriptions_lock:
+            table = subscription.table
+            if table not in self._subscriptions:
+                for schema in self._schemas():
+                    schema.create_changes(table)
+                    schema.commit()
+                self._subscriptions[table] = []
+            self._subscriptions[table].append(subscription)
+
+    def _unsubscribe(self, subscription):
+        with self._subscriptions_lock:
+            table = subscription.table
+            subscriptions = self._subscriptions.get(table, [])
+            if subscription not in subscriptions:
+                return
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._subscriptions[table]
+                for schema in self._schemas():
+                    schema.drop_changes(table)
+                    schema.commit()
+
+    def __changes__(self, schema):
+        #
+        # deliver the changes logged since the last batch
+        #
+        with self._subscriptions_lock:
+            for table, subscriptions in self._subscriptions.items():
+                for change in schema.fetch_changes(table):
+                    for subscription in subscriptions:
+                        subscription.put(*change)
+
     def close(self):
         with self._global_lock:
             if hasattr(atexit, 'unregister'):
@@ -568,10 +877,19 @@ class NDB(object):
                 # release all the sources
                 for target, source in self.sources.items():
                     source.close()
-                # shutdown the _dbm_thread
+                # shutdown the shards and the _dbm_thread
+                for shard in self.shards:
+                    shard.queue.put(('localhost', (DBMExitException(), )))
+                    shard.thread.join()
                 self._event_queue.put(('localhost', (DBMExitException(), )))
                 self._dbm_thread.join()
+                # stop the subscriptions delivery
+                for subscriptions in tuple(self._subscriptions.values()):
+                    for subscription in tuple(subscriptions):
+                        subscription.close()
                 # close the database
+                for shard in self.shards:
+                    shard.close()
                 self.schema.commit()
                 self.schema.close()
 
@@ -589,14 +907,55 @@ class NDB(object):
             # Please be very careful with the DB locks!
             #
             if self._db_provider == 'sqlite3':
-                self._db = sqlite3.connect(self._db_spec,
-                                           check_same_thread=False)
+                if self._db_shards:
+                    #
+                    # the shards are attached to an in-memory DB,
+                    # see DBSchema.attach()
+                    #
+                    self._db = sqlite3.connect(':memory:',
+                                               uri=True,
+                                               check_same_thread=False)
+                elif self._db_replicas and self._db_spec == ':memory:':
+                    #
+                    # the replicas need a shared cache to access
+                    # the in-memory DB
+                    #
+                    self._db_uri = ('file:ndb-%s?mode=memory&cache=shared'
+                                    % uuid32())
+                    self._db = sqlite3.connect(self._db_uri,
+                                               uri=True,
+                                               check_same_thread=False)
+                else:
+                    self._db = sqlite3.connect(self._db_spec,
+                                               check_same_thread=False)
             elif self._db_provider == 'psycopg2':
                 self._db = psycopg2.connect(**self._db_spec)
 
             if self.schema:
                 self.schema.db = self._db
 
+    def __replica__(self):
+        #
+        # open a read-only connection
+        #
+        if self._db_provider == 'sqlite3':
+            if self._db_uri is not None:
+                db = sqlite3.connect(self._db_uri,
+                                     uri=True,
+                                     check_same_thread=False)
+                #
+                # do not wait for the table locks of the shared cache
+                #
+                db.execute('PRAGMA read_uncommitted = 1')
+            else:
+                db = sqlite3.connect(self._db_spec,
+                                     check_same_thread=False)
+            db.execute('PRAGMA query_only = 1')
+        elif self._db_provider == 'psycopg2':
+            db = psycopg2.connect(**self._db_spec)
+            db.set_session(readonly=True, autocommit=True)
+        return db
+
     def disconnect_source(self, target, flush=True):
         '''
         Disconnect an event source from the DB. Raise KeyError if
@@ -607,9 +966,13 @@ class NDB(object):
         # close the source
         self.sources[target].close()
         del self.sources[target]
+        if target in self._shard_map:
+            self._shard_map[target].sources.discard(target)
         #
         if flush:
-            self.schema.flush(target)
+            self.get_schema(target).flush(target)
+            if self.topology is not None:
+                self.topology.flush(target)
 
     def connect_source(self, target, source, event=None):
         '''
@@ -625,20 +988,25 @@ class NDB(object):
         connected.
         '''
         #
-        # flush the DB
-        self.schema.flush(target)
-        #
         # register the channel
         if target in self.sources:
             self.disconnect_source(target)
+        if self.shards:
+            shard = self._shard(target)
+            shard.sources.add(target)
+            evq = shard.queue
+        else:
+            evq = self._event_queue
+        #
+        # flush the DB
+        self.get_schema(target).flush(target)
         try:
             if isinstance(source, NetlinkMixin):
-                self.sources[target] = Source(self._event_queue,
-                                              target, source, event)
+                self.sources[target] = Source(evq, target, source, event)
             elif isinstance(source, dict):
                 iclass = source.pop('class')
                 persistent = source.pop('persistent', False)
-                self.sources[target] = Source(self._event_queue,
+                self.sources[target] = Source(evq,
                                               target, iclass, event,
                                               persistent, **source)
             elif isinstance(source, Source):
@@ -651,67 +1019,167 @@ class NDB(object):
             if target in self.sources:
                 self.sources[target].close()
                 del self.sources[target]
-            self.schema.flush(target)
+            if self.shards:
+                self._shard_map[target].sources.discard(target)
+            self.get_schema(target).flush(target)
             raise
 
-    def __dbm__(self):
+    def _schema_event_map(self, schema):
+        #
+        # the events the sources send to the schema
+        #
+        return {SchemaFlush: [lambda t, x: schema.flush(t)],
+                MarkFailed: [lambda t, x: schema.mark(t, 1)],
+                BulkStart: [lambda t, x: schema.bulk_start(t)],
+                BulkEnd: [lambda t, x: schema.bulk_end(t)]}
 
-        def default_handler(target, event):
-            if isinstance(event, Exception):
-                raise event
-            logging.warning('unsupported event ignored: %s' % type(event))
+    def __dbm__(self):
 
         def check_sources_started(target, event):
             if all([x.started.is_set() for x in self.sources.values()]):
                 self._event_queue.put(('localhost', (self._dbm_ready, )))
 
-        # init the events map
-        event_map = {type(self._dbm_ready): [lambda t, x: x.set()],
-                     SchemaFlush: [lambda t, x: self.schema.flush(t)],
-                     MarkFailed: [lambda t, x: self.schema.mark(t, 1)],
-                     SyncStart: [check_sources_started]}
-        self._event_map = event_map
-
-        event_queue = self._event_queue
+        def sync_shards(target, event):
+            #
+            # wait until the shards load the events enqueued so far
+            #
+            for shard in self.shards:
+                sync = threading.Event()
+                shard.queue.put((target, (sync, )))
+                sync.wait()
+            event.set()
 
         self.__initdb__()
         self.schema = dbschema.init(self._db,
                                     self._db_provider,
                                     self._db_rtnl_log,
-                                    id(threading.current_thread()))
+                                    id(threading.current_thread()),
+                                    self._db_profile,
+                                    self._db_indices)
+        self.schema.journal = self._db_journal
+        if self._db_replicas:
+            self.schema.replicas = queue.Queue()
+            for _ in range(self._db_replicas):
+                self.schema.replicas.put(self.__replica__())
+
+        # init the events map
+        event_map = {SyncStart: [check_sources_started]}
+        if self._db_shards:
+            #
+            # the shards load the events, the main loop serves
+            # only the NDB control events
+            #
+            main_map = {type(self._dbm_ready): [sync_shards]}
+            schema = None
+        else:
+            main_map = {}
+            schema = self.schema
+            event_map[type(self._dbm_ready)] = [lambda t, x: x.set()]
+            event_map.update(self._schema_event_map(schema))
+            for (event, handlers) in schema.event_map.items():
+                event_map[event] = list(handlers)
+        if self.topology is not None:
+            (event_map
+             .setdefault(SchemaFlush, [])
+             .append(lambda t, x: self.topology.flush(t)))
+            for (event, handlers) in self.topology.event_map.items():
+                event_map.setdefault(event, []).extend(handlers)
+        self._event_map = event_map
+
+        if self._db_shards:
+            uid = uuid32()
+            for idx in range(self._db_shards):
+                if self._db_spec == ':memory:':
+                    spec = ('file:ndb-%s-%i?mode=memory&cache=shared'
+                            % (uid, idx))
+                else:
+                    spec = '%s.%i' % (self._db_spec, idx)
+                shard = Shard(self, idx, spec)
+                shard.start()
+                self.shards.append(shard)
+            self.schema.attach([x.spec for x in self.shards])
+
         for target, source in self._nl.items():
             try:
                 self.connect_source(target, source, SyncStart())
             except Exception as e:
                 log.error('could not connect source %s: %s' % (target, e))
 
-        for (event, handlers) in self.schema.event_map.items():
-            for handler in handlers:
-                self.register_handler(event, handler)
+        self.__consume__(self._event_queue, (main_map, event_map), schema)
+
+    def __consume__(self, event_queue, event_maps, schema):
+        #
+        # The events loop of the main thread and the shards. For
+        # every event run the handlers from all the maps, in order.
+        #
+        # :param event_queue: the queue to read
+        # :param event_maps: the handlers maps
+        # :param schema: the schema to commit the batches, if any
+        #
+        def default_handler(target, event):
+            if isinstance(event, Exception):
+                raise event
+            logging.warning('unsupported event ignored: %s' % type(event))
 
+        default = [[default_handler, ]]
         while True:
             target, events = event_queue.get()
-            for event in events:
-                handlers = event_map.get(event.__class__, [default_handler, ])
-                for handler in tuple(handlers):
-                    try:
-                        handler(target, event)
-                    except InvalidateHandlerException:
+            if self.coalescer is None:
+                events = [(target, x) for x in events]
+            else:
+                batch = self.coalescer.drain(event_queue,
+                                             (target, events),
+                                             lambda x: x[1])
+                events = self.coalescer.collapse([(x[0], y) for x in batch
+                                                  for y in x[1]])
+            for target, event in events:
+                chains = [x[event.__class__] for x in event_maps
+                          if event.__class__ in x] or default
+                for handlers in chains:
+                    for handler in tuple(handlers):
                         try:
-                            handlers.remove(handler)
+                            handler(target, event)
+                        except InvalidateHandlerException:
+                            try:
+                                with self._event_map_lock:
+                                    if handler in handlers:
+                                        handlers.remove(handler)
+                            except:
+                                log.error('could not invalidate '
+                                          'event handler:\n%s'
+                                          % traceback.format_exc())
+                        except ShutdownException:
+                            for target, source in self.sources.items():
+                                source.shutdown.set()
+                        except DBMExitException:
+                            return
                         except:
-                            log.error('could not invalidate event handler:\n%s'
-                                      % traceback.format_exc())
-                    except ShutdownException:
-                        for target, source in self.sources.items():
-                            source.shutdown.set()
-                    except DBMExitException:
-                        return
-                    except:
-                        log.error('could not load event:\n%s\n%s'
-                                  % (event, traceback.format_exc()))
+                            log.error('could not load event:\n%s\n%s'
+                                      % (event, traceback.format_exc()))
                 if time.time() - self.gctime > config.gc_timeout:
                     self.gctime = time.time()
                     for wr in tuple(self._rtnl_objects):
                         if wr() is None:
-                            self._rtnl_objects.remove(wr)
+                            self._rtnl_objects.discard(wr)
+            if schema is None:
+                continue
+            #
+            # load the rows batched by the handlers above; with
+            # a storage profile, replicas or shards it is the
+            # transaction boundary
+            try:
+                if schema.profile is None and \
+                        schema.replicas is None and \
+                        schema.shard is None:
+                    schema.flush_batch()
+                else:
+                    schema.commit()
+            except:
+                log.error('could not load events batch:\n%s'
+                          % traceback.format_exc())
+            if self._subscriptions:
+                try:
+                    self.__changes__(schema)
+                except:
+                    log.error('could not deliver the changes:\n%s'
+                              % traceback.format_exc())
@@ -3,9 +3,10 @@ from pyroute2.ndb.report import Report
 
 class Query(object):
 
-    def __init__(self, schema, fmt='raw'):
+    def __init__(self, schema, fmt='raw', topology=None):
         self._schema = schema
         self._fmt = fmt
+        self._topology = topology
 
     def _formatter(self, cursor, fmt=None, header=None, transform=None):
         fmt = fmt or self._fmt
@@ -35,7 +36,10 @@ class Query(object):
         Report all the nodes within the cluster.
         '''
         header = ('nodename',)
-        return Report(self._formatter(self._schema.fetch('''
+        if self._topology is not None:
+            return Report(self._formatter(self._topology.records('nodes'),
+                                          fmt, header))
+        return Report(self._formatter(self._schema.fetch_replica('''
             SELECT DISTINCT f_target
             FROM interfaces
         '''), fmt, header))
@@ -47,7 +51,10 @@ class Query(object):
         '''
         header = ('left_node',
                   'right_node')
-        return Report(self._formatter(self._schema.fetch('''
+        if self._topology is not None:
+            return Report(self._formatter(self._topology.records('p2p'),
+                                          fmt, header))
+        return Report(self._formatter(self._schema.fetch_replica('''
             SELECT DISTINCT
                 l.f_target, r.f_target
             FROM p2p AS l
@@ -77,7 +84,10 @@ class Query(object):
                   'right_node',
                   'right_ifname',
                   'right_lladdr')
-        return Report(self._formatter(self._schema.fetch('''
+        if self._topology is not None:
+            return Report(self._formatter(self._topology.records('l2'),
+                                          fmt, header))
+        return Report(self._formatter(self._schema.fetch_replica('''
         SELECT DISTINCT
             j.f_target, j.f_IFLA_IFNAME, j.f_IFLA_ADDRESS,
             d.f_target, d.f_IFLA_IFNAME, j.f_NDA_LLADDR
@@ -115,7 +125,10 @@ class Query(object):
                   'gateway_address',
                   'dst',
                   'dst_len')
-        return Report(self._formatter(self._schema.fetch('''
+        if self._topology is not None:
+            return Report(self._formatter(self._topology.records('l3'),
+                                          fmt, header))
+        return Report(self._formatter(self._schema.fetch_replica('''
             SELECT DISTINCT
                 r.f_target, a.f_target, a.f_IFA_ADDRESS,
                 r.f_RTA_DST, r.f_dst_len
@@ -26,12 +26,17 @@ class RTNL_Object(dict):
     errors = None
     msg_class = None
     reverse_update = None
+    journal = None  # {table: [record, ...]}, see snapshot()
 
     def __init__(self, view, key, iclass, ctxid=None):
         self.view = view
         self.sources = view.ndb.sources
         self.ctxid = ctxid or id(self)
-        self.schema = view.ndb.schema
+        if isinstance(key, dict):
+            target = key.get('target', 'localhost')
+        else:
+            target = 'localhost'
+        self.schema = view.ndb.get_schema(target)
         self.changed = set()
         self.iclass = iclass
         self.etable = self.table
@@ -98,8 +103,15 @@ class RTNL_Object(dict):
 
     def snapshot(self, ctxid=None):
         snp = type(self)(self.view, self.key, ctxid)
-        self.schema.save_deps(snp.ctxid, weakref.ref(snp), self.iclass)
-        snp.etable = '%s_%s' % (snp.table, snp.ctxid)
+        if self.schema.journal:
+            #
+            # the snapshot object keeps the own values, the journal
+            # keeps the dependencies to restore on rollback
+            #
+            snp.journal = self.schema.save_journal(snp, self.view.classes)
+        else:
+            self.schema.save_deps(snp.ctxid, weakref.ref(snp), self.iclass)
+            snp.etable = '%s_%s' % (snp.table, snp.ctxid)
         snp.changed = set(self.changed)
         return snp
 
@@ -195,7 +207,9 @@ class RTNL_Object(dict):
 
     def check(self):
         self.load_sql()
+        return self.check_state()
 
+    def check_state(self):
         if self.next_scope and self.scope != self.next_scope:
             return False
 
@@ -266,13 +280,20 @@ class RTNL_Object(dict):
         elif scope == 'remove':
             api('del', **idx_req)
 
-        for _ in range(3):
-            if self.check():
-                break
-            self.load_event.wait(1)
+        #
+        # Wait for the RTNL event: load_rtnlmsg() updates the object
+        # from the event in the NDB thread, so there is no need to
+        # poll the DB. Read the DB only if the time is out.
+        #
+        deadline = time.time() + 3
+        while not self.check_state():
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                if self.check():
+                    break
+                raise Exception('timeout while applying changes')
+            self.load_event.wait(timeout)
             self.load_event.clear()
-        else:
-            raise Exception('timeout while applying changes')
 
         #
         if rollback:
@@ -283,23 +304,29 @@ class RTNL_Object(dict):
                         issubclass(cls, type(self)):
                     continue
                 # comprare the tables
-                diff = (self
-                        .schema
-                        .fetch('''
-                               SELECT * FROM %s_%s
-                                   EXCEPT
-                               SELECT * FROM %s
-                               '''
-                               % (table, self.ctxid, table)))
-                for record in diff:
+                if self.journal is not None:
+                    diff = self.schema.journal_diff(table, self.journal)
+                else:
+                    diff = (self
+                            .schema
+                            .fetch('''
+                                   SELECT * FROM %s_%s
+                                       EXCEPT
+                                   SELECT * FROM %s
+                                   '''
+                                   % (table, self.ctxid, table)))
+                for values in diff:
                     record = dict(zip((self
                                        .schema
                                        .compiled[table]['all_names']),
-                                      record))
+                                      values))
                     key = dict([x for x in record.items()
                                 if x[0] in self.schema.compiled[table]['idx']])
                     obj = self.view.get(key, table)
-                    obj.load_sql(ctxid=self.ctxid)
+                    if self.journal is not None:
+                        obj.update(dict(zip(obj.names, values)))
+                    else:
+                        obj.load_sql(ctxid=self.ctxid)
                     obj.scope = 'invalid'
                     obj.next_scope = 'system'
                     try:
@@ -358,9 +385,29 @@ class RTNL_Object(dict):
             elif value != (event.get_attr(name) or event.get(name)):
                 return
 
-        if event['header'].get('type', 0) % 2:
+        if self.schema.ignored(event):
+            #
+            # the DB doesn't load the event, e.g. AF_BRIDGE
+            # RTM_NEWLINK, so the object reloads the DB state
+            #
+            self.load_sql()
+        elif event['header'].get('type', 0) % 2:
             self.scope = 'invalid'
             self.changed = set()
         else:
-            self.load_sql()
+            self.load_rtnl(target, event)
         self.load_event.set()
+
+    def load_rtnl(self, target, event):
+        #
+        # Load the object from the event, the values are the same
+        # as load_netlink() saves to the DB. Snapshots and views
+        # are loaded from the DB.
+        #
+        if self.etable != self.table or self.table not in self.schema.spec:
+            return self.load_sql()
+        values, _ = self.schema.extract(self.table, event)
+        with self.lock:
+            if self.scope != 'remove':
+                self.update(dict(zip(self.names[2:], values)))
+                self.scope = 'system'
@@ -0,0 +1,114 @@
+'''
+Sharded NDB, see the `pyroute2.ndb.main` module docs.
+
+Every shard is an ingestion worker with an own events queue,
+thread and SQLite3 DB. The sources are distributed among the
+shards, so a busy source delays only the sources of its shard.
+'''
+import time
+import sqlite3
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from pyroute2.ndb import dbschema
+
+
+class ShardQueue(queue.Queue):
+    '''
+    The events queue that stamps the items to track the
+    ingestion lag.
+    '''
+
+    def _init(self, maxsize):
+        queue.Queue._init(self, maxsize)
+        self.lag = 0
+
+    def _put(self, item):
+        queue.Queue._put(self, (time.time(), item))
+
+    def _get(self):
+        stamp, item = queue.Queue._get(self)
+        self.lag = time.time() - stamp
+        return item
+
+    def delay(self):
+        '''
+        Return the age of the oldest pending item.
+        '''
+        with self.mutex:
+            if not self.queue:
+                return 0
+            return time.time() - self.queue[0][0]
+
+
+class Shard(object):
+    '''
+    The ingestion worker. All the arguments are required.
+
+    :param ndb: the NDB instance
+    :param index: the shard number
+    :param spec: the SQLite3 DB spec, a path or a URI
+    '''
+
+    def __init__(self, ndb, index, spec):
+        self.ndb = ndb
+        self.index = index
+        self.spec = spec
+        self.queue = ShardQueue()
+        self.schema = None
+        self.sources = set()
+        self.ready = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,
+                                       name='NDB shard %i' % self.index)
+        self.thread.start()
+        self.ready.wait()
+        if self.schema is None:
+            raise RuntimeError('could not start shard %i' % self.index)
+
+    def run(self):
+        ndb = self.ndb
+        try:
+            db = sqlite3.connect(self.spec,
+                                 uri=self.spec.startswith('file:'),
+                                 check_same_thread=False)
+            self.schema = dbschema.init(db,
+                                        'sqlite3',
+                                        ndb._db_rtnl_log,
+                                        id(threading.current_thread()),
+                                        ndb._db_profile,
+                                        ndb._db_indices)
+            self.schema.journal = ndb._db_journal
+            self.schema.shard = self.index
+        finally:
+            self.ready.set()
+        #
+        # the shard handlers go first, then the ones shared by
+        # all the shards: RTNL objects, the topology etc.
+        #
+        event_map = dict(self.schema.event_map)
+        event_map.update(ndb._schema_event_map(self.schema))
+        event_map[type(self.ready)] = [lambda t, x: x.set()]
+        ndb.__consume__(self.queue, (event_map, ndb._event_map), self.schema)
+
+    def stats(self):
+        '''
+        Return the shard metrics:
+
+        * `sources` -- the targets of the shard
+        * `queue` -- the events queue depth
+        * `lag` -- the last dequeued item wait time, seconds
+        * `delay` -- the oldest pending item age, seconds
+        '''
+        return {'sources': list(self.sources),
+                'queue': self.queue.qsize(),
+                'lag': self.queue.lag,
+                'delay': self.queue.delay()}
+
+    def close(self):
+        self.schema.commit()
+        self.schema.close()
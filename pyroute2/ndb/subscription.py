@@ -0,0 +1,96 @@
+import logging
+import threading
+import traceback
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    '''
+    The table changes feed, see `Factory.subscribe()`.
+
+    The changes are `(change, old, new)` tuples: `change` is
+    'insert', 'update' or 'delete', `old` and `new` are the row
+    dicts or None. If the queue is full, the new changes are
+    dropped and counted in `dropped`.
+    '''
+
+    def __init__(self, ndb, table, names,
+                 match=None,
+                 callback=None,
+                 maxsize=1024):
+        self.ndb = ndb
+        self.table = table
+        self.names = names
+        self.match = match or {}
+        self.callback = callback
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread = None
+        if callback is not None:
+            self.thread = threading.Thread(target=self._deliver,
+                                           name='NDB subscription %s'
+                                           % table)
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _match(self, row):
+        if row is None:
+            return False
+        for key, value in self.match.items():
+            if row[key] != value:
+                return False
+        return True
+
+    def _deliver(self):
+        while True:
+            change = self.queue.get()
+            if change is None:
+                return
+            try:
+                self.callback(*change)
+            except Exception:
+                log.error('subscription callback error:\n%s'
+                          % traceback.format_exc())
+
+    def put(self, change, old, new):
+        #
+        # called from the NDB thread; a row matches if either its
+        # old or new values match, so the subscriber sees the rows
+        # leaving the filter
+        #
+        if old is not None:
+            old = dict(zip(self.names, old))
+        if new is not None:
+            new = dict(zip(self.names, new))
+        if self.match and not (self._match(old) or self._match(new)):
+            return
+        try:
+            self.queue.put_nowait((change, old, new))
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, block=True, timeout=None):
+        '''
+        Return the next change, raise `queue.Empty` on timeout.
+        Don't use it with a callback.
+        '''
+        return self.queue.get(block, timeout)
+
+    def close(self):
+        self.ndb._unsubscribe(self)
+        if self.thread is not None:
+            self.queue.put(None)
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
@@ -0,0 +1,413 @@
+'''
+Topology graph
+==============
+
+`Query.nodes()`, `p2p_edges()`, `l2_edges()` and `l3_edges()` join
+the whole DB on every call. With `NDB(topology=True)` the same graph
+is maintained in memory from the events NDB loads, and the reports
+are served from it w/o SQL::
+
+    ndb = NDB(sources=..., topology=True)
+    ndb.query.l2_edges()
+    ndb.topology.adjacency['l2'][('node1', 2)]
+    # -> {('node2', 3): 1}
+
+The graph is updated incrementally: an event touches only the edges
+that depend on the changed object. The adjacency maps a
+`(target, ifindex)` pair to the remote pairs and the number of the
+report lines that join them:
+
+* l2: the neighbour's interface -> the interface with the neighbour's
+  lladdr on another node
+* l3: the route's oif -> the interface with the route's gateway
+  address on another node
+* p2p: a GRE interface -> the GRE interface on another node that
+  uses the local address as the remote one
+
+The report lines changes are delivered to the subscribers, in the
+NDB thread::
+
+    def callback(kind, action, record):
+        # kind: 'nodes', 'p2p', 'l2' or 'l3'
+        # action: 'add' or 'remove'
+        # record: the report line, w/o the header
+        ...
+
+    ndb.topology.subscribe(callback)
+
+Issues: routes dropped by the NDB routes GC are not tracked.
+'''
+import logging
+import threading
+import traceback
+from socket import AF_BRIDGE
+from pyroute2.ndb.dbschema import DBSchema
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+log = logging.getLogger(__name__)
+
+ZERO_LLADDR = '00:00:00:00:00:00'
+
+
+def _key(event, fields):
+    ret = []
+    for field in fields:
+        value = event.get(field)
+        if value is None:
+            value = event.get_attr(field)
+        ret.append(value)
+    return tuple(ret)
+
+
+def _index(index, key, value):
+    index.setdefault(key, set()).add(value)
+
+
+def _unindex(index, key, value):
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+class Topology(object):
+    '''
+    The cluster graph, see the module docs.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.subscribers = []
+        self.adjacency = {'l2': {}, 'l3': {}, 'p2p': {}}
+        self.event_map = {ifinfmsg: [self.load_ifinfmsg],
+                          ifaddrmsg: [self.load_ifaddrmsg],
+                          ndmsg: [self.load_ndmsg],
+                          rtmsg: [self.load_rtmsg]}
+        # report lines -> the number of edges behind them
+        self._records = {'nodes': {}, 'l2': {}, 'l3': {}, 'p2p': {}}
+        # anchor -> [(record, (left, right)), ...]
+        self._edges = {'l2': {}, 'l3': {}, 'p2p': {}}
+        #
+        # objects, the keys start with the target
+        #
+        self._links = {}         # (target, index) -> (ifname, lladdr)
+        self._tunnels = {}       # (target, index) -> (local, remote)
+        self._addresses = set()  # (target, index, address, local)
+        self._neighbours = set()  # (target, ifindex, lladdr)
+        self._routes = {}        # (target, ...) -> (gw, dst, len, oif)
+        #
+        # lookup indices
+        #
+        self._by_lladdr = {}     # lladdr -> {(target, index), ...}
+        self._by_remote = {}     # tunnel remote -> {(target, index), ...}
+        self._by_local = {}      # tunnel local -> {(target, index), ...}
+        self._by_address = {}    # address -> {(target, index): count}
+        self._by_gateway = {}    # gateway -> {route, ...}
+        self._link_addresses = {}   # (target, index) -> {address, ...}
+        self._link_neighbours = {}  # (target, index) -> {neighbour, ...}
+        self._link_routes = {}      # (target, oif) -> {route, ...}
+        self._neighbours_lladdr = {}  # lladdr -> {neighbour, ...}
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.remove(callback)
+
+    def records(self, kind):
+        '''
+        Return the report lines: `kind` is one of 'nodes', 'p2p',
+        'l2' or 'l3'.
+        '''
+        with self.lock:
+            return list(self._records[kind])
+
+    def _notify(self, kind, action, record):
+        for callback in tuple(self.subscribers):
+            try:
+                callback(kind, action, record)
+            except Exception:
+                log.error('topology callback error:\n%s'
+                          % traceback.format_exc())
+
+    def _add(self, kind, record, pair=None):
+        records = self._records[kind]
+        records[record] = records.get(record, 0) + 1
+        if records[record] == 1:
+            self._notify(kind, 'add', record)
+        if pair is not None:
+            remote = self.adjacency[kind].setdefault(pair[0], {})
+            remote[pair[1]] = remote.get(pair[1], 0) + 1
+
+    def _remove(self, kind, record, pair=None):
+        records = self._records[kind]
+        records[record] -= 1
+        if not records[record]:
+            del records[record]
+            self._notify(kind, 'remove', record)
+        if pair is not None:
+            remote = self.adjacency[kind][pair[0]]
+            remote[pair[1]] -= 1
+            if not remote[pair[1]]:
+                del remote[pair[1]]
+                if not remote:
+                    del self.adjacency[kind][pair[0]]
+
+    def _refresh(self, kind, anchors):
+        #
+        # recalculate the edges that start from the anchors; add
+        # the new ones first, so the unchanged edges are not reported
+        #
+        edges = self._edges[kind]
+        build = getattr(self, '_%s_edges' % kind)
+        for anchor in tuple(anchors):
+            old = edges.pop(anchor, ())
+            new = build(anchor)
+            if new:
+                edges[anchor] = new
+            for record, pair in new:
+                self._add(kind, record, pair)
+            for record, pair in old:
+                self._remove(kind, record, pair)
+
+    def _l2_edges(self, anchor):
+        (target, ifindex, lladdr) = anchor
+        link = self._links.get((target, ifindex))
+        if anchor not in self._neighbours or \
+                link[1] in (None, ZERO_LLADDR):
+            return []
+        return [((target, link[0], link[1],
+                  remote[0], self._links[remote][0], lladdr),
+                 ((target, ifindex), remote))
+                for remote in self._by_lladdr.get(lladdr, ())
+                if remote[0] != target]
+
+    def _l3_edges(self, anchor):
+        route = self._routes.get(anchor)
+        if route is None:
+            return []
+        (gateway, dst, dst_len, oif) = route
+        target = anchor[0]
+        remotes = self._by_address.get(gateway, {})
+        # the gateway is a local address
+        if [x for x in remotes if x[0] == target]:
+            return []
+        return [((target, remote[0], gateway, dst, dst_len),
+                 ((target, oif), remote))
+                for remote in remotes]
+
+    def _p2p_edges(self, anchor):
+        tunnel = self._tunnels.get(anchor)
+        if tunnel is None or tunnel[0] is None:
+            return []
+        return [((anchor[0], remote[0]), (anchor, remote))
+                for remote in self._by_remote.get(tunnel[0], ())
+                if remote[0] != anchor[0]]
+
+    #
+    # links
+    #
+    def _set_link(self, key, ifname, lladdr):
+        old = self._links.get(key)
+        if old == (ifname, lladdr):
+            return
+        anchors = set(self._link_neighbours.get(key, ()))
+        anchors |= self._neighbours_lladdr.get(lladdr, set())
+        if old is None:
+            self._add('nodes', key[:1])
+        else:
+            anchors |= self._neighbours_lladdr.get(old[1], set())
+            _unindex(self._by_lladdr, old[1], key)
+        self._links[key] = (ifname, lladdr)
+        if lladdr is not None:
+            _index(self._by_lladdr, lladdr, key)
+        self._refresh('l2', anchors)
+
+    def _del_link(self, key):
+        if key not in self._links:
+            return
+        #
+        # the DB drops the dependent objects with ON DELETE CASCADE
+        #
+        for anchor in tuple(self._link_addresses.get(key, ())):
+            self._del_address(anchor)
+        for anchor in tuple(self._link_neighbours.get(key, ())):
+            self._del_neighbour(anchor)
+        for anchor in tuple(self._link_routes.get(key, ())):
+            self._del_route(anchor)
+        self._del_tunnel(key)
+        (ifname, lladdr) = self._links.pop(key)
+        _unindex(self._by_lladdr, lladdr, key)
+        self._remove('nodes', key[:1])
+        self._refresh('l2', self._neighbours_lladdr.get(lladdr, ()))
+
+    def _set_tunnel(self, key, local, remote):
+        old = self._tunnels.get(key)
+        if old == (local, remote):
+            return
+        anchors = set([key])
+        anchors |= self._by_local.get(remote, set())
+        if old is not None:
+            anchors |= self._by_local.get(old[1], set())
+            _unindex(self._by_local, old[0], key)
+            _unindex(self._by_remote, old[1], key)
+        self._tunnels[key] = (local, remote)
+        _index(self._by_local, local, key)
+        _index(self._by_remote, remote, key)
+        self._refresh('p2p', anchors)
+
+    def _del_tunnel(self, key):
+        if key not in self._tunnels:
+            return
+        (local, remote) = self._tunnels.pop(key)
+        anchors = set([key])
+        anchors |= self._by_local.get(remote, set())
+        _unindex(self._by_local, local, key)
+        _unindex(self._by_remote, remote, key)
+        self._refresh('p2p', anchors)
+
+    def load_ifinfmsg(self, target, event):
+        key = (target, event['index'])
+        with self.lock:
+            #
+            # link goes down: the DB flushes the related routes
+            #
+            if not event['flags'] & 1:
+                for anchor in tuple(self._link_routes.get(key, ())):
+                    self._del_route(anchor)
+            if event.get_attr('IFLA_WIRELESS') or \
+                    event['family'] == AF_BRIDGE:
+                return
+            if event['header'].get('type', 0) % 2:
+                self._del_link(key)
+                return
+            self._set_link(key,
+                           event.get_attr('IFLA_IFNAME'),
+                           event.get_attr('IFLA_ADDRESS'))
+            linkinfo = event.get_attr('IFLA_LINKINFO')
+            if linkinfo is not None and \
+                    linkinfo.get_attr('IFLA_INFO_KIND') == 'gre':
+                ifdata = linkinfo.get_attr('IFLA_INFO_DATA')
+                self._set_tunnel(key,
+                                 ifdata.get_attr('IFLA_GRE_LOCAL'),
+                                 ifdata.get_attr('IFLA_GRE_REMOTE'))
+
+    #
+    # addresses
+    #
+    def _set_address(self, anchor):
+        link = anchor[:2]
+        if anchor in self._addresses or link not in self._links:
+            return
+        self._addresses.add(anchor)
+        _index(self._link_addresses, link, anchor)
+        remotes = self._by_address.setdefault(anchor[2], {})
+        remotes[link] = remotes.get(link, 0) + 1
+        self._refresh('l3', self._by_gateway.get(anchor[2], ()))
+
+    def _del_address(self, anchor):
+        if anchor not in self._addresses:
+            return
+        link = anchor[:2]
+        self._addresses.remove(anchor)
+        _unindex(self._link_addresses, link, anchor)
+        remotes = self._by_address[anchor[2]]
+        remotes[link] -= 1
+        if not remotes[link]:
+            del remotes[link]
+            if not remotes:
+                del self._by_address[anchor[2]]
+        self._refresh('l3', self._by_gateway.get(anchor[2], ()))
+
+    def load_ifaddrmsg(self, target, event):
+        anchor = (target, ) + _key(event, DBSchema.indices['addresses'])
+        with self.lock:
+            if event['header'].get('type', 0) % 2:
+                self._del_address(anchor)
+            else:
+                self._set_address(anchor)
+
+    #
+    # neighbours
+    #
+    def _set_neighbour(self, anchor):
+        link = anchor[:2]
+        if anchor in self._neighbours or link not in self._links:
+            return
+        self._neighbours.add(anchor)
+        _index(self._link_neighbours, link, anchor)
+        _index(self._neighbours_lladdr, anchor[2], anchor)
+        self._refresh('l2', (anchor, ))
+
+    def _del_neighbour(self, anchor):
+        if anchor not in self._neighbours:
+            return
+        self._neighbours.remove(anchor)
+        _unindex(self._link_neighbours, anchor[:2], anchor)
+        _unindex(self._neighbours_lladdr, anchor[2], anchor)
+        self._refresh('l2', (anchor, ))
+
+    def load_ndmsg(self, target, event):
+        if event['ifindex'] == 0:
+            return
+        anchor = (target, ) + _key(event, DBSchema.indices['neighbours'])
+        with self.lock:
+            if event['header'].get('type', 0) % 2:
+                self._del_neighbour(anchor)
+            else:
+                self._set_neighbour(anchor)
+
+    #
+    # routes; only the routes via a gateway make edges
+    #
+    def _set_route(self, anchor, route):
+        old = self._routes.get(anchor)
+        if old == route:
+            return
+        link = (anchor[0], route[3])
+        if route[3] is not None and link not in self._links:
+            self._del_route(anchor)
+            return
+        if old is not None:
+            _unindex(self._by_gateway, old[0], anchor)
+            _unindex(self._link_routes, (anchor[0], old[3]), anchor)
+        self._routes[anchor] = route
+        _index(self._by_gateway, route[0], anchor)
+        _index(self._link_routes, link, anchor)
+        self._refresh('l3', (anchor, ))
+
+    def _del_route(self, anchor):
+        if anchor not in self._routes:
+            return
+        route = self._routes.pop(anchor)
+        _unindex(self._by_gateway, route[0], anchor)
+        _unindex(self._link_routes, (anchor[0], route[3]), anchor)
+        self._refresh('l3', (anchor, ))
+
+    def load_rtmsg(self, target, event):
+        anchor = (target, ) + _key(event, DBSchema.indices['routes'])
+        gateway = event.get_attr('RTA_GATEWAY')
+        with self.lock:
+            if event['header'].get('type', 0) % 2 or gateway is None:
+                self._del_route(anchor)
+            else:
+                self._set_route(anchor, (gateway,
+                                         event.get_attr('RTA_DST'),
+                                         event['dst_len'],
+                                         event.get_attr('RTA_OIF')))
+
+    def flush(self, target):
+        '''
+        Drop all the objects of the target, like `DBSchema.flush()`.
+        '''
+        with self.lock:
+            for anchor in [x for x in self._routes if x[0] == target]:
+                self._del_route(anchor)
+            for key in [x for x in self._links if x[0] == target]:
+                self._del_link(key)
@@ -89,6 +89,8 @@ import logging
 import traceback
 import threading
 
+from itertools import product
+
 from socket import SOCK_DGRAM
 from socket import MSG_PEEK
 from socket import SOL_SOCKET
@@ -274,6 +276,88 @@ class LockFactory(object):
         del self.locks[key]
 
 
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
+class CallbackIndex(object):
+    '''
+    Callbacks table keyed by the message type, the field names
+    and the field values::
+
+        {msg_type: {('index', ): {(2, ): [record, ...]}}}
+
+    A field matches if either the message header field or the
+    NLA with the same name is equal to the value. The lookup
+    cost depends on the number of distinct field sets for the
+    message type, not on the number of callbacks. A field with
+    the None value never matches.
+    '''
+    def __init__(self):
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, msg_type, fields, record):
+        names = tuple(sorted(fields))
+        key = tuple(_freeze(fields[x]) for x in names)
+        with self.lock:
+            (self.index
+             .setdefault(msg_type, {})
+             .setdefault(names, {})
+             .setdefault(key, [])
+             .append(record))
+
+    def remove(self, match):
+        '''
+        Remove the first record for which `match(record)` is True,
+        return the record or None.
+        '''
+        with self.lock:
+            for (msg_type, fields) in tuple(self.index.items()):
+                for (names, keys) in tuple(fields.items()):
+                    for (key, records) in tuple(keys.items()):
+                        for record in records:
+                            if not match(record):
+                                continue
+                            records.remove(record)
+                            if not records:
+                                del keys[key]
+                            if not keys:
+                                del fields[names]
+                            if not fields:
+                                del self.index[msg_type]
+                            return record
+
+    def lookup(self, msg_type, msg):
+        '''
+        Return the list of records matching the message.
+        '''
+        ret = []
+        with self.lock:
+            fields = self.index.get(msg_type)
+            if not fields:
+                return ret
+            for (names, keys) in fields.items():
+                values = []
+                for name in names:
+                    candidates = set((_freeze(msg.get(name, None)), ))
+                    candidates.add(_freeze(msg
+                                           .get_attr(msg.name2nla(name))))
+                    # a missing field matches nothing, even None
+                    candidates.discard(None)
+                    values.append(candidates)
+                for key in product(*values):
+                    ret.extend(keys.get(key, ()))
+        return ret
+
+
 class NetlinkMixin(object):
     '''
     Generic netlink socket
@@ -314,6 +398,7 @@ class NetlinkMixin(object):
         self._rcvbuf = rcvbuf
         self.backlog = {0: []}
         self.callbacks = []     # [(predicate, callback, args), ...]
+        self.callbacks_index = CallbackIndex()
         self.pthread = None
         self.closed = False
         self.uname = config.uname
@@ -392,7 +477,8 @@ class NetlinkMixin(object):
         self.close()
 
     def register_callback(self, callback,
-                          predicate=lambda x: True, args=None):
+                          predicate=lambda x: True, args=None,
+                          msg_type=None, **fields):
         '''
         Register a callback to run on a message arrival.
 
@@ -425,10 +511,33 @@ class NetlinkMixin(object):
         Please note: you do **not** need to register the default 0 queue
         to invoke callbacks on broadcast messages. Callbacks are
         iterated **before** messages get enqueued.
+
+        Every callback registered this way is checked for every
+        message. With many callbacks register them by the message
+        type and, optionally, by the key fields. Such callbacks are
+        looked up in an index, and the predicate, if given, is
+        checked only for the matching messages::
+
+            # only RTM_NEWLINK for the interface index 2
+            ipr.register_callback(cb, msg_type=RTM_NEWLINK, index=2)
+
+            # RTM_NEWROUTE in the main table
+            ipr.register_callback(cb, msg_type=RTM_NEWROUTE, table=254)
+
+        A field matches if either the header field or the NLA with
+        the same name, like `RTA_TABLE`, is equal to the value.
+        Indexed callbacks run **after** messages get enqueued, and
+        outside of the backlog lock, so they do not block other
+        threads reading from the socket.
         '''
         if args is None:
             args = []
-        self.callbacks.append((predicate, callback, args))
+        if msg_type is None:
+            self.callbacks.append((predicate, callback, args))
+        else:
+            self.callbacks_index.add(msg_type,
+                                     fields,
+                                     (predicate, callback, args))
 
     def unregister_callback(self, callback):
         '''
@@ -440,6 +549,7 @@ class NetlinkMixin(object):
             if cr[1] == callback:
                 self.callbacks.pop(cb.index(cr))
                 return
+        self.callbacks_index.remove(lambda x: x[1] == callback)
 
     def register_policy(self, policy, msg_class=None):
         '''
@@ -770,6 +880,7 @@ class NetlinkMixin(object):
                                 self.qsize = current
 
                                 # We've got the data, lock the backlog again
+                                indexed = []
                                 with self.backlog_lock:
                                     for msg in msgs:
                                         seq = msg['header']['sequence_number']
@@ -799,9 +910,26 @@ class NetlinkMixin(object):
                                                 lw = log.warning
                                                 lw("Callback fail: %s" % (cr))
                                                 lw(traceback.format_exc())
+                                        if self.callbacks_index:
+                                            mtype = msg['header']['type']
+                                            indexed.extend(
+                                                (cr, msg) for cr in
+                                                self.callbacks_index
+                                                .lookup(mtype, msg))
                                         # 8<-----------------------------------
                                         self.backlog[seq].append(msg)
 
+                                # Indexed callbacks run outside of the
+                                # backlog lock
+                                for (cr, msg) in indexed:
+                                    try:
+                                        if cr[0](msg):
+                                            cr[1](msg, *cr[2])
+                                    except:
+                                        lw = log.warning
+                                        lw("Callback fail: %s" % (cr))
+                                        lw(traceback.format_exc())
+
                                 # Now wake up other threads
                                 self.change_master.set()
                             finally:
@@ -913,7 +1041,7 @@ class BatchSocket(NetlinkMixin):
         msg.encode()
 
     def get(self, *argv, **kwarg):
-        pass
+        return []
 
 
 class NetlinkSocket(NetlinkMixin):
@@ -0,0 +1,171 @@
+'''
+Events coalescing
+=================
+
+During a link flap or a routing reconvergence one object may
+change many times per second, and the consumers process all
+the intermediate states. The coalescer collapses successive
+updates of the same object into one, the latest one::
+
+    coalescer = Coalescer({'route': 0.1, 'neigh': 0})
+    msg = evq.get()
+    batch = coalescer.drain(evq, msg)
+    for (source, msg) in coalescer.collapse([(None, x) for x in batch]):
+        ...
+
+The spec maps an event class to the time window, in seconds:
+`drain()` collects the events for that time, or, if the window
+is 0, until the queue is empty. Event classes: `link`, `addr`,
+`neigh` and `route`; other events are not coalesced.
+
+Only the last event for every object key is delivered: e.g.,
+`RTM_NEWROUTE` followed by `RTM_DELROUTE` is delivered as one
+`RTM_DELROUTE`. Events that can not be coalesced are barriers:
+updates are never moved across them. The number of dropped
+events is counted per class in `coalescer.suppressed`.
+'''
+import time
+from pyroute2.config import AF_BRIDGE
+from pyroute2.netlink import nlmsg
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+classes = {'RTM_NEWLINK': 'link',
+           'RTM_DELLINK': 'link',
+           'RTM_NEWADDR': 'addr',
+           'RTM_DELADDR': 'addr',
+           'RTM_NEWNEIGH': 'neigh',
+           'RTM_DELNEIGH': 'neigh',
+           'RTM_NEWROUTE': 'route',
+           'RTM_DELROUTE': 'route'}
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(x) for x in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for (k, v) in value.items()))
+    return value
+
+
+def object_key(cls, msg):
+    '''
+    Return the object key for the event of the class. The family is
+    a part of every key: e.g. AF_BRIDGE RTM_NEWLINK is not a state
+    of the AF_UNSPEC link object.
+    '''
+    if cls == 'link':
+        return (cls,
+                msg['family'],
+                msg['index'])
+    elif cls == 'addr':
+        return (cls,
+                msg['family'],
+                msg['index'],
+                msg.get_attr('IFA_ADDRESS'),
+                msg['prefixlen'])
+    elif cls == 'neigh':
+        if msg['family'] == AF_BRIDGE:
+            # FDB records have no NDA_DST
+            return (cls,
+                    msg['family'],
+                    msg['ifindex'],
+                    msg.get_attr('NDA_LLADDR'),
+                    msg.get_attr('NDA_VLAN'))
+        return (cls,
+                msg['family'],
+                msg['ifindex'],
+                msg.get_attr('NDA_DST'))
+    elif cls == 'route':
+        return (cls,
+                msg['family'],
+                msg.get_attr('RTA_TABLE', msg['table']),
+                _hashable(msg.get_attr('RTA_DST')),
+                msg['dst_len'],
+                msg['tos'],
+                msg.get_attr('RTA_PRIORITY'))
+
+
+class Coalescer(object):
+    '''
+    Coalesce events according to the spec, see the module docs.
+
+        - spec -- event class -> time window
+        - limit -- max events to collect at once
+    '''
+    def __init__(self, spec, limit=8192):
+        self.spec = dict(spec)
+        self.limit = limit
+        self.suppressed = dict([(x, 0) for x in self.spec])
+
+    def _class(self, event):
+        if not isinstance(event, nlmsg):
+            return None
+        cls = classes.get(event.get('event'))
+        if cls in self.spec:
+            return cls
+        return None
+
+    def key(self, event):
+        '''
+        Return the object key, or `None` if the event can not be
+        coalesced.
+        '''
+        cls = self._class(event)
+        if cls is None:
+            return None
+        return object_key(cls, event)
+
+    def window(self, events):
+        '''
+        Return the time window for the events.
+        '''
+        return max([self.spec.get(self._class(x), 0) for x in events] +
+                   [0])
+
+    def drain(self, evq, item, unpack=None):
+        '''
+        Collect items from the queue, starting with the `item`
+        already taken from it. `unpack(item)` must return the
+        events of the item, by default the item is one event.
+        '''
+        unpack = unpack or (lambda x: (x, ))
+        ret = [item]
+        started = time.time()
+        window = self.window(unpack(item))
+        while len(ret) < self.limit:
+            timeout = started + window - time.time()
+            try:
+                if timeout > 0:
+                    item = evq.get(timeout=timeout)
+                else:
+                    item = evq.get_nowait()
+            except queue.Empty:
+                break
+            evq.task_done()
+            ret.append(item)
+            window = max(window, self.window(unpack(item)))
+        return ret
+
+    def collapse(self, pairs):
+        '''
+        Collapse the list of `(source, event)` pairs, keeping
+        the order of the delivered events.
+        '''
+        ret = []
+        last = {}
+        for (source, event) in pairs:
+            key = self.key(event)
+            if key is None:
+                # a barrier
+                last = {}
+            else:
+                key = (source, key)
+                if key in last:
+                    ret[last[key]] = None
+                    self.suppressed[key[1][0]] += 1
+                last[key] = len(ret)
+            ret.append((source, event))
+        return [x for x in ret if x is not None]
@@ -489,15 +489,25 @@ class ifinfbase(object):
                     netns_path = self.value
                 else:
                     netns_path = '%s/%s' % (self.netns_run_dir, self.value)
-                self.netns_fd = os.open(netns_path, os.O_RDONLY)
-                self['value'] = self.netns_fd
-                self.register_clean_cb(self.close)
+                if config.netns_fd_cache:
+                    # the fd is owned by the cache, see pyroute2.netns
+                    from pyroute2.netns import cache
+                    self['value'] = cache.acquire(netns_path)
+                    self.register_clean_cb(self.release)
+                else:
+                    self.netns_fd = os.open(netns_path, os.O_RDONLY)
+                    self['value'] = self.netns_fd
+                    self.register_clean_cb(self.close)
             nla.encode(self)
 
         def close(self):
             if self.netns_fd is not None:
                 os.close(self.netns_fd)
 
+        def release(self):
+            from pyroute2.netns import cache
+            cache.release(self['value'])
+
     class vflist(nla):
         nla_map = (('IFLA_VF_INFO_UNSPEC', 'none'),
                    ('IFLA_VF_INFO', 'vfinfo'))
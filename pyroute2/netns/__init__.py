@@ -55,6 +55,17 @@ One can even start `IPDB` on the top of `NetNS`::
     # do some stuff within the netns
     ipdb.release()
 
+Run an operation in many netns
+------------------------------
+
+`fanout()` runs the same call concurrently in a list of namespaces,
+reusing cached netns handles between the calls, see
+`pyroute2.netns.pool` for details::
+
+    from pyroute2 import netns
+    for (name, links, error) in netns.fanout(names, 'get_links'):
+        ...
+
 Spawn a process within a netns
 ------------------------------
 
@@ -70,6 +81,28 @@ These functions are described below. To use them, import
     from pyroute2 import netns
     netns.listnetns()
 
+Netns fd cache
+--------------
+
+Resolving a netns name means `open()` and `close()` on every call.
+The module provides a process-wide cache of netns file descriptors,
+`netns.cache`; to use it in `setns()` and in `net_ns_fd` link
+requests, enable it in the config::
+
+    from pyroute2 import config
+    config.netns_fd_cache = True
+
+Every lookup still costs one `stat()` call, that detects netns
+removal and re-creation under the same name. The cache hit/miss
+counters are available with `netns.cache.stats()`.
+
+Please keep in mind, that an open fd keeps the netns alive. The
+`remove()` call drops the fd from the cache, but a netns removed
+by other tools stays in the system until the next lookup of the
+same name or until `netns.cache.purge()`.
+
+To get netns ids for all the namespaces at once, use `listnsid()`.
+
 Please be aware, that in order to run system calls the
 library uses `ctypes` module. It can fail on platforms
 where SELinux is enforced. If the Python interpreter,
@@ -85,6 +118,7 @@ import ctypes
 import ctypes.util
 import pickle
 import struct
+import threading
 import traceback
 from pyroute2 import config
 from pyroute2.common import basestring
@@ -123,6 +157,131 @@ def _get_netnspath(name):
     return netnspath
 
 
+class NetNSCache(object):
+    '''
+    Process-wide cache of open netns file descriptors.
+
+    Netns files are tracked by the path and by `(st_dev, st_ino)` of
+    the netns inode, so several paths to the same netns share one fd.
+
+    `acquire()` returns an fd, that stays valid until `release()`,
+    even if the cache entry is invalidated meanwhile.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}     # path -> inode
+        self.inodes = {}    # inode -> record
+        self.fds = {}       # fd -> record
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, netns):
+        '''
+        Get an open fd for the netns name or path.
+        '''
+        path = _get_netnspath(netns)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(netns)
+            raise
+        inode = (st.st_dev, st.st_ino)
+        with self.lock:
+            if self.paths.get(path) != inode:
+                # not cached or the netns is re-created
+                self._drop_path(path)
+            record = self.inodes.get(inode)
+            if record is not None:
+                self.hits += 1
+                record['paths'].add(path)
+                record['refs'] += 1
+                self.paths[path] = inode
+                return record['fd']
+            self.misses += 1
+        fd = os.open(path, os.O_RDONLY)
+        st = os.fstat(fd)
+        inode = (st.st_dev, st.st_ino)
+        with self.lock:
+            record = self.inodes.get(inode)
+            if record is None:
+                record = {'fd': fd,
+                          'paths': set(),
+                          'refs': 0}
+                self.inodes[inode] = record
+                self.fds[fd] = record
+            else:
+                # opened by another thread meanwhile
+                os.close(fd)
+            self._drop_path(path)
+            record['paths'].add(path)
+            record['refs'] += 1
+            self.paths[path] = inode
+            return record['fd']
+
+    def release(self, fd):
+        '''
+        Release an fd got with `acquire()`.
+        '''
+        with self.lock:
+            record = self.fds.get(fd)
+            if record is None:
+                return
+            record['refs'] -= 1
+            if not record['refs'] and not record['paths']:
+                self._close(record)
+
+    def _close(self, record):
+        del self.fds[record['fd']]
+        os.close(record['fd'])
+
+    def _drop_path(self, path):
+        inode = self.paths.pop(path, None)
+        record = self.inodes.get(inode)
+        if record is None:
+            return
+        record['paths'].discard(path)
+        if not record['paths']:
+            del self.inodes[inode]
+            if not record['refs']:
+                self._close(record)
+
+    def invalidate(self, netns=None):
+        '''
+        Drop the netns from the cache, or all the cache entries,
+        if netns is not specified.
+        '''
+        with self.lock:
+            if netns is None:
+                paths = tuple(self.paths)
+            else:
+                paths = (_get_netnspath(netns), )
+            for path in paths:
+                self._drop_path(path)
+
+    def purge(self):
+        '''
+        Drop the entries for removed or re-created netns.
+        '''
+        with self.lock:
+            for (path, inode) in tuple(self.paths.items()):
+                try:
+                    st = os.stat(path)
+                    if (st.st_dev, st.st_ino) == inode:
+                        continue
+                except OSError:
+                    pass
+                self._drop_path(path)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.inodes)}
+
+
+cache = NetNSCache()
+
+
 def listnetns(nspath=None):
     '''
     List available network namespaces.
@@ -140,6 +299,41 @@ def listnetns(nspath=None):
             raise
 
 
+def listnsid(nspath=None, ipr=None):
+    '''
+    Return a dict `{name: nsid}` for all the netns in the directory.
+    The netns ids are those seen from the current netns, -1 means no
+    id assigned. An `IPRoute` instance may be provided by `ipr`.
+    '''
+    from pyroute2.iproute.linux import IPRoute
+    if config.netns_fd_cache:
+        acquire, release = cache.acquire, cache.release
+    else:
+        acquire, release = _open_netns, os.close
+    nsdir = nspath or NETNS_RUN_DIR
+    ret = {}
+    nl = ipr or IPRoute()
+    try:
+        for name in listnetns(nsdir):
+            try:
+                fd = acquire(os.path.join(nsdir, name))
+            except OSError:
+                # removed meanwhile
+                continue
+            try:
+                ret[name] = nl.get_netnsid(fd=fd)
+            finally:
+                release(fd)
+    finally:
+        if ipr is None:
+            nl.close()
+    return ret
+
+
+def _open_netns(netns):
+    return os.open(_get_netnspath(netns), os.O_RDONLY)
+
+
 def _create(netns, libc=None):
     libc = libc or ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
     netnspath = _get_netnspath(netns)
@@ -208,6 +402,7 @@ def remove(netns, libc=None):
     '''
     libc = libc or ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
     netnspath = _get_netnspath(netns)
+    cache.invalidate(netns)
     libc.umount2(netnspath, MNT_DETACH)
     os.unlink(netnspath)
 
@@ -226,17 +421,22 @@ def setns(netns, flags=os.O_CREAT, libc=None):
     not provided via arguments.
     '''
     newfd = False
+    cached = False
     libc = libc or ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
     if isinstance(netns, basestring):
         netnspath = _get_netnspath(netns)
-        if os.path.basename(netns) in listnetns(os.path.dirname(netns)):
+        if os.path.exists(netnspath):
             if flags & (os.O_CREAT | os.O_EXCL) == (os.O_CREAT | os.O_EXCL):
                 raise OSError(errno.EEXIST, 'netns exists', netns)
         else:
             if flags & os.O_CREAT:
                 create(netns, libc=libc)
-        nsfd = os.open(netnspath, os.O_RDONLY)
-        newfd = True
+        if config.netns_fd_cache:
+            nsfd = cache.acquire(netns)
+            cached = True
+        else:
+            nsfd = os.open(netnspath, os.O_RDONLY)
+            newfd = True
     elif isinstance(netns, file):
         nsfd = netns.fileno()
     elif isinstance(netns, int):
@@ -246,5 +446,19 @@ def setns(netns, flags=os.O_CREAT, libc=None):
     error = libc.syscall(__NR_setns, nsfd, CLONE_NEWNET)
     if newfd:
         os.close(nsfd)
+    elif cached:
+        cache.release(nsfd)
     if error != 0:
         raise OSError(ctypes.get_errno(), 'failed to open netns', netns)
+
+
+def fanout(names, fn, workers=16):
+    '''
+    Run `fn(nl)` concurrently for every netns name, where `nl`
+    is the netns handle, or call the `nl` method, if `fn` is a
+    string. The operations start right away; return an iterator of
+    `(name, result, error)` tuples in the order of completion. Handles
+    are cached in a process-wide pool.
+    '''
+    from pyroute2.netns.pool import default_pool
+    return default_pool().fanout(names, fn, workers)
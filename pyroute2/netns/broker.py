@@ -0,0 +1,350 @@
+'''
+NetNS broker
+============
+
+Every `NetNS` object forks a proxy process. With thousands of
+network namespaces that means thousands of idle processes and
+pipes. The broker is one helper process, that holds netlink
+sockets for many namespaces and serves all of them over one
+channel::
+
+    from pyroute2 import NetNS
+    from pyroute2 import NetNSBroker
+
+    broker = NetNSBroker()
+    ns = [NetNS('test%i' % x, broker=broker) for x in range(1000)]
+    ...
+    for x in ns:
+        x.close()
+    broker.close()
+
+The broker opens the netlink socket for a namespace with
+`setns()` and returns back to its own namespace right after
+that, so it may serve any number of namespaces. Requests are
+tagged with the channel id, one channel per `NetNS` object.
+The requests that pass the userspace proxy, like tuntap or
+team interfaces, and the sockets created later, e.g. with
+`bind(clone_socket=True)`, switch to the channel namespace
+for the time of the call.
+
+`NetNS` objects, attached to a broker, provide the same API as
+standalone ones. Closing the broker closes all the channels.
+'''
+
+import os
+import errno
+import signal
+import select
+import atexit
+import logging
+import threading
+from pyroute2 import config
+from pyroute2.common import AddrPool
+from pyroute2.netns import setns
+from pyroute2.netns.nslink import FD
+from pyroute2.remote import Endpoint
+from pyroute2.remote import Transport
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+
+class BrokerEndpoint(Endpoint):
+    '''
+    The broker channel server side. Keeps the channel netns fd
+    to run there the requests, see `Endpoint.execute()`.
+    '''
+    def __init__(self, trnsp_out, channel, netns, home):
+        super(BrokerEndpoint, self).__init__(trnsp_out, channel)
+        self.netns = netns
+        self.home = home
+
+    def execute(self, func, *argv, **kwarg):
+        setns(self.netns)
+        try:
+            return func(*argv, **kwarg)
+        finally:
+            setns(self.home)
+
+    def close(self):
+        try:
+            super(BrokerEndpoint, self).close()
+        finally:
+            os.close(self.netns)
+
+
+def BrokerServer(trnsp_in, trnsp_out):
+    '''
+    The broker process loop. Channel 0 is the broker control
+    channel, all the rest are served by `Endpoint` objects.
+    '''
+
+    def stop_server(signum, frame):
+        BrokerServer.run = False
+
+    BrokerServer.run = True
+    signal.signal(signal.SIGTERM, stop_server)
+
+    self_ns = os.open('/proc/self/ns/net', os.O_RDONLY)
+    endpoints = {}  # channel -> Endpoint
+    sockets = {}    # fd -> Endpoint
+    poll = select.poll()
+    poll.register(trnsp_in.fileno(), select.POLLIN | select.POLLPRI)
+
+    def update(endpoint):
+        for fd in endpoint.sockets:
+            if fd not in sockets:
+                sockets[fd] = endpoint
+                poll.register(fd, select.POLLIN | select.POLLPRI)
+
+    def detach(endpoint):
+        for fd in endpoint.sockets:
+            poll.unregister(fd)
+            del sockets[fd]
+        del endpoints[endpoint.channel]
+        endpoint.close()
+        trnsp_out.send({'stage': 'detach',
+                        'error': None}, endpoint.channel)
+
+    trnsp_out.send({'stage': 'init',
+                    'uname': config.uname,
+                    'error': None})
+
+    # 8<-------------------------------------------------------------
+    while BrokerServer.run:
+        try:
+            events = poll.poll()
+        except:
+            continue
+        for (fd, event) in events:
+            if fd in sockets:
+                sockets[fd].serve_broadcast(fd)
+                continue
+            cmd = trnsp_in.recv_cmd()
+            if cmd['channel'] == 0:
+                if cmd['stage'] == 'shutdown':
+                    for endpoint in tuple(endpoints.values()):
+                        detach(endpoint)
+                    os.close(self_ns)
+                    return
+                elif cmd['stage'] == 'attach':
+                    channel = cmd['attach']
+                    try:
+                        setns(cmd['netns'], cmd['flags'])
+                        nsfd = None
+                        try:
+                            nsfd = os.open('/proc/self/ns/net',
+                                           os.O_RDONLY)
+                            endpoint = BrokerEndpoint(trnsp_out,
+                                                      channel,
+                                                      nsfd,
+                                                      self_ns)
+                        except Exception:
+                            if nsfd is not None:
+                                os.close(nsfd)
+                            raise
+                        finally:
+                            setns(self_ns)
+                    except Exception as e:
+                        trnsp_out.send({'stage': 'init',
+                                        'error': e}, channel)
+                        trnsp_out.send({'stage': 'detach',
+                                        'error': None}, channel)
+                        continue
+                    endpoints[channel] = endpoint
+                    update(endpoint)
+                    endpoint.init()
+                continue
+            endpoint = endpoints.get(cmd['channel'])
+            if endpoint is None:
+                continue
+            if cmd['stage'] == 'shutdown':
+                detach(endpoint)
+            else:
+                endpoint.serve_cmd(cmd)
+                if cmd['stage'] == 'command':
+                    update(endpoint)
+
+
+class BrokerChannel(object):
+    '''
+    One channel of the broker transport. Provides both incoming
+    and outgoing transport API for `RemoteSocket`.
+    '''
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.file_obj = self
+        self.lock = threading.Lock()
+        self.brd_queue = queue.Queue()
+        self.cmd_queue = queue.Queue()
+        self.route = None
+        self.down = None
+        self.closed = False
+
+    @property
+    def binary(self):
+        return self.broker.trnsp_out.binary
+
+    @binary.setter
+    def binary(self, value):
+        self.broker.trnsp_out.binary = value
+
+    def send(self, obj):
+        return self.broker.trnsp_out.send(obj, self.channel)
+
+    def send_raw(self, frame, data=b''):
+        return self.broker.trnsp_out.send_raw(frame, data, self.channel)
+
+    def put(self, msg):
+        with self.lock:
+            if self.closed:
+                return
+            if self.route is None:
+                self.cmd_queue.put(msg)
+                return
+        self.route(msg)
+
+    def recv_cmd(self):
+        return self.cmd_queue.get()
+
+    def demux(self, route, down):
+        with self.lock:
+            while not self.cmd_queue.empty():
+                route(self.cmd_queue.get())
+            self.route = route
+            self.down = down
+
+    def close(self, reason=None):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        if self.down is not None:
+            self.down(reason)
+        else:
+            # the RemoteSocket init is not complete, terminate it
+            self.cmd_queue.put({'stage': 'init',
+                                'error': IOError(errno.ECOMM,
+                                                 'broker channel closed')})
+
+
+class NetNSBroker(object):
+    '''
+    The broker client. Forks the broker process and runs the
+    demultiplexer thread, that routes messages to the channels.
+    Use it as `NetNS(name, broker=broker)`.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.channel_ids = AddrPool(minaddr=1, maxaddr=0xffff)
+        self.closed = False
+        trnsp_in, remote_trnsp_out = [Transport(FD(x))
+                                      for x in os.pipe()]
+        remote_trnsp_in, trnsp_out = [Transport(FD(x))
+                                      for x in os.pipe()]
+
+        self.child = os.fork()
+        if self.child == 0:
+            # child process
+            trnsp_in.file_obj.close()
+            trnsp_out.file_obj.close()
+            try:
+                BrokerServer(remote_trnsp_in, remote_trnsp_out)
+            finally:
+                os._exit(0)
+
+        remote_trnsp_in.file_obj.close()
+        remote_trnsp_out.file_obj.close()
+        self.trnsp_in = trnsp_in
+        self.trnsp_out = trnsp_out
+        try:
+            init = self.trnsp_in.recv_cmd()
+            if init['error'] is not None:
+                raise init['error']
+        except Exception:
+            self.close()
+            raise
+        self.uname = init['uname']
+        self._demux_thread = threading.Thread(target=self._demux,
+                                              name='NetNS broker demux')
+        self._demux_thread.setDaemon(True)
+        self._demux_thread.start()
+        atexit.register(self.close)
+
+    def _demux(self):
+        error = None
+        while True:
+            try:
+                msg = self.trnsp_in.recv_frame()
+            except Exception as e:
+                error = e
+                break
+            with self.lock:
+                channel = self.channels.get(msg['channel'])
+                if msg['stage'] == 'detach' and channel is not None:
+                    # the server side is closed, the id may be reused
+                    del self.channels[msg['channel']]
+                    self.channel_ids.free(msg['channel'])
+            if channel is not None:
+                channel.put(msg)
+        with self.lock:
+            channels = tuple(self.channels.values())
+            self.channels = {}
+        for channel in channels:
+            channel.close(error)
+        try:
+            self.trnsp_in.file_obj.close()
+        except Exception:
+            pass
+
+    def channel(self, netns, flags=os.O_CREAT):
+        '''
+        Open a channel to the netns.
+        '''
+        with self.lock:
+            if self.closed:
+                raise IOError(errno.ECOMM, 'broker is closed')
+            channel = BrokerChannel(self, self.channel_ids.alloc())
+            self.channels[channel.channel] = channel
+        self.trnsp_out.send({'stage': 'attach',
+                             'attach': channel.channel,
+                             'netns': netns,
+                             'flags': flags})
+        return channel
+
+    def _cleanup_atexit(self):
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
+        else:
+            try:
+                atexit._exithandlers.remove((self.close, (), {}))
+            except ValueError:
+                pass
+
+    def close(self):
+        '''
+        Shut down the broker and all its channels.
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self._cleanup_atexit()
+        try:
+            self.trnsp_out.send({'stage': 'shutdown'})
+        except Exception:
+            pass
+        try:
+            self.trnsp_out.file_obj.close()
+        except Exception:
+            pass
+        try:
+            os.kill(self.child, signal.SIGTERM)
+            os.waitpid(self.child, 0)
+        except OSError:
+            pass
@@ -62,6 +62,13 @@ To remove a network namespace::
 One should stop it first with `close()`, and only after that
 run `remove()`.
 
+To serve many namespaces with one helper process instead of
+a process per namespace, use a broker, see `pyroute2.netns.broker`::
+
+    from pyroute2 import NetNSBroker
+    broker = NetNSBroker()
+    netns = NetNS('test', broker=broker)
+
 '''
 
 import os
@@ -87,6 +94,12 @@ class FD(object):
         self.fd = fd
         for name in ('read', 'write', 'close'):
             setattr(self, name, partial(getattr(os, name), self.fd))
+        if hasattr(os, 'readv'):
+            # Python 3.3+: read directly into the transport buffers
+            self.readinto = self._readinto
+
+    def _readinto(self, buf):
+        return os.readv(self.fd, [buf])
 
     def fileno(self):
         return self.fd
@@ -132,9 +145,23 @@ class NetNS(RTNL_API, RemoteSocket):
     Do not forget to call `release()` when the work is done. It will shut
     down `NetNS` instance as well.
     '''
-    def __init__(self, netns, flags=os.O_CREAT):
+    def __init__(self, netns, flags=os.O_CREAT, broker=None):
         self.netns = netns
         self.flags = flags
+        self.broker = broker
+        self.child = None
+        if broker is not None:
+            # no own proxy process, use a channel to the broker
+            trnsp_in = trnsp_out = broker.channel(netns, flags)
+            try:
+                super(NetNS, self).__init__(trnsp_in, trnsp_out)
+            except Exception:
+                self.close()
+                raise
+            atexit.register(self.close)
+            self.marshal = MarshalRtnl()
+            return
+
         trnsp_in, self.remote_trnsp_out = [Transport(FD(x))
                                            for x in os.pipe()]
         self.remote_trnsp_in, trnsp_out = [Transport(FD(x))
@@ -167,8 +194,13 @@ class NetNS(RTNL_API, RemoteSocket):
                 os._exit(0)
 
         try:
-            self.remote_trnsp_in.close()
-            self.remote_trnsp_out.close()
+            #
+            # close the child ends of the pipes, so the demux thread
+            # gets EOF and fails the requests if the child dies
+            #
+            self.remote_trnsp_in.file_obj.close()
+            self.remote_trnsp_out.file_obj.close()
+            self.remote_trnsp_in = self.remote_trnsp_out = None
             super(NetNS, self).__init__(trnsp_in, trnsp_out)
         except Exception:
             self.close()
@@ -177,7 +209,7 @@ class NetNS(RTNL_API, RemoteSocket):
         self.marshal = MarshalRtnl()
 
     def clone(self):
-        return type(self)(self.netns, self.flags)
+        return type(self)(self.netns, self.flags, self.broker)
 
     def _cleanup_atexit(self):
         if hasattr(atexit, 'unregister'):
@@ -200,6 +232,8 @@ class NetNS(RTNL_API, RemoteSocket):
                 pass
             log.error('forced shutdown procedure, clean up netns manually')
 
+        if self.child is None:
+            return
         try:
             os.kill(self.child, signal.SIGTERM)
             os.waitpid(self.child, 0)
@@ -0,0 +1,169 @@
+'''
+NetNS pool
+==========
+
+Run the same operation in many network namespaces at once::
+
+    from pyroute2.netns.pool import NetNSPool
+
+    pool = NetNSPool()
+    for (name, ret, error) in pool.fanout(names, 'get_links'):
+        if error is not None:
+            print('%s failed: %s' % (name, error))
+        ...
+
+    # an operation with arguments
+    def up(nl):
+        idx = nl.link_lookup(ifname='eth0')[0]
+        return nl.link('set', index=idx, state='up')
+
+    errors = [x for x in pool.fanout(names, up) if x[2] is not None]
+    pool.close()
+
+The pool keeps `NetNS` handles open between the calls, so the
+next fan-out over the same namespaces costs no setup. By default
+all the handles are served by one `NetNSBroker` process.
+
+The operations start right away, `fanout()` returns an iterator
+of `(name, result, error)` tuples in the order of completion, so
+the results may be dropped in fire-and-forget calls; an error in
+one namespace doesn't affect others.
+The handle is dropped from the cache if its channel is broken,
+so the next call opens it again.
+
+The same is available as `pyroute2.netns.fanout()`, that uses
+a process-wide default pool.
+'''
+
+import atexit
+import threading
+from pyroute2.netns.nslink import NetNS
+from pyroute2.netns.broker import NetNSBroker
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class NetNSPool(object):
+    '''
+    A cache of `NetNS` handles with concurrent fan-out.
+
+        - broker -- `True` to start own `NetNSBroker`, `None` to
+          fork a process per netns, or an existing broker object
+        - flags -- `NetNS` flags, 0 means do not create netns
+        - workers -- default number of worker threads
+    '''
+    def __init__(self, broker=True, flags=0, workers=16):
+        self.own_broker = broker is True
+        self.broker = NetNSBroker() if self.own_broker else broker
+        self.flags = flags
+        self.workers = workers
+        self.handles = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _lock(self, name):
+        with self.lock:
+            if name not in self.locks:
+                self.locks[name] = threading.Lock()
+            return self.locks[name]
+
+    def get(self, name):
+        '''
+        Get the cached handle for the netns, open it if required.
+        '''
+        with self._lock(name):
+            nl = self.handles.get(name)
+            if nl is None:
+                nl = NetNS(name, flags=self.flags, broker=self.broker)
+                self.handles[name] = nl
+            return nl
+
+    def drop(self, name):
+        '''
+        Close the handle and remove it from the cache.
+        '''
+        with self._lock(name):
+            nl = self.handles.pop(name, None)
+        if nl is not None:
+            try:
+                nl.close()
+            except Exception:
+                pass
+
+    def fanout(self, names, fn, workers=None):
+        '''
+        Run `fn(nl)` for every netns in `names`, where `nl` is the
+        netns handle. `fn` may be also a method name, e.g.
+        `'get_links'`. The operations start right away, not on the
+        first iteration. Return an iterator of `(name, result, error)`
+        tuples, that yields them as soon as the operations complete.
+        '''
+        names = list(names)
+        workers = min(workers or self.workers, len(names))
+        tasks = queue.Queue()
+        results = queue.Queue()
+        for name in names:
+            tasks.put(name)
+
+        def worker():
+            while True:
+                try:
+                    name = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                nl = ret = error = None
+                try:
+                    nl = self.get(name)
+                    if callable(fn):
+                        ret = fn(nl)
+                    else:
+                        ret = getattr(nl, fn)()
+                except Exception as e:
+                    error = e
+                    if getattr(nl, 'channel_error', None) is not None:
+                        self.drop(name)
+                results.put((name, ret, error))
+
+        for _ in range(workers):
+            t = threading.Thread(target=worker, name='NetNS fanout')
+            t.setDaemon(True)
+            t.start()
+
+        def collect():
+            for _ in names:
+                yield results.get()
+
+        return collect()
+
+    def close(self):
+        '''
+        Close all the cached handles, and the broker, if it is
+        started by the pool.
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for name in tuple(self.handles):
+            self.drop(name)
+        if self.own_broker:
+            self.broker.close()
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    '''
+    Return the process-wide pool, start it if required.
+    '''
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None or _default_pool.closed:
+            _default_pool = NetNSPool()
+            atexit.register(_default_pool.close)
+        return _default_pool
@@ -1,4 +1,6 @@
 import os
+import errno
+import fcntl
 import atexit
 import pickle
 import select
@@ -7,11 +9,13 @@ import logging
 import signal
 import threading
 import traceback
-from io import BytesIO
 from socket import SOL_SOCKET
 from socket import SO_RCVBUF
 from pyroute2 import config
+from pyroute2.common import AddrPool
+from pyroute2.common import basestring
 from pyroute2.netlink.nlsocket import NetlinkMixin
+from pyroute2.netlink.nlsocket import NetlinkSocket
 if config.uname[0][-3:] == 'BSD':
     from pyroute2.iproute.bsd import IPRoute
 else:
@@ -23,38 +27,137 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+#
+# Frame types, the second word of the frame header.
+#
+# TRNSP_PICKLE is the only type understood by old peers, so
+# raw frames are sent only after the peer confirms the binary
+# protocol support during the init stage.
+#
+TRNSP_PICKLE = 0        # pickled control message
+TRNSP_BROADCAST = 1     # raw netlink data from the kernel
+TRNSP_DATAGRAM = 2      # (cookie, pid, groups) + encoded netlink message
+TRNSP_ACK = 3           # successful datagram delivery: (cookie, )
+
+
+def netns_names(msg):
+    #
+    # Check if IFLA_NET_NS_FD holds a netns name, including the
+    # nested messages like the veth peer
+    #
+    for nla in msg.get('attrs', ()):
+        if nla[0] == 'IFLA_NET_NS_FD' and isinstance(nla[1], basestring):
+            return True
+        if isinstance(nla[1], dict) and netns_names(nla[1]):
+            return True
+    return False
+
 
 class Transport(object):
     '''
     A simple transport protocols to send objects between two
     end-points. Requires an open file-like object at init.
+
+    Every frame starts with a header `struct.pack('II', length, type)`.
+    Control messages are pickled, while netlink data may be sent
+    as is with `send_raw()`, if `binary` is set.
+
+    Requests and responses carry a cookie, so several requests
+    may be in flight on the same transport at once.
+
+    The upper 16 bits of the frame type word hold the channel id,
+    so one transport can serve several endpoints, see
+    `pyroute2.netns.broker`. The default channel is 0.
     '''
     def __init__(self, file_obj):
         self.file_obj = file_obj
         self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
         self.cmd_queue = queue.Queue()
         self.brd_queue = queue.Queue()
         self.run = True
+        self.binary = False
+        self._header = bytearray(8)
+        self._buffer = bytearray(65536)
 
     def fileno(self):
         return self.file_obj.fileno()
 
-    def send(self, obj):
-        dump = BytesIO()
-        pickle.dump(obj, dump)
-        packet = struct.pack("II", len(dump.getvalue()) + 8, 0)
-        packet += dump.getvalue()
-        self.file_obj.write(packet)
-        self.file_obj.flush()
+    def send(self, obj, channel=0):
+        dump = pickle.dumps(obj)
+        packet = struct.pack("II",
+                             len(dump) + 8,
+                             TRNSP_PICKLE | (channel << 16)) + dump
+        with self.send_lock:
+            self.file_obj.write(packet)
+            self.file_obj.flush()
+
+    def send_raw(self, frame, data=b'', channel=0):
+        packet = struct.pack("II", len(data) + 8, frame | (channel << 16))
+        packet += data
+        with self.send_lock:
+            self.file_obj.write(packet)
+            self.file_obj.flush()
+
+    def _read_into(self, buf):
+        #
+        # Fill the buffer up, return the number of bytes read;
+        # less than len(buf) means EOF
+        #
+        view = memoryview(buf)
+        offset = 0
+        readinto = getattr(self.file_obj, 'readinto', None)
+        while offset < len(buf):
+            if readinto is not None:
+                chunk = readinto(view[offset:])
+            else:
+                data = self.file_obj.read(len(buf) - offset)
+                chunk = len(data)
+                view[offset:offset + chunk] = data
+            if not chunk:
+                break
+            offset += chunk
+        return offset
 
     def __recv(self):
-        length, offset = struct.unpack("II", self.file_obj.read(8))
-        dump = BytesIO()
-        dump.write(self.file_obj.read(length - 8))
-        dump.seek(0)
-        ret = pickle.load(dump)
+        if self._read_into(self._header) < 8:
+            raise struct.error('unexpected end of stream')
+        length, frame = struct.unpack("II", self._header)
+        length -= 8
+        channel = frame >> 16
+        frame &= 0xffff
+        #
+        # read the frame into the receive buffer, that grows up to
+        # the largest frame and is reused; the data that leaves the
+        # transport is copied out of it
+        #
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+        data = memoryview(self._buffer)[:length]
+        if self._read_into(data) < length:
+            raise struct.error('unexpected end of stream')
+        if frame == TRNSP_BROADCAST:
+            ret = {'stage': 'broadcast',
+                   'data': bytearray(data),
+                   'error': None}
+        elif frame == TRNSP_DATAGRAM:
+            ret = {'stage': 'datagram',
+                   'data': bytearray(data),
+                   'error': None}
+        elif frame == TRNSP_ACK:
+            ret = {'stage': 'datagram',
+                   'error': None,
+                   'return': None,
+                   'cookie': struct.unpack_from('I', data)[0]}
+        else:
+            ret = pickle.loads(data.tobytes())
+        ret['channel'] = channel
         return ret
 
+    def recv_frame(self):
+        with self.lock:
+            return self.__recv()
+
     def recv(self):
         while self.run:
             with self.lock:
@@ -87,14 +190,139 @@ class Transport(object):
 
 class ProxyChannel(object):
 
-    def __init__(self, channel, stage):
+    def __init__(self, channel, stage, channel_id=0):
         self.target = channel
         self.stage = stage
+        self.channel_id = channel_id
 
     def send(self, data):
         return self.target.send({'stage': self.stage,
                                  'data': data,
-                                 'error': None})
+                                 'error': None}, self.channel_id)
+
+
+class Endpoint(object):
+    '''
+    The server side of one channel: an IPRoute socket, that
+    serves requests from the transport.
+
+    The object should be created in the target network
+    namespace; it can be used then from any netns.
+    '''
+    def __init__(self, trnsp_out, channel=0):
+        self.ipr = IPRoute()
+        self.lock = self.ipr._sproxy.lock
+        self.ipr._s_channel = ProxyChannel(trnsp_out, 'broadcast', channel)
+        self.trnsp_out = trnsp_out
+        self.channel = channel
+        # all the sockets to poll: fd -> socket
+        self.sockets = {self.ipr.fileno(): self.ipr}
+
+    def init(self):
+        self.trnsp_out.send({'stage': 'init',
+                             'uname': config.uname,
+                             'binary': True,
+                             'error': None}, self.channel)
+
+    def close(self):
+        self.ipr.close()
+        # send loopback nlmsg to terminate possible .get()
+        data = struct.pack('IHHQIQQ', 28, 2, 0, 0, 104, 0, 0)
+        self.trnsp_out.send({'stage': 'broadcast',
+                             'data': data,
+                             'error': None}, self.channel)
+
+    def serve_broadcast(self, fd):
+        sock = self.sockets[fd]
+        trnsp_out = self.trnsp_out
+        bufsize = sock.getsockopt(SOL_SOCKET, SO_RCVBUF) // 2
+        with self.lock:
+            error = None
+            data = None
+            try:
+                data = sock.recv(bufsize)
+            except Exception as e:
+                error = e
+                error.tb = traceback.format_exc()
+            if error is None and trnsp_out.binary:
+                trnsp_out.send_raw(TRNSP_BROADCAST, data, self.channel)
+            else:
+                trnsp_out.send({'stage': 'broadcast',
+                                'data': data,
+                                'error': error}, self.channel)
+
+    def execute(self, func, *argv, **kwarg):
+        #
+        # run the requests that may create sockets or pass the
+        # userspace proxy, see NetNSBroker
+        #
+        return func(*argv, **kwarg)
+
+    def serve_cmd(self, cmd):
+        ipr = self.ipr
+        trnsp_out = self.trnsp_out
+        if cmd['stage'] == 'protocol':
+            # no response, the client doesn't wait for it
+            trnsp_out.binary = cmd['binary']
+        elif cmd['stage'] == 'datagram':
+            error = None
+            try:
+                data = memoryview(cmd['data'])
+                cookie, pid, groups = struct.unpack_from('III', data)
+                msg_type = struct.unpack_from('H', data, 16)[0]
+                if msg_type in ipr._sproxy.pmap or \
+                        not isinstance(ipr, NetlinkSocket):
+                    # the message must pass the userspace proxy
+                    msg_class = ipr.marshal.msg_map[msg_type]
+                    msg = msg_class(bytearray(data[12:]))
+                    msg.decode()
+                    self.execute(ipr.sendto_gate, msg, (pid, groups))
+                else:
+                    ipr.sendto(data[12:], (pid, groups))
+            except Exception as e:
+                error = e
+                error.tb = traceback.format_exc()
+            if error is None:
+                trnsp_out.send_raw(TRNSP_ACK,
+                                   struct.pack('I', cookie),
+                                   self.channel)
+            else:
+                trnsp_out.send({'stage': 'datagram',
+                                'error': error,
+                                'return': None,
+                                'cookie': cookie}, self.channel)
+        elif cmd['stage'] == 'reconstruct':
+            error = None
+            try:
+                msg = cmd['argv'][0]()
+                msg.load(pickle.loads(cmd['argv'][1]))
+                self.execute(ipr.sendto_gate, msg, cmd['argv'][2])
+            except Exception as e:
+                error = e
+                error.tb = traceback.format_exc()
+            trnsp_out.send({'stage': 'reconstruct',
+                            'error': error,
+                            'return': None,
+                            'cookie': cmd['cookie']}, self.channel)
+
+        elif cmd['stage'] == 'command':
+            error = None
+            try:
+                ret = self.execute(getattr(ipr, cmd['name']),
+                                   *cmd['argv'],
+                                   **cmd['kwarg'])
+                if cmd['name'] == 'bind' and \
+                        ipr._brd_socket is not None:
+                    self.sockets[ipr._brd_socket.fileno()] = \
+                        ipr._brd_socket
+            except Exception as e:
+                ret = None
+                error = e
+                error.tb = traceback.format_exc()
+            trnsp_out.send({'stage': 'command',
+                            'error': error,
+                            'return': ret,
+                            'cookie': cmd['cookie']}, self.channel)
 
 
 def Server(trnsp_in, trnsp_out):
@@ -106,88 +334,51 @@ def Server(trnsp_in, trnsp_out):
     signal.signal(signal.SIGTERM, stop_server)
 
     try:
-        ipr = IPRoute()
-        lock = ipr._sproxy.lock
-        ipr._s_channel = ProxyChannel(trnsp_out, 'broadcast')
+        endpoint = Endpoint(trnsp_out)
     except Exception as e:
         trnsp_out.send({'stage': 'init',
                         'error': e})
         return 255
 
-    inputs = [ipr.fileno(), trnsp_in.fileno()]
-    broadcasts = {ipr.fileno(): ipr}
     outputs = []
 
     # all is OK so far
-    trnsp_out.send({'stage': 'init',
-                    'uname': config.uname,
-                    'error': None})
+    endpoint.init()
 
     # 8<-------------------------------------------------------------
     while Server.run:
+        inputs = list(endpoint.sockets) + [trnsp_in.fileno()]
         try:
             events, _, _ = select.select(inputs, outputs, inputs)
         except:
             continue
         for fd in events:
-            if fd in broadcasts:
-                sock = broadcasts[fd]
-                bufsize = sock.getsockopt(SOL_SOCKET, SO_RCVBUF) // 2
-                with lock:
-                    error = None
-                    data = None
-                    try:
-                        data = sock.recv(bufsize)
-                    except Exception as e:
-                        error = e
-                        error.tb = traceback.format_exc()
-                    trnsp_out.send({'stage': 'broadcast',
-                                    'data': data,
-                                    'error': error})
+            if fd in endpoint.sockets:
+                endpoint.serve_broadcast(fd)
             elif fd == trnsp_in.fileno():
                 cmd = trnsp_in.recv_cmd()
                 if cmd['stage'] == 'shutdown':
-                    ipr.close()
-                    data = struct.pack('IHHQIQQ', 28, 2, 0, 0, 104, 0, 0)
-                    trnsp_out.send({'stage': 'broadcast',
-                                    'data': data,
-                                    'error': None})
+                    endpoint.close()
                     return
-                elif cmd['stage'] == 'reconstruct':
-                    error = None
-                    try:
-                        msg = cmd['argv'][0]()
-                        msg.load(pickle.loads(cmd['argv'][1]))
-                        ipr.sendto_gate(msg, cmd['argv'][2])
-                    except Exception as e:
-                        error = e
-                        error.tb = traceback.format_exc()
-                    trnsp_out.send({'stage': 'reconstruct',
-                                    'error': error,
-                                    'return': None,
-                                    'cookie': cmd['cookie']})
-
-                elif cmd['stage'] == 'command':
-                    error = None
-                    try:
-                        ret = getattr(ipr, cmd['name'])(*cmd['argv'],
-                                                        **cmd['kwarg'])
-                        if cmd['name'] == 'bind' and \
-                                ipr._brd_socket is not None:
-                            inputs.append(ipr._brd_socket.fileno())
-                            broadcasts[ipr._brd_socket.fileno()] = \
-                                ipr._brd_socket
-                    except Exception as e:
-                        ret = None
-                        error = e
-                        error.tb = traceback.format_exc()
-                    trnsp_out.send({'stage': 'command',
-                                    'error': error,
-                                    'return': ret,
-                                    'cookie': cmd['cookie']})
+                endpoint.serve_cmd(cmd)
 
 
 class RemoteSocket(NetlinkMixin):
+    '''
+    The client side of the remote protocol.
+
+    All the requests are tagged with cookies and may be issued
+    from any number of threads at once. The only reader of the
+    incoming transport is the demultiplexer thread, that routes
+    responses to the waiting requests and enqueues broadcasts.
+    The socket `fileno()` is a pipe, that is readable while there
+    are broadcast messages to `recv()`, so the object still can be
+    used in poll/select.
+
+    If the incoming transport provides `demux(route, down)`, it is
+    demultiplexed by somebody else, e.g. by a `NetNSBroker`, and
+    no thread is started.
+    '''
 
     trnsp_in = None
     trnsp_out = None
@@ -198,9 +389,22 @@ class RemoteSocket(NetlinkMixin):
         super(RemoteSocket, self).__init__()
         self.trnsp_in = trnsp_in
         self.trnsp_out = trnsp_out
-        self.cmdlock = threading.Lock()
         self.shutdown_lock = threading.RLock()
         self.closed = False
+        self.cookies = AddrPool(minaddr=1, maxaddr=0xffff)
+        self.requests = {}
+        self.requests_lock = threading.Lock()
+        self.channel_error = None
+        # broadcast notification pipe, holds one byte while there
+        # are queued messages
+        self._brd_lock = threading.Lock()
+        self._brd_closed = False
+        self._brd_ready = False
+        self._brd_read, self._brd_write = os.pipe()
+        for fd in (self._brd_read, self._brd_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._demux_thread = None
         init = self.trnsp_in.recv_cmd()
         if init['stage'] != 'init':
             raise TypeError('incorrect protocol init')
@@ -209,31 +413,138 @@ class RemoteSocket(NetlinkMixin):
         else:
             self.uname = init['uname']
             atexit.register(self.close)
+        if init.get('binary'):
+            # the server supports raw frames, switch both directions
+            self.trnsp_out.send({'stage': 'protocol', 'binary': True})
+            self.trnsp_out.binary = True
         self.sendto_gate = self._gate
+        if hasattr(self.trnsp_in, 'demux'):
+            self.trnsp_in.demux(self._route, self._channel_down)
+        else:
+            self._demux_thread = threading.Thread(target=self._demux,
+                                                  name='RemoteSocket demux')
+            self._demux_thread.setDaemon(True)
+            self._demux_thread.start()
+
+    def _brd_put(self, msg):
+        with self._brd_lock:
+            self.trnsp_in.brd_queue.put(msg)
+            if not self._brd_closed and not self._brd_ready:
+                os.write(self._brd_write, b'\0')
+                self._brd_ready = True
+
+    def _route(self, msg):
+        if msg['stage'] in ('broadcast', 'signal'):
+            self._brd_put(msg)
+            return
+        with self.requests_lock:
+            slot = self.requests.get(msg.get('cookie'))
+        if slot is not None:
+            slot.put(msg)
+        else:
+            log.debug('orphaned remote response: %s' % (msg, ))
+
+    def _channel_down(self, reason=None):
+        #
+        # The channel is down: fail all the pending requests
+        # and terminate possible .get()
+        #
+        log.debug('remote channel closed: %s' % (reason, ))
+        error = IOError(errno.ECOMM, 'remote channel closed')
+        with self.requests_lock:
+            if self.channel_error is not None:
+                return
+            self.channel_error = error
+            for slot in self.requests.values():
+                slot.put({'error': error})
+        self._brd_put({'stage': 'broadcast',
+                       'data': None,
+                       'error': error})
+
+    def _demux(self):
+        while True:
+            try:
+                msg = self.trnsp_in.recv_frame()
+            except Exception as e:
+                self._channel_down(e)
+                break
+            self._route(msg)
+        # the demux thread owns the incoming channel
+        try:
+            self.trnsp_in.file_obj.close()
+        except Exception:
+            pass
+
+    def _request(self, cmd=None, frame=None, data=None):
+        slot = queue.Queue()
+        with self.requests_lock:
+            if self.channel_error is not None:
+                raise self.channel_error
+            cookie = self.cookies.alloc()
+            self.requests[cookie] = slot
+        try:
+            try:
+                if frame is None:
+                    cmd['cookie'] = cookie
+                    self.trnsp_out.send(cmd)
+                else:
+                    self.trnsp_out.send_raw(frame,
+                                            struct.pack('I', cookie) + data)
+            except (IOError, OSError) as e:
+                #
+                # the outgoing channel is broken, e.g. EPIPE: the
+                # demux thread may not have noticed it yet
+                #
+                self._channel_down(e)
+                raise self.channel_error
+            ret = slot.get()
+        finally:
+            with self.requests_lock:
+                del self.requests[cookie]
+            self.cookies.free(cookie)
+        if ret['error'] is not None:
+            raise ret['error']
+        return ret['return']
 
     def _gate(self, msg, addr):
-        with self.cmdlock:
-            self.trnsp_out.send({'stage': 'reconstruct',
-                                 'cookie': None,
-                                 'name': None,
-                                 'argv': [type(msg),
-                                          pickle.dumps(msg.dump()),
-                                          addr],
-                                 'kwarg': None})
-            ret = self.trnsp_in.recv_cmd()
-            if ret['error'] is not None:
-                raise ret['error']
-            return ret['return']
+        #
+        # A netns name in IFLA_NET_NS_FD must be opened on the server
+        # side, so such messages can not be encoded here
+        #
+        if self.trnsp_out.binary and not netns_names(msg):
+            msg.reset()
+            msg.encode()
+            return self._request(frame=TRNSP_DATAGRAM,
+                                 data=struct.pack('II', *addr) +
+                                 bytes(msg.data))
+        return self._request({'stage': 'reconstruct',
+                              'name': None,
+                              'argv': [type(msg),
+                                       pickle.dumps(msg.dump()),
+                                       addr],
+                              'kwarg': None})
 
     def recv(self, bufsize, flags=0):
         msg = None
         while True:
-            msg = self.trnsp_in.recv()
+            msg = self.trnsp_in.brd_queue.get()
+            with self._brd_lock:
+                #
+                # every get() is followed by this check, so the
+                # pipe is readable while the queue is not empty
+                #
+                if not self._brd_closed and self._brd_ready and \
+                        self.trnsp_in.brd_queue.empty():
+                    os.read(self._brd_read, 1)
+                    self._brd_ready = False
             if msg['stage'] == 'signal':
                 os.kill(os.getpid(), msg['data'])
             else:
                 break
         if msg['error'] is not None:
+            if msg['error'] is self.channel_error:
+                # leave the message for other readers
+                self._brd_put(msg)
             raise msg['error']
         return msg['data']
 
@@ -259,8 +570,6 @@ class RemoteSocket(NetlinkMixin):
                     self.remote_trnsp_out.send({'stage': 'broadcast',
                                                 'data': data,
                                                 'error': None})
-                    with self.trnsp_in.lock:
-                        pass
 
                 transport_objs = (self.trnsp_out, self.trnsp_in,
                                   self.remote_trnsp_in, self.remote_trnsp_out)
@@ -273,27 +582,30 @@ class RemoteSocket(NetlinkMixin):
                     except Exception:
                         pass
 
-                # Close the file descriptors.
+                # Close the file descriptors; the incoming channel
+                # will be closed by the demux thread on EOF
                 for trnsp in transport_objs:
+                    if trnsp is self.trnsp_in and \
+                            self._demux_thread is not None:
+                        continue
                     try:
                         trnsp.file_obj.close()
                     except Exception:
                         pass
 
+                with self._brd_lock:
+                    self._brd_closed = True
+                    os.close(self._brd_read)
+                    os.close(self._brd_write)
+
     def proxy(self, cmd, *argv, **kwarg):
-        with self.cmdlock:
-            self.trnsp_out.send({'stage': 'command',
-                                 'cookie': None,
-                                 'name': cmd,
-                                 'argv': argv,
-                                 'kwarg': kwarg})
-            ret = self.trnsp_in.recv_cmd()
-            if ret['error'] is not None:
-                raise ret['error']
-            return ret['return']
+        return self._request({'stage': 'command',
+                              'name': cmd,
+                              'argv': argv,
+                              'kwarg': kwarg})
 
     def fileno(self):
-        return self.trnsp_in.fileno()
+        return self._brd_read
 
     def bind(self, *argv, **kwarg):
         if 'async' in kwarg:
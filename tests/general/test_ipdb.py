@@ -6,6 +6,7 @@ import time
 import uuid
 import random
 import socket
+import struct
 import threading
 import subprocess
 from pyroute2 import config
@@ -16,9 +17,15 @@ from pyroute2 import NetNS
 from pyroute2.common import basestring
 from pyroute2.common import uifname
 from pyroute2.common import AF_MPLS
+from pyroute2.ipdb.batch import Pipeline
 from pyroute2.ipdb.exceptions import CreateException
+from pyroute2.ipdb.routes import CompactRoute
+from pyroute2.ipdb.routes import RoutingTableSet
+from pyroute2.ipdb.interfaces import Interface
+from pyroute2.ipdb.interfaces import CompactInterface
 from pyroute2.ipdb.exceptions import PartialCommitException
 from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
 from utils import grep
 from utils import create_link
 from utils import kernel_version_ge
@@ -1157,6 +1164,28 @@ class TestExplicit(BasicSetup):
             r.remove()
         assert not grep('ip ro', pattern='172.16.3.0/24.*127.0.0.1')
 
+    def test_routes_lookup(self):
+        require_user('root')
+        os.system('ip route add 172.16.4.0/24 via 127.0.0.1')
+        os.system('ip route add 172.16.4.128/25 via 127.0.0.1 proto static')
+        time.sleep(1)
+        try:
+            assert self.ip.routes.lookup('172.16.4.1').dst == \
+                '172.16.4.0/24'
+            assert self.ip.routes.lookup('172.16.4.129').dst == \
+                '172.16.4.128/25'
+            ret = self.ip.routes.filter({'gateway': '127.0.0.1',
+                                         'proto': 4,
+                                         'table': 254})
+            assert [x['route'].dst for x in ret] == ['172.16.4.128/25']
+        finally:
+            os.system('ip route del 172.16.4.0/24')
+            os.system('ip route del 172.16.4.128/25')
+        time.sleep(1)
+        table = self.ip.routes.tables[254]
+        assert '172.16.4.0/24' not in table.fdx['dst']
+        assert '172.16.4.128/25' not in table.fdx['dst']
+
     def test_routes_del_nh_fail(self):
         require_user('root')
         with self.ip.routes.add({'dst': '172.16.0.0/24',
@@ -1643,6 +1672,41 @@ class TestExplicit(BasicSetup):
         assert ('172.16.0.1', 24) in self.ip.interfaces[self.ifd].ipaddr
         assert self.ip.interfaces[self.ifd].flags & 1
 
+    def test_snapshots_cow(self):
+        require_user('root')
+
+        i = self.ip.interfaces[self.ifd]
+        with i:
+            i.add_ip('172.16.0.1/24')
+            i.up()
+        mtu = i.mtu
+
+        # the snapshot records only changes
+        s = i.snapshot()
+        journal = i._snapshots[s]
+        assert i._journals == [journal]
+        with i:
+            i.add_ip('172.16.0.2/24')
+            i.mtu = 1280
+        assert ('172.16.0.2', 24) in i.ipaddr
+
+        # the first change after the transaction detaches the journal
+        wd = self.ip.watchdog(ifname=self.ifd, mtu=1300)
+        os.system('ip link set %s mtu 1300' % self.ifd)
+        wd.wait()
+        assert not i._journals
+        assert not i.ipaddr.journals
+        assert i._snapshots[s] is not journal
+        snapshot = i.last_snapshot()
+        assert snapshot.mtu == mtu
+        assert set(snapshot.ipaddr) == set([('172.16.0.1', 24)])
+
+        # revert
+        i.revert(s)
+        assert s not in i._snapshots
+        assert i.current_tx.mtu == mtu
+        i.drop()
+
     def test_ipaddr_views(self):
         require_user('root')
 
@@ -2992,6 +3056,297 @@ class TestMisc(object):
                 if '172.18.0.0/24' in ipdb.routes.tables.get(100, {}):
                     ipdb.routes.tables[100]['172.18.0.0/24'].remove().commit()
 
+    def test_compact_routes(self):
+        require_user('root')
+        os.system('ip route add 172.18.1.0/24 via 127.0.0.1 proto static')
+        try:
+            with IPDB(compact_routes=True) as ipdb:
+                table = ipdb.routes.tables[254]
+                ret = ipdb.routes.filter({'dst': '172.18.1.0/24'})
+                assert len(ret) == 1
+                assert isinstance(ret[0]['route'], CompactRoute)
+                assert ret[0]['route'].gateway == '127.0.0.1'
+                assert isinstance(table.idx[ret[0]['key']], int)
+                assert ipdb.routes.lookup('172.18.1.1').proto == 4
+                # the route object is created on demand
+                with ipdb.routes['172.18.1.0/24'] as r:
+                    r.gateway = '127.0.0.2'
+                assert isinstance(table.idx[ret[0]['key']], dict)
+                assert grep('ip ro', pattern='172.18.1.0/24.*127.0.0.2')
+        finally:
+            os.system('ip route del 172.18.1.0/24')
+
+    def test_compact_interfaces(self):
+        require_user('root')
+        with IPDB(compact_interfaces=True) as ipdb:
+            i = ipdb.interfaces[self.ifname]
+            assert isinstance(i, CompactInterface)
+            # None fields are not stored
+            assert 'master' not in i
+            assert i.master is None
+            assert i['master'] is None
+            assert len(i) < len(Interface._fields)
+            # linked sets are created on demand
+            assert 'vlans' not in i
+            assert i.vlans == set()
+            assert 'vlans' in i.dump()
+            with i:
+                i.mtu = 1280
+                i.add_ip('172.18.4.1/24')
+            assert grep('ip link show %s' % self.ifname, pattern='mtu 1280')
+            assert ('172.18.4.1', 24) in i.ipaddr
+
+    def test_progressive(self):
+        require_user('root')
+        os.system('ip route add 172.18.2.0/24 via 127.0.0.1')
+        try:
+            with IPDB(progressive=True) as ipdb:
+                assert ipdb.interfaces.ready.wait(5)
+                assert self.ifname in ipdb.interfaces
+                assert ipdb.routes.ready.wait(5)
+                assert '172.18.2.0/24' in ipdb.routes
+                assert ipdb.rules.ready.wait(5)
+            # sections are ready also in the default mode
+            with IPDB() as ipdb:
+                assert ipdb.routes.ready.is_set()
+        finally:
+            os.system('ip route del 172.18.2.0/24')
+
+    def test_progressive_error(self):
+
+        def fail(*argv, **kwarg):
+            raise _TestException()
+
+        register = RoutingTableSet._register
+        RoutingTableSet._register = fail
+        try:
+            with IPDB(progressive=True) as ipdb:
+                # the failed section doesn't block the waiters
+                assert ipdb.routes.ready.wait(5)
+                assert isinstance(ipdb.routes.error, _TestException)
+                assert ipdb.interfaces.ready.wait(5)
+                assert ipdb.interfaces.error is None
+        finally:
+            RoutingTableSet._register = register
+
+    def test_batch_commit(self):
+        require_user('root')
+        require_8021q()
+        ifA = uifname()
+        ifB = uifname()
+        try:
+            with IPDB() as ipdb:
+                (ipdb.interfaces
+                 .add(ifname=ifA, kind='dummy')
+                 .add_ip('172.18.3.2/24')
+                 .up())
+                (ipdb.interfaces
+                 .add(ifname=ifB, kind='vlan', link=ifA, vlan_id=1001)
+                 .add_ip('172.18.4.2/24')
+                 .up())
+                ipdb.routes.add(dst='172.18.5.0/24', gateway='172.18.3.1')
+                ipdb.commit(batch=True)
+                assert ipdb.interfaces[ifB]['link'] == \
+                    ipdb.interfaces[ifA]['index']
+                assert grep('ip ad', pattern='172.18.4.2/24')
+                assert grep('ip route', pattern='172.18.5.0/24.*%s' % ifA)
+                # one failed request reverts all the batch
+                ipdb.interfaces[self.ifname].set_mtu(1280)
+                ipdb.routes.add(dst='172.18.6.0/24', gateway='172.18.254.1')
+                try:
+                    ipdb.commit(batch=True)
+                except NetlinkError:
+                    pass
+                else:
+                    raise AssertionError('commit must fail')
+                assert ipdb.interfaces[self.ifname]['mtu'] != 1280
+                assert not grep('ip route', pattern='172.18.6.0/24')
+        finally:
+            remove_link(ifB)
+            remove_link(ifA)
+
+    def test_batch_compile_error(self):
+        with IPRoute() as ipr:
+            pipeline = Pipeline(ipr)
+            pipeline.add(('link', ('add', ), {'ifname': 'a',
+                                              'kind': 'dummy'}))
+            size = len(pipeline.compiler.batch)
+            try:
+                pipeline.add(('link', ('add', ), {'ifname': 'b',
+                                                  'kind': 'dummy',
+                                                  'mtu': 'b'}))
+            except struct.error:
+                pass
+            else:
+                raise AssertionError('compile must fail')
+            # the failed request leaves neither data nor seq
+            assert len(pipeline.compiler.batch) == size
+            assert pipeline.compiler.addr_pool.allocated == \
+                [pipeline.requests[0][0]]
+            assert len(ipr.addr_pool.ban) == 1
+
+    def test_callback_pool(self):
+        require_user('root')
+        ifA = uifname()
+        block = threading.Event()
+        mtus = []
+
+        def slow(ipdb, msg, action):
+            if msg.get_attr('IFLA_IFNAME') == self.ifname:
+                block.wait(5)
+
+        def record(ipdb, msg, action):
+            if action == 'RTM_NEWLINK' and \
+                    msg.get_attr('IFLA_IFNAME') == ifA:
+                mtus.append(msg.get_attr('IFLA_MTU'))
+
+        try:
+            with IPDB(cb_workers=2) as ipdb:
+                cuid = ipdb.register_callback(slow)
+                ipdb.register_callback(record)
+                # the events are sharded by the interface index
+                index = max(ipdb.by_index.keys()) + 1
+                if index % 2 == ipdb.interfaces[self.ifname]['index'] % 2:
+                    index += 1
+                os.system('ip link add %s index %i type dummy' %
+                          (ifA, index))
+                os.system('ip link set %s mtu 1280' % self.ifname)
+                for mtu in range(1300, 1305):
+                    os.system('ip link set %s mtu %i' % (ifA, mtu))
+                # the slow callback doesn't block other interfaces
+                for _ in range(30):
+                    if 1304 in mtus:
+                        break
+                    time.sleep(0.1)
+                assert not block.is_set()
+                block.set()
+                assert 1304 in mtus
+                # but the events of one interface are ordered
+                ordered = [x for x in mtus if 1300 <= x < 1305]
+                assert ordered == sorted(ordered)
+                stats = ipdb.callback_stats()
+                assert len(stats['workers']) == 2
+                assert stats['callbacks'][cuid]['calls'] > 0
+                ipdb.unregister_callback(cuid)
+                assert cuid not in ipdb.callback_stats()['callbacks']
+        finally:
+            remove_link(ifA)
+
+    def test_callback_pool_unregister(self):
+        # callbacks on different workers unregister themselves
+        # at the same time
+        running = [threading.Event(), threading.Event()]
+        done = [threading.Event(), threading.Event()]
+        cuids = []
+
+        def cb(x):
+            def f(ipdb, msg, action):
+                if msg['index'] != 1000000 + x:
+                    return
+                running[x].set()
+                running[1 - x].wait(5)
+                ipdb.unregister_callback(cuids[x])
+                done[x].set()
+            return f
+
+        with IPDB(cb_workers=2) as ipdb:
+            cuids.extend([ipdb.register_callback(cb(0)),
+                          ipdb.register_callback(cb(1))])
+            for x in range(2):
+                msg = ifinfmsg()
+                msg['event'] = 'RTM_NEWLINK'
+                msg['index'] = 1000000 + x
+                ipdb._cb_pool.put(msg)
+            for event in done:
+                assert event.wait(5)
+            assert not ipdb._post_callbacks
+
+    def test_callback_stats_unregister(self):
+        with IPDB() as ipdb:
+            cuid = ipdb.register_callback(lambda *x: None)
+            callback = ipdb._post_callbacks[cuid]
+            ipdb.unregister_callback(cuid)
+            # the callback is unregistered while the run is in progress
+            ipdb._post_callbacks[cuid] = callback
+            msg = ifinfmsg()
+            msg['event'] = 'RTM_NEWLINK'
+            ipdb._run_callbacks(msg)
+            del ipdb._post_callbacks[cuid]
+            assert cuid not in ipdb.callback_stats()['callbacks']
+
+    def test_coalesce(self):
+        require_user('root')
+        with IPDB(coalesce={'link': 0.5}) as ipdb:
+            with ipdb.eventqueue(timeout=5) as evq:
+                for mtu in range(1300, 1310):
+                    os.system('ip link set %s mtu %i' % (self.ifname, mtu))
+                mtus = []
+                for msg in evq:
+                    if msg['event'] == 'RTM_NEWLINK' and \
+                            msg.get_attr('IFLA_IFNAME') == self.ifname:
+                        mtus.append(msg.get_attr('IFLA_MTU'))
+                        if mtus[-1] == 1309:
+                            break
+                assert len(mtus) < 10
+                assert evq.suppressed['link'] > 0
+
+    def test_callback_index(self):
+        require_user('root')
+        post = []
+        pre = []
+        other = []
+
+        def cb(ret):
+            return lambda ipdb, msg, action: ret.append(msg['index'])
+
+        with IPDB() as ipdb:
+            index = ipdb.interfaces[self.ifname]['index']
+            cuids = [ipdb.register_callback(cb(post),
+                                            event='RTM_NEWLINK',
+                                            ifname=self.ifname),
+                     ipdb.register_callback(cb(pre),
+                                            mode='pre',
+                                            event='RTM_NEWLINK',
+                                            index=index),
+                     ipdb.register_callback(cb(other),
+                                            event='RTM_NEWLINK',
+                                            index=-1)]
+            wd = ipdb.watchdog(ifname=self.ifname, mtu=1280)
+            os.system('ip link set %s mtu 1280' % self.ifname)
+            wd.wait()
+            for _ in range(30):
+                if post:
+                    break
+                time.sleep(0.1)
+            assert set(post) == set(pre) == set((index, ))
+            assert not other
+            ipdb.unregister_callback(cuids[0])
+            ipdb.unregister_callback(cuids[1], mode='pre')
+            ipdb.unregister_callback(cuids[2])
+            assert not ipdb._post_index
+            assert not ipdb._pre_index
+
+    def test_watchdog_table(self):
+        require_user('root')
+        ifA = uifname()
+        with IPDB() as ipdb:
+            # unrelated watchdogs must not be woken up
+            wds = [ipdb.watchdog(ifname='%s-%i' % (ifA, x))
+                   for x in range(100)]
+            wd = ipdb.watchdog(ifname=ifA)
+            create_link(ifA, 'dummy')
+            try:
+                assert wd.wait()
+                assert not any([x.is_set for x in wds])
+                for x in wds:
+                    x.cancel()
+                index = ipdb.interfaces[ifA].index
+                wd = ipdb.watchdog('RTM_DELLINK', ifname=ifA, index=index)
+            finally:
+                remove_link(ifA)
+            assert wd.wait()
+            assert not ipdb._watchdogs
+
     def test_global_only_interfaces(self):
         require_user('root')
         ifA = uifname()
@@ -8,6 +8,7 @@ from pyroute2 import NetlinkError
 from pyroute2.common import uifname
 from pyroute2.common import AF_MPLS
 from pyroute2.netlink import nlmsg
+from pyroute2.netlink.rtnl import RTM_NEWLINK
 from pyroute2.netlink.rtnl.req import IPRouteRequest
 from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
 from pyroute2.netlink.rtnl.ifinfmsg import IFF_NOARP
@@ -1128,6 +1129,29 @@ class TestIPRoute(object):
         assert self.cb_counter == 0
         self.ip.unregister_callback(_callback)
 
+    def test_callbacks_indexed(self):
+        require_user('root')
+        dev = self.ifaces[0]
+
+        self.cb_counter = 0
+        self.ip.register_callback(_callback,
+                                  args=(self, ),
+                                  msg_type=RTM_NEWLINK,
+                                  index=dev)
+        self.test_updown_link()
+        assert self.cb_counter > 0
+        self.ip.unregister_callback(_callback)
+        assert not self.ip.callbacks_index
+
+        self.cb_counter = 0
+        self.ip.register_callback(_callback,
+                                  args=(self, ),
+                                  msg_type=RTM_NEWLINK,
+                                  index=-1)
+        self.test_updown_link()
+        assert self.cb_counter == 0
+        self.ip.unregister_callback(_callback)
+
     def test_link_filter(self):
         links = self.ip.link('dump', ifname='lo')
         assert len(links) == 1
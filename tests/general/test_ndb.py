@@ -43,6 +43,38 @@ class TestMisc(object):
         for source in sources:
             assert sources[source].closed
 
+    def test_replicas(self):
+        with NDB(db_replicas=2) as ndb:
+            assert len(ndb.interfaces.dump())
+            assert len(ndb.routes.summary())
+            assert len(ndb.query.nodes())
+            assert ndb.schema.replicas.qsize() == 2
+
+    def test_topology(self):
+        with NDB(topology=True) as ndb:
+            assert [x for x in ndb.query.nodes()] == [('nodename', ),
+                                                      ('localhost', )]
+            assert ndb.topology.records('nodes') == [('localhost', )]
+
+    def test_shards(self):
+        sources = {'localhost0': IPRoute(),
+                   'localhost1': IPRoute()}
+        with NDB(sources=sources, db_shards=2) as ndb:
+            # a shard per source
+            assert sorted([x.stats()['sources'][0] for x in ndb.shards]) == \
+                ['localhost0', 'localhost1']
+            # the reports read all the shards
+            targets = set([x[0] for x in ndb.interfaces.summary()][1:])
+            assert targets == set(sources)
+            # the objects use the shard of the target
+            lo = ndb.interfaces[{'target': 'localhost1', 'ifname': 'lo'}]
+            assert lo.schema is ndb.get_schema('localhost1')
+            assert lo.schema is not ndb.get_schema('localhost0')
+            # unknown targets are not assigned to the shards
+            assert ndb.get_schema('nowhere') is ndb.schema
+            assert 'nowhere' not in ndb._shard_map
+            assert sum([len(x.sources) for x in ndb.shards]) == 2
+
 
 class TestBase(object):
 
@@ -1,19 +1,27 @@
 import os
 import time
+import errno
 import fcntl
+import select
+import signal
 import platform
 import subprocess
 import tempfile
+from threading import Event
 from threading import Thread
 
 from pyroute2 import IPDB
+from pyroute2 import config
 from pyroute2 import IPRoute
 from pyroute2 import NetNS
+from pyroute2 import NetNSBroker
 from pyroute2 import NSPopen
 from pyroute2.common import uifname
 from pyroute2.netns.process.proxy import NSPopen as NSPopenDirect
+from pyroute2.netns.pool import NetNSPool
 from pyroute2 import netns as netnsmod
 from uuid import uuid4
+from utils import remove_link
 from utils import require_user
 from nose.plugins.skip import SkipTest
 
@@ -389,6 +397,307 @@ class TestNetNS(object):
         assert success[0]
 
 
+class TestMultiplex(object):
+
+    def setup(self):
+        require_user('root')
+        self.nsname = str(uuid4())
+        self.ns = NetNS(self.nsname)
+
+    def teardown(self):
+        self.ns.close()
+        netnsmod.remove(self.nsname)
+
+    def run_threads(self, target, count=5):
+        errors = []
+
+        def worker():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, errors
+
+    def test_concurrent(self):
+        # the netlink data goes in raw frames
+        assert self.ns.trnsp_out.binary
+
+        def requests():
+            for _ in range(20):
+                assert [x.get_attr('IFLA_IFNAME') for x
+                        in self.ns.get_links()] == ['lo']
+                assert self.ns.link_lookup(ifname='lo') == [1]
+
+        threads, errors = self.run_threads(requests)
+        for thread in threads:
+            thread.join()
+        assert not errors
+
+    def test_broadcast(self):
+        ifname = uifname()
+        received = []
+
+        def listen():
+            while True:
+                for msg in self.ns.get():
+                    if msg['event'] == 'RTM_NEWLINK' and \
+                            msg.get_attr('IFLA_IFNAME') == ifname:
+                        received.append(msg)
+                        return
+
+        self.ns.bind()
+        listener = Thread(target=listen)
+        listener.setDaemon(True)
+        listener.start()
+        # the requests run along with the broadcasts
+        threads, errors = self.run_threads(lambda: self.ns.get_links())
+        with NetNS(self.nsname) as ns:
+            ns.link('add', ifname=ifname, kind='bridge')
+        for thread in threads:
+            thread.join()
+        listener.join(5)
+        assert not errors
+        assert received
+
+    def test_broadcast_backlog(self):
+        # more messages than the notification pipe may hold
+        count = 70000
+        for _ in range(count):
+            self.ns._brd_put({'stage': 'broadcast',
+                              'data': b'',
+                              'error': None})
+        # the socket is readable while there are messages
+        for _ in range(count):
+            assert select.select([self.ns], [], [], 0)[0]
+            self.ns.recv(0)
+        assert not select.select([self.ns], [], [], 0)[0]
+
+    def test_channel_down(self):
+
+        def requests():
+            while True:
+                self.ns.get_links()
+
+        threads, errors = self.run_threads(requests)
+        time.sleep(0.5)
+        os.kill(self.ns.child, signal.SIGKILL)
+        for thread in threads:
+            thread.join()
+        # all the pending and new requests fail
+        assert len(errors) == len(threads)
+        for error in errors + [None]:
+            if error is None:
+                try:
+                    self.ns.get_links()
+                except IOError as e:
+                    error = e
+            assert isinstance(error, IOError)
+            assert error.errno == errno.ECOMM
+
+
+class TestBroker(object):
+
+    def setup(self):
+        require_user('root')
+        self.broker = NetNSBroker()
+        self.names = []
+
+    def teardown(self):
+        self.broker.close()
+        for ns in self.names:
+            netnsmod.remove(ns)
+
+    def alloc_nsname(self):
+        nsid = str(uuid4())
+        self.names.append(nsid)
+        return nsid
+
+    def test_links(self):
+        ns = [NetNS(self.alloc_nsname(), broker=self.broker)
+              for _ in range(10)]
+        ifname = uifname()
+        ns[0].link('add', ifname=ifname, kind='bridge')
+        assert len(ns[0].link_lookup(ifname=ifname)) == 1
+        for x in ns[1:]:
+            assert len(x.link_lookup(ifname=ifname)) == 0
+            assert len(x.get_links()) == 1
+        for x in ns:
+            x.close()
+
+    def test_tuntap(self):
+        ns = NetNS(self.alloc_nsname(), broker=self.broker)
+        ifname = uifname()
+        # the userspace proxy runs in the channel netns
+        ns.link('add', ifname=ifname, kind='tuntap', mode='tap')
+        try:
+            assert len(ns.link_lookup(ifname=ifname)) == 1
+            with IPRoute() as ipr:
+                assert len(ipr.link_lookup(ifname=ifname)) == 0
+        finally:
+            ns.close()
+            remove_link(ifname)
+
+    def test_ipdb(self):
+        nsid = self.alloc_nsname()
+        ipdb = IPDB(nl=NetNS(nsid, broker=self.broker))
+        ifname = uifname()
+        with ipdb.create(ifname=ifname, kind='bridge') as i:
+            i.add_ip('172.16.0.1/24')
+            i.up()
+        assert ('172.16.0.1', 24) in ipdb.interfaces[ifname].ipaddr
+        ipdb.release()
+
+    def test_attach_fail(self):
+        nsid = str(uuid4())
+        try:
+            NetNS(nsid, flags=0, broker=self.broker)
+        except OSError:
+            pass
+        else:
+            raise AssertionError('OSError expected')
+        assert nsid not in netnsmod.listnetns()
+
+    def test_close_broker(self):
+        ns = NetNS(self.alloc_nsname(), broker=self.broker)
+        self.broker.close()
+        try:
+            ns.get_links()
+        except IOError:
+            pass
+        else:
+            raise AssertionError('IOError expected')
+        ns.close()
+
+
+class TestPool(object):
+
+    def setup(self):
+        require_user('root')
+        self.pool = NetNSPool()
+        self.names = [str(uuid4()) for _ in range(10)]
+        for nsid in self.names:
+            NetNS(nsid).close()
+
+    def teardown(self):
+        self.pool.close()
+        for nsid in self.names:
+            netnsmod.remove(nsid)
+
+    def test_fanout(self):
+        ifname = uifname()
+
+        def create(nl):
+            nl.link('add', ifname=ifname, kind='bridge')
+            return nl.link_lookup(ifname=ifname)
+
+        ret = list(self.pool.fanout(self.names, create, workers=4))
+        assert set([x[0] for x in ret]) == set(self.names)
+        assert all([x[2] is None and len(x[1]) == 1 for x in ret])
+        # the handles are cached
+        assert set(self.pool.handles) == set(self.names)
+
+    def test_eager(self):
+        done = []
+        event = Event()
+
+        def run(nl):
+            done.append(nl)
+            if len(done) == len(self.names):
+                event.set()
+
+        # the result is not consumed, but the operations run
+        self.pool.fanout(self.names, run)
+        assert event.wait(10)
+        assert len(done) == len(self.names)
+
+    def test_errors(self):
+        missing = str(uuid4())
+        ret = dict([(x[0], x) for x in
+                    self.pool.fanout(self.names + [missing], 'get_links')])
+        assert isinstance(ret[missing][2], OSError)
+        assert missing not in self.pool.handles
+        assert missing not in netnsmod.listnetns()
+        for nsid in self.names:
+            assert ret[nsid][2] is None
+
+
+class TestNetNSCache(object):
+
+    def setup(self):
+        require_user('root')
+        self.cache = netnsmod.NetNSCache()
+        self.names = [str(uuid4()) for _ in range(3)]
+        for nsid in self.names:
+            netnsmod.create(nsid)
+
+    def teardown(self):
+        self.cache.invalidate()
+        for nsid in self.names:
+            netnsmod.remove(nsid)
+
+    def test_hits(self):
+        fd = self.cache.acquire(self.names[0])
+        self.cache.release(fd)
+        assert self.cache.acquire(self.names[0]) == fd
+        self.cache.release(fd)
+        stats = self.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['size'] == 1
+        # the same netns by the full path shares the fd
+        path = '%s/%s' % (netnsmod.NETNS_RUN_DIR, self.names[0])
+        assert self.cache.acquire(path) == fd
+        self.cache.release(fd)
+
+    def test_recreate(self):
+        fd = self.cache.acquire(self.names[0])
+        inode = os.fstat(fd).st_ino
+        netnsmod.remove(self.names[0])
+        netnsmod.create(self.names[0])
+        # the fd stays valid until release
+        assert os.fstat(fd).st_ino == inode
+        self.cache.release(fd)
+        fd = self.cache.acquire(self.names[0])
+        assert os.fstat(fd).st_ino != inode
+        self.cache.release(fd)
+        assert self.cache.stats()['misses'] == 2
+        assert self.cache.stats()['size'] == 1
+
+    def test_removed(self):
+        fd = self.cache.acquire(self.names[0])
+        self.cache.release(fd)
+        netnsmod.remove(self.names[0])
+        try:
+            self.cache.acquire(self.names[0])
+        except OSError:
+            pass
+        else:
+            raise AssertionError('removed netns must not be cached')
+        assert self.cache.stats()['size'] == 0
+        netnsmod.create(self.names[0])
+
+    def test_listnsid(self):
+        subprocess.check_call(['ip', 'netns', 'set', self.names[1], '42'])
+        ret = netnsmod.listnsid()
+        assert set(self.names) <= set(ret)
+        assert ret[self.names[0]] == -1
+        assert ret[self.names[1]] == 42
+
+    def test_setns(self):
+        config.netns_fd_cache = True
+        try:
+            with NetNS(self.names[0]) as ns:
+                ns.link('add', ifname='cache0', kind='bridge')
+                assert ns.link_lookup(ifname='cache0')
+        finally:
+            config.netns_fd_cache = False
+            netnsmod.cache.invalidate()
+
+
 def _ns_worker(netns_path, worker_index, success):
     with IPRoute() as ip, NetNS(netns_path) as ns:
         try:
@@ -0,0 +1,53 @@
+import threading
+from pyroute2.common import AddrPool
+from pyroute2.ipdb.batch import Pipeline
+
+
+class NL(object):
+    '''
+    The socket parts used by `Pipeline`
+    '''
+    def __init__(self):
+        self.addr_pool = AddrPool(minaddr=0xff, maxaddr=0xffff)
+        self.backlog = {}
+        self.backlog_lock = threading.Lock()
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(data)
+
+    def get(self, msg_seq):
+        return []
+
+
+def request(x):
+    return ('link', ('set', ), {'index': x, 'ifalias': 'x' * 200})
+
+
+class TestPipeline(object):
+
+    def test_chunks(self):
+        nl = NL()
+        pipeline = Pipeline(nl)
+        pipeline.chunk_size = 1024
+        for x in range(20):
+            pipeline.add(request(x))
+        size = len(pipeline.compiler.batch)
+        assert size > pipeline.chunk_size * 2
+        ret = pipeline.run()
+        assert ret == [(None, None)] * 20
+        # all the data is sent, no chunk exceeds the limit
+        assert sum([len(x) for x in nl.sent]) == size
+        assert len(nl.sent) > 2
+        assert all([len(x) <= 1024 for x in nl.sent])
+
+    def test_large(self):
+        # a request bigger than the chunk goes alone
+        nl = NL()
+        pipeline = Pipeline(nl)
+        pipeline.chunk_size = 128
+        for x in range(3):
+            pipeline.add(request(x))
+        pipeline.run()
+        assert len(nl.sent) == 3
+        assert len(set([len(x) for x in nl.sent])) == 1
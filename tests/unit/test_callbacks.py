@@ -0,0 +1,61 @@
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+from pyroute2.netlink.nlsocket import CallbackIndex
+
+
+def link(index, ifname):
+    msg = ifinfmsg()
+    msg['index'] = index
+    msg['attrs'] = [('IFLA_IFNAME', ifname)]
+    return msg
+
+
+def route(table, dst):
+    msg = rtmsg()
+    msg['family'] = 2
+    msg['table'] = 252
+    msg['attrs'] = [('RTA_TABLE', table), ('RTA_DST', dst)]
+    return msg
+
+
+class TestCallbackIndex(object):
+
+    def test_lookup(self):
+        idx = CallbackIndex()
+        idx.add('link', {'index': 2}, 'a')
+        idx.add('link', {'index': 3}, 'b')
+        idx.add('link', {'ifname': 'eth0'}, 'c')
+        idx.add('link', {}, 'd')
+        idx.add('route', {}, 'e')
+        assert sorted(idx.lookup('link', link(2, 'eth0'))) == ['a', 'c', 'd']
+        assert sorted(idx.lookup('link', link(3, 'eth1'))) == ['b', 'd']
+        assert idx.lookup('addr', link(2, 'eth0')) == []
+
+    def test_nla(self):
+        # fields match both the header and the NLA
+        idx = CallbackIndex()
+        idx.add('route', {'table': 1000, 'family': 2}, 'a')
+        idx.add('route', {'table': 252}, 'b')
+        idx.add('route', {'dst': '10.0.0.0'}, 'c')
+        idx.add('route', {'table': 1001}, 'd')
+        ret = idx.lookup('route', route(1000, '10.0.0.0'))
+        assert sorted(ret) == ['a', 'b', 'c']
+
+    def test_none(self):
+        # missing fields do not match None
+        idx = CallbackIndex()
+        idx.add('link', {'index': None}, 'a')
+        idx.add('link', {'index': 2, 'ifname': None}, 'b')
+        idx.add('link', {'index': 2}, 'c')
+        assert idx.lookup('link', link(2, 'eth0')) == ['c']
+
+    def test_remove(self):
+        idx = CallbackIndex()
+        idx.add('link', {'index': 2}, 'a')
+        idx.add('link', {'index': 2}, 'b')
+        assert idx.remove(lambda x: x == 'a') == 'a'
+        assert idx.remove(lambda x: x == 'a') is None
+        assert idx.lookup('link', link(2, 'eth0')) == ['b']
+        idx.remove(lambda x: x == 'b')
+        assert not idx
+        assert idx.index == {}
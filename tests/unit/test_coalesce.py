@@ -0,0 +1,119 @@
+import time
+from pyroute2.config import AF_BRIDGE
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+from pyroute2.netlink.rtnl.coalesce import Coalescer
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def link(event, index, mtu, family=0):
+    msg = ifinfmsg()
+    msg['event'] = event
+    msg['family'] = family
+    msg['index'] = index
+    msg['attrs'] = [('IFLA_MTU', mtu)]
+    return msg
+
+
+def fdb(event, ifindex, lladdr):
+    msg = ndmsg()
+    msg['event'] = event
+    msg['family'] = AF_BRIDGE
+    msg['ifindex'] = ifindex
+    msg['attrs'] = [('NDA_LLADDR', lladdr)]
+    return msg
+
+
+def route(event, dst, dst_len=24, table=254):
+    msg = rtmsg()
+    msg['event'] = event
+    msg['family'] = 2
+    msg['table'] = table
+    msg['dst_len'] = dst_len
+    msg['tos'] = 0
+    msg['attrs'] = [('RTA_DST', dst)]
+    return msg
+
+
+class TestCoalescer(object):
+
+    def collapse(self, coalescer, events):
+        return [x[1] for x in coalescer.collapse([(None, y)
+                                                  for y in events])]
+
+    def test_latest_state(self):
+        c = Coalescer({'link': 0})
+        events = [link('RTM_NEWLINK', 1, 1500),
+                  link('RTM_NEWLINK', 2, 1500),
+                  link('RTM_NEWLINK', 1, 1400),
+                  link('RTM_NEWLINK', 1, 1300)]
+        ret = self.collapse(c, events)
+        assert ret == [events[1], events[3]]
+        assert c.suppressed == {'link': 2}
+
+    def test_net_delete(self):
+        c = Coalescer({'route': 0})
+        events = [route('RTM_NEWROUTE', '10.0.0.0'),
+                  route('RTM_NEWROUTE', '10.0.0.0', table=100),
+                  route('RTM_DELROUTE', '10.0.0.0')]
+        ret = self.collapse(c, events)
+        assert ret == [events[1], events[2]]
+        assert c.suppressed == {'route': 1}
+
+    def test_families(self):
+        # AF_BRIDGE link events do not replace the link state
+        c = Coalescer({'link': 0})
+        events = [link('RTM_NEWLINK', 1, 1400),
+                  link('RTM_NEWLINK', 1, 1400, family=AF_BRIDGE)]
+        assert self.collapse(c, events) == events
+        assert c.suppressed == {'link': 0}
+
+    def test_fdb(self):
+        # FDB records are keyed by the lladdr
+        c = Coalescer({'neigh': 0})
+        events = [fdb('RTM_NEWNEIGH', 2, '52:54:00:00:00:%02x' % x)
+                  for x in range(5)]
+        events.append(fdb('RTM_DELNEIGH', 2, '52:54:00:00:00:00'))
+        assert self.collapse(c, events) == events[1:]
+        assert c.suppressed == {'neigh': 1}
+
+    def test_classes(self):
+        # only the configured classes are coalesced
+        c = Coalescer({'route': 0})
+        events = [link('RTM_NEWLINK', 1, 1500),
+                  link('RTM_NEWLINK', 1, 1400)]
+        assert self.collapse(c, events) == events
+        assert c.suppressed == {'route': 0}
+
+    def test_barrier(self):
+        c = Coalescer({'link': 0})
+        barrier = Exception()
+        events = [link('RTM_NEWLINK', 1, 1500),
+                  barrier,
+                  link('RTM_NEWLINK', 1, 1400)]
+        assert self.collapse(c, events) == events
+
+    def test_sources(self):
+        c = Coalescer({'link': 0})
+        events = [('a', link('RTM_NEWLINK', 1, 1500)),
+                  ('b', link('RTM_NEWLINK', 1, 1500))]
+        assert c.collapse(events) == events
+
+    def test_drain(self):
+        c = Coalescer({'link': 0, 'route': 0.2})
+        evq = queue.Queue()
+        for x in range(10):
+            evq.put(link('RTM_NEWLINK', 1, 1500 - x))
+        # drain the queue
+        first = evq.get()
+        assert len(c.drain(evq, first)) == 10
+        assert evq.empty()
+        # wait for the time window
+        started = time.time()
+        first = route('RTM_NEWROUTE', '10.0.0.0')
+        assert len(c.drain(evq, first)) == 1
+        assert time.time() - started >= 0.2
@@ -0,0 +1,224 @@
+import os
+import logging
+import sqlite3
+import tempfile
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from pyroute2 import config
+from pyroute2.ndb import dbschema
+from pyroute2.common import uuid32
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+
+
+def link(index, ifname, mtu, event=16):
+    msg = ifinfmsg()
+    msg['header'] = {'type': event}
+    msg['index'] = index
+    msg['flags'] = 1
+    msg['attrs'] = [('IFLA_IFNAME', ifname), ('IFLA_MTU', mtu)]
+    return msg
+
+
+def addr(index, address):
+    msg = ifaddrmsg()
+    msg['header'] = {'type': 20}
+    msg['index'] = index
+    msg['family'] = 2
+    msg['prefixlen'] = 24
+    msg['attrs'] = [('IFA_ADDRESS', address), ('IFA_LOCAL', address)]
+    return msg
+
+
+class TestLoad(object):
+
+    def load(self, upsert, events, spec=':memory:', profile=None,
+             secondary=None):
+        schema = dbschema.init(sqlite3.connect(spec,
+                                               check_same_thread=False,
+                                               uri=spec.startswith('file:')),
+                               'sqlite3',
+                               False,
+                               id(threading.current_thread()),
+                               profile,
+                               secondary)
+        schema.upsert = upsert
+        for event in events:
+            for handler in schema.event_map[type(event)]:
+                handler('localhost', event)
+        return schema
+
+    def dump(self, schema):
+        return (list(schema.fetch('SELECT f_index, f_IFLA_IFNAME, '
+                                  'f_IFLA_MTU FROM interfaces '
+                                  'ORDER BY f_index')),
+                list(schema.fetch('SELECT f_index, f_IFA_ADDRESS '
+                                  'FROM addresses')))
+
+    def test_batch(self):
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            return
+        events = [link(1, 'lo', 65536),
+                  link(2, 'eth0', 1500),
+                  link(1, 'lo', 1500),
+                  addr(2, '10.0.0.1'),
+                  # no such interface: the row must be dropped
+                  addr(3, '10.0.0.2'),
+                  link(2, 'eth0', 1400)]
+        plain = self.load(False, events)
+        batch = self.load(True, events)
+        # the last event is still pending
+        assert batch._batch[0] == 'interfaces'
+        assert self.dump(batch) == self.dump(plain)
+        assert batch._batch is None
+        assert self.dump(batch) == ([(1, 'lo', 1500), (2, 'eth0', 1400)],
+                                    [(2, '10.0.0.1')])
+
+    def test_bulk(self):
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            return
+        events = [link(1, 'lo', 65536),
+                  link(2, 'eth0', 1500),
+                  link(1, 'lo', 1500),
+                  addr(2, '10.0.0.1'),
+                  addr(3, '10.0.0.2'),
+                  link(2, 'eth0', 1400)]
+        plain = self.load(False, events)
+        bulk = self.load(True, [])
+        bulk.bulk_start('localhost')
+        for event in events:
+            for handler in bulk.event_map[type(event)]:
+                handler('localhost', event)
+        # the rows are staged until the end of the bulk load
+        assert self.dump(bulk) == ([], [])
+        bulk.bulk_end('localhost')
+        assert self.dump(bulk) == self.dump(plain)
+        assert not bulk.fetchone('SELECT count(*) FROM interfaces_bulk')[0]
+
+    def test_profile(self):
+        spec = tempfile.mktemp()
+        try:
+            schema = self.load(True, [link(1, 'lo', 65536)], spec, 'file-wal')
+            assert schema.fetchone('PRAGMA journal_mode')[0] == 'wal'
+            reader = sqlite3.connect(spec)
+            # fetch() doesn't commit with a profile
+            assert self.dump(schema)[0] == [(1, 'lo', 65536)]
+            assert not reader.execute('SELECT * FROM interfaces').fetchall()
+            schema.commit()
+            assert reader.execute('SELECT * FROM interfaces').fetchall()
+            reader.close()
+            schema.close()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(spec + suffix):
+                    os.unlink(spec + suffix)
+
+    def test_replica(self):
+        spec = 'file:test-%s?mode=memory&cache=shared' % uuid32()
+        schema = self.load(True, [link(1, 'lo', 65536)], spec)
+        replica = sqlite3.connect(spec, uri=True, check_same_thread=False)
+        replica.execute('PRAGMA read_uncommitted = 1')
+        replica.execute('PRAGMA query_only = 1')
+        schema.replicas = queue.Queue()
+        schema.replicas.put(replica)
+        # replicas see only the loaded batches
+        req = 'SELECT f_IFLA_IFNAME FROM interfaces'
+        assert list(schema.fetch_replica(req)) == []
+        schema.flush_batch()
+        records = schema.fetch_replica(req)
+        assert next(records) == ('lo', )
+        # the replica is busy, fall back to the main connection
+        assert schema.replicas.empty()
+        assert list(schema.fetch_replica(req)) == [('lo', )]
+        records.close()
+        assert schema.replicas.qsize() == 1
+        schema.close()
+
+    def test_secondary(self):
+        req = ('SELECT * FROM interfaces '
+               'WHERE f_target = ? AND f_IFLA_IFNAME = ?')
+        plan = self.load(True, []).explain(req, ('localhost', 'lo'))
+        assert 'interfaces_target_IFLA_IFNAME_sidx' in plan[0][-1]
+        schema = self.load(True, [], secondary={'interfaces': []})
+        plan = schema.explain(req, ('localhost', 'lo'))
+        assert 'interfaces_target_IFLA_IFNAME_sidx' not in plan[0][-1]
+
+    def test_slow_query(self):
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        schema = self.load(True, [link(1, 'lo', 65536)])
+        handler = Handler()
+        dbschema.log.addHandler(handler)
+        config.db_slow_query = 0
+        try:
+            list(schema.fetch('SELECT * FROM interfaces WHERE f_IFLA_MTU = ?',
+                              (1500, )))
+        finally:
+            config.db_slow_query = None
+            dbschema.log.removeHandler(handler)
+        assert len(records) == 1
+        assert 'SCAN' in records[0]
+
+    def test_changes(self):
+        schema = self.load(True, [link(1, 'lo', 65536),
+                                  link(2, 'eth0', 1500),
+                                  addr(2, '10.0.0.1')])
+        schema.create_changes('interfaces')
+        schema.create_changes('addresses')
+        events = [link(1, 'lo', 65536),
+                  link(2, 'eth0', 1400),
+                  link(3, 'eth1', 1500)]
+        for event in events:
+            schema.load_ifinfmsg('localhost', event)
+        schema.mark('localhost', 1)
+        schema.execute('DELETE FROM interfaces WHERE f_index = 2')
+        names = schema.compiled['interfaces']['all_names']
+        changes = [(x[0],
+                    x[1] and dict(zip(names[:1] + names[2:], x[1])),
+                    x[2] and dict(zip(names[:1] + names[2:], x[2])))
+                   for x in schema.fetch_changes('interfaces')]
+        # no changes for lo, f_tflags changes are not logged
+        assert [(x[0],
+                 x[1] and x[1]['IFLA_MTU'],
+                 x[2] and x[2]['IFLA_MTU']) for x in changes] == \
+            [('update', 1500, 1400),
+             ('insert', None, 1500),
+             ('delete', 1400, None)]
+        # the foreign keys cascade
+        assert [x[0] for x in schema.fetch_changes('addresses')] == \
+            ['delete']
+        assert schema.fetch_changes('interfaces') == []
+        schema.drop_changes('interfaces')
+        schema.load_ifinfmsg('localhost', link(1, 'lo', 1500))
+        assert not schema.fetchone("SELECT count(*) FROM sqlite_master "
+                                   "WHERE name LIKE 'interfaces_changes%'")[0]
+
+    def test_attach(self):
+        specs = ['file:test-%s?mode=memory&cache=shared' % uuid32()
+                 for _ in range(2)]
+        shards = [self.load(True, [link(1, 'lo', 65536)], specs[0]),
+                  self.load(True, [link(1, 'lo', 65536),
+                                   link(2, 'eth0', 1500)], specs[1])]
+        for idx, shard in enumerate(shards):
+            shard.execute('UPDATE interfaces SET f_target = ?',
+                          ('shard%i' % idx, ))
+            shard.commit()
+        schema = self.load(True, [link(1, 'lo', 1500)], ':memory:')
+        schema.attach(specs)
+        # the main tables are shadowed by the shards
+        assert sorted(schema.fetch('SELECT f_target, f_IFLA_IFNAME, '
+                                   'f_IFLA_MTU FROM interfaces')) == \
+            [('shard0', 'lo', 65536),
+             ('shard1', 'eth0', 1500),
+             ('shard1', 'lo', 65536)]
+        assert schema.fetchone('SELECT count(*) FROM vlan')[0] == 0
+        schema.close()
+        for shard in shards:
+            shard.close()
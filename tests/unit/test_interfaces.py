@@ -0,0 +1,56 @@
+from socket import AF_INET6
+from pyroute2.ipdb.interfaces import Interface
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import IFA_F_TENTATIVE
+
+
+def addr(address, flags=0):
+    msg = ifaddrmsg()
+    msg['family'] = AF_INET6
+    msg['prefixlen'] = 64
+    msg['flags'] = flags
+    msg['index'] = 2
+    msg['attrs'] = [('IFA_ADDRESS', address)]
+    return msg
+
+
+class IPAddr(set):
+
+    @property
+    def ipv6(self):
+        return [x for x in self if ':' in x[0]]
+
+
+class Stub(dict):
+    '''
+    The interface parts used by `Interface._sync_ipv6()`
+    '''
+    def __init__(self, dump):
+        self['flags'] = 0
+        self['index'] = 2
+        self['ipaddr'] = IPAddr([('fe80::3', 64), ('172.16.0.1', 24)])
+        self.dump = dump
+        self.loaded = []
+        self.nl = self
+        self.ipdb = self
+        self.ipaddr = self
+
+    def get_addr(self, index, family):
+        return self.dump
+
+    def _new(self, msg):
+        self.loaded.append(msg.get_attr('IFA_ADDRESS'))
+
+
+class TestSyncIPv6(object):
+
+    def test_tentative(self):
+        stub = Stub([addr('fe80::1', IFA_F_TENTATIVE),
+                     addr('fe80::2', IFA_F_TENTATIVE),
+                     addr('2001:db8::1')])
+        transaction = {'ipaddr': set([('fe80::2', 64)])}
+        Interface.__dict__['_sync_ipv6'](stub, transaction)
+        # old IPv6 addresses are flushed
+        assert stub['ipaddr'] == set([('172.16.0.1', 24)])
+        # not requested tentative addresses are skipped
+        assert stub.loaded == ['fe80::2', '2001:db8::1']
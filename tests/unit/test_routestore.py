@@ -0,0 +1,52 @@
+from pyroute2.ipdb.routes import RouteStore
+
+
+def route(dst, gateway, table=254):
+    return {'family': 2,
+            'dst_len': 24,
+            'table': table,
+            'dst': dst,
+            'gateway': gateway}
+
+
+class TestRouteStore(object):
+
+    def test_put(self):
+        store = RouteStore()
+        a = store.put(route('10.0.0.0/24', '127.0.0.2'))
+        b = store.put(route('10.0.1.0/24', '127.0.0.2', table=100))
+        assert len(store) == 2
+        assert store.get(b, 'table') == 100
+        assert store.get(a, 'priority') is None
+        # routes share the interned values
+        assert store.columns['gateway'][a] is store.columns['gateway'][b]
+        assert store.fields(a) == route('10.0.0.0/24', '127.0.0.2')
+
+    def test_interned(self):
+        store = RouteStore()
+        a = store.put(route('10.0.0.0/24', '127.0.0.2'))
+        b = store.put(route('10.0.1.0/24', '127.0.0.2'))
+        assert store.interned['127.0.0.2'][1] == 2
+        # an update releases the old values
+        store.put(route('10.0.1.0/24', '127.0.0.3'), b)
+        assert store.interned['127.0.0.2'][1] == 1
+        assert store.interned['127.0.0.3'][1] == 1
+        # the last route drops the value
+        store.release(a)
+        assert '127.0.0.2' not in store.interned
+        store.release(b)
+        assert store.interned == {}
+        assert len(store) == 0
+
+    def test_not_hashable(self):
+        store = RouteStore()
+        fields = route('10.0.0.0/24', '127.0.0.2')
+        fields['extra'] = [('metrics', {})]
+        try:
+            store.put(fields)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError('TypeError expected')
+        assert store.interned == {}
+        assert len(store) == 0
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+from pyroute2.ndb import dbschema
+from pyroute2.ndb.main import Factory
+from pyroute2.ndb.interface import Interface
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+
+
+def link(index, ifname, mtu, event=16, family=0):
+    msg = ifinfmsg()
+    msg['header'] = {'type': event}
+    msg['family'] = family
+    msg['index'] = index
+    msg['flags'] = 1
+    msg['attrs'] = [('IFLA_IFNAME', ifname), ('IFLA_MTU', mtu)]
+    return msg
+
+
+def addr(index, address):
+    msg = ifaddrmsg()
+    msg['header'] = {'type': 20}
+    msg['index'] = index
+    msg['family'] = 2
+    msg['prefixlen'] = 24
+    msg['attrs'] = [('IFA_ADDRESS', address), ('IFA_LOCAL', address)]
+    return msg
+
+
+class NDB(object):
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.sources = {}
+
+    def get_schema(self, target):
+        return self.schema
+
+
+class View(object):
+
+    classes = Factory.classes
+
+    def __init__(self, ndb):
+        self.ndb = ndb
+
+
+class TestLoad(object):
+
+    def schema(self):
+        schema = dbschema.init(sqlite3.connect(':memory:',
+                                               check_same_thread=False),
+                               'sqlite3',
+                               False,
+                               id(threading.current_thread()))
+        schema.load_ifinfmsg('localhost', link(1, 'lo', 65536))
+        schema.load_ifinfmsg('localhost', link(2, 'eth0', 1500))
+        schema.load_netlink('addresses', 'localhost', addr(1, '127.0.0.1'))
+        schema.load_netlink('addresses', 'localhost', addr(2, '10.0.0.1'))
+        return schema
+
+    def test_load_rtnlmsg(self):
+        schema = self.schema()
+        obj = Interface(View(NDB(schema)), 'lo')
+        assert obj['mtu'] == 65536
+        obj['mtu'] = 1500
+        assert not obj.check_state()
+        # the object is loaded from the event, not from the DB
+        schema.execute = None
+        obj.load_rtnlmsg('localhost', link(1, 'lo', 1500))
+        assert obj.load_event.is_set()
+        assert obj['mtu'] == 1500
+        assert obj.check_state()
+        # no match
+        obj.load_event.clear()
+        obj.load_rtnlmsg('localhost', link(2, 'eth0', 1400))
+        assert not obj.load_event.is_set()
+        obj.load_rtnlmsg('localhost', link(1, 'lo', 1500, event=17))
+        assert obj.scope == 'invalid'
+
+    def test_load_ignored(self):
+        schema = self.schema()
+        obj = Interface(View(NDB(schema)), 'lo')
+        # AF_BRIDGE events are not loaded to the DB, nor to the object
+        obj.load_rtnlmsg('localhost', link(1, 'lo', 1500, family=7))
+        assert obj.load_event.is_set()
+        assert obj['family'] == 0
+        assert obj['mtu'] == 65536
+        obj.load_rtnlmsg('localhost', link(1, 'lo', 1500, event=17, family=7))
+        assert obj.scope == 'system'
+
+    def test_journal(self):
+        schema = self.schema()
+        schema.journal = True
+        obj = Interface(View(NDB(schema)), 'lo')
+        obj['mtu'] = 1500
+        snp = obj.snapshot()
+        # no snapshot tables
+        assert not schema.snapshots
+        assert snp.etable == 'interfaces'
+        assert snp['mtu'] == 65536
+        assert snp.changed == set(['mtu'])
+        # only the object dependencies
+        names = schema.compiled['interfaces']['all_names']
+        assert [x[names.index('index')]
+                for x in snp.journal['interfaces']] == [1]
+        names = schema.compiled['addresses']['all_names']
+        assert [x[names.index('IFA_ADDRESS')]
+                for x in snp.journal['addresses']] == ['127.0.0.1']
+        assert not schema.fetchone('SELECT count(*) FROM interfaces '
+                                   'WHERE f_tflags != 0')[0]
+        assert not schema.journal_diff('addresses', snp.journal)
+        schema.execute('DELETE FROM addresses')
+        assert schema.journal_diff('addresses', snp.journal) == \
+            snp.journal['addresses']
@@ -0,0 +1,50 @@
+from pyroute2.ndb.subscription import Subscription
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class NDB(object):
+
+    def _unsubscribe(self, subscription):
+        pass
+
+
+class TestSubscription(object):
+
+    def test_match(self):
+        sub = Subscription(NDB(), 'routes', ('target', 'dst', 'oif'),
+                           match={'oif': 2},
+                           maxsize=2)
+        sub.put('insert', None, ('localhost', '10.0.0.0', 2))
+        sub.put('insert', None, ('localhost', '10.0.1.0', 3))
+        # the row leaves the filter
+        sub.put('update',
+                ('localhost', '10.0.0.0', 2),
+                ('localhost', '10.0.0.0', 3))
+        # the queue is full
+        sub.put('delete', ('localhost', '10.0.0.0', 2), None)
+        assert sub.get() == ('insert',
+                             None,
+                             {'target': 'localhost',
+                              'dst': '10.0.0.0',
+                              'oif': 2})
+        assert sub.get()[0] == 'update'
+        assert sub.dropped == 1
+        try:
+            sub.get(timeout=0.1)
+        except queue.Empty:
+            pass
+        else:
+            raise AssertionError('the queue must be empty')
+
+    def test_callback(self):
+        changes = []
+        sub = Subscription(NDB(), 'routes', ('target', 'dst'),
+                           callback=lambda *x: changes.append(x))
+        sub.put('insert', None, ('localhost', '10.0.0.0'))
+        sub.close()
+        assert changes == [('insert', None, {'target': 'localhost',
+                                             'dst': '10.0.0.0'})]
+        assert sub.thread is None
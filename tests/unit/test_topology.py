@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+from pyroute2.ndb import dbschema
+from pyroute2.ndb.query import Query
+from pyroute2.ndb.topology import Topology
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+
+def decoded(msg):
+    # the handlers work with the messages as received
+    msg.encode()
+    ret = msg.__class__(msg.data)
+    ret.decode()
+    return ret
+
+
+def link(index, ifname, lladdr, gre=None, event=16, flags=1):
+    msg = ifinfmsg()
+    msg['header'] = {'type': event}
+    msg['index'] = index
+    msg['flags'] = flags
+    msg['attrs'] = [('IFLA_IFNAME', ifname)]
+    if lladdr is not None:
+        msg['attrs'].append(('IFLA_ADDRESS', lladdr))
+    if gre is not None:
+        data = {'attrs': [('IFLA_GRE_LOCAL', gre[0]),
+                          ('IFLA_GRE_REMOTE', gre[1])]}
+        msg['attrs'].append(('IFLA_LINKINFO',
+                             {'attrs': [('IFLA_INFO_KIND', 'gre'),
+                                        ('IFLA_INFO_DATA', data)]}))
+    return decoded(msg)
+
+
+def addr(index, address, event=20):
+    msg = ifaddrmsg()
+    msg['header'] = {'type': event}
+    msg['index'] = index
+    msg['family'] = 2
+    msg['prefixlen'] = 24
+    msg['attrs'] = [('IFA_ADDRESS', address), ('IFA_LOCAL', address)]
+    return decoded(msg)
+
+
+def neigh(ifindex, dst, lladdr, event=28):
+    msg = ndmsg()
+    msg['header'] = {'type': event}
+    msg['ifindex'] = ifindex
+    msg['family'] = 2
+    msg['state'] = 2
+    msg['attrs'] = [('NDA_DST', dst), ('NDA_LLADDR', lladdr)]
+    return decoded(msg)
+
+
+def route(dst, gateway, oif, event=24):
+    msg = rtmsg()
+    msg['header'] = {'type': event}
+    msg['family'] = 2
+    msg['dst_len'] = 24
+    msg['proto'] = 4
+    msg['type'] = 1
+    msg['attrs'] = [('RTA_TABLE', 254),
+                    ('RTA_DST', dst),
+                    ('RTA_GATEWAY', gateway),
+                    ('RTA_OIF', oif)]
+    return decoded(msg)
+
+
+node1 = [link(1, 'lo', '00:00:00:00:00:00'),
+         link(2, 'eth0', '52:54:00:00:00:01'),
+         link(3, 'gre1', None, ('10.0.0.1', '10.0.0.2')),
+         addr(2, '10.0.0.1'),
+         neigh(2, '10.0.0.2', '52:54:00:00:00:02'),
+         route('192.168.2.0', '10.0.0.2', 2),
+         route('192.168.3.0', '10.0.0.3', 2)]
+
+node2 = [link(1, 'lo', '00:00:00:00:00:00'),
+         link(2, 'eth0', '52:54:00:00:00:02'),
+         link(3, 'gre1', None, ('10.0.0.2', '10.0.0.1')),
+         addr(2, '10.0.0.2'),
+         neigh(2, '10.0.0.1', '52:54:00:00:00:01'),
+         route('192.168.1.0', '10.0.0.1', 2)]
+
+
+class TestTopology(object):
+
+    def init(self):
+        self.schema = dbschema.init(sqlite3.connect(':memory:',
+                                                    check_same_thread=False),
+                                    'sqlite3',
+                                    False,
+                                    id(threading.current_thread()))
+        self.topology = Topology()
+        self.changes = []
+        self.topology.subscribe(lambda *argv: self.changes.append(argv))
+        self.sql = Query(self.schema)
+        self.graph = Query(self.schema, topology=self.topology)
+
+    def load(self, target, events):
+        for event in events:
+            for event_map in (self.schema.event_map,
+                              self.topology.event_map):
+                for handler in event_map[type(event)]:
+                    handler(target, event)
+
+    def check(self):
+        for report in ('nodes', 'p2p_edges', 'l2_edges', 'l3_edges'):
+            sql = [x for x in getattr(self.sql, report)()]
+            graph = [x for x in getattr(self.graph, report)()]
+            assert sql[0] == graph[0]
+            assert sorted(sql[1:], key=repr) == sorted(graph[1:], key=repr)
+
+    def test_reports(self):
+        self.init()
+        self.load('node1', node1)
+        self.load('node2', node2)
+        self.check()
+        assert sorted(self.topology.records('l3')) == \
+            [('node1', 'node2', '10.0.0.2', '192.168.2.0', 24),
+             ('node2', 'node1', '10.0.0.1', '192.168.1.0', 24)]
+        assert self.topology.adjacency['l2'][('node1', 2)] == \
+            {('node2', 2): 1}
+        assert self.topology.adjacency['p2p'][('node2', 3)] == \
+            {('node1', 3): 1}
+
+    def test_updates(self):
+        self.init()
+        self.load('node1', node1)
+        self.load('node2', node2)
+        del self.changes[:]
+        # the gateway becomes a local address
+        self.load('node1', [addr(2, '10.0.0.2')])
+        self.check()
+        assert self.changes == [('l3', 'remove', ('node1',
+                                                  'node2',
+                                                  '10.0.0.2',
+                                                  '192.168.2.0',
+                                                  24))]
+        self.load('node1', [addr(2, '10.0.0.2', event=21)])
+        self.check()
+        # rename, the l2 edges follow
+        self.load('node2', [link(2, 'eth1', '52:54:00:00:00:02')])
+        self.check()
+        # link goes down, the routes are dropped
+        self.load('node2', [link(2, 'eth1', '52:54:00:00:00:02', flags=0)])
+        self.check()
+        assert not [x for x in self.topology.records('l3')
+                    if x[0] == 'node2']
+        # a new gateway
+        self.load('node1', [route('192.168.3.0', '10.0.0.2', 2)])
+        self.check()
+        # the source is gone
+        self.schema.flush('node2')
+        self.topology.flush('node2')
+        self.check()
+        assert self.topology.records('nodes') == [('node1', )]
+        assert not self.topology.adjacency['l2']
+        assert not self.topology.adjacency['p2p']
@@ -0,0 +1,64 @@
+from pyroute2.ipdb.linkedset import LinkedSet
+from pyroute2.ipdb.transactional import Transactional
+
+
+class Obj(Transactional):
+    _fields = ['a', 'b']
+    _linked_sets = ['s']
+
+    def __init__(self, *argv, **kwarg):
+        super(Obj, self).__init__(*argv, **kwarg)
+        with self._direct_state:
+            self['a'] = 1
+            self['s'] = LinkedSet()
+            self['s'].add(1)
+
+
+def snapshot():
+    obj = Obj(mode='direct')
+    sid = obj.snapshot()
+    journal = obj._snapshots[sid]
+    # the changes within the transaction are recorded
+    tid = obj.begin()
+    with obj._direct_state:
+        obj['a'] = 2
+    obj.drop(tid)
+    assert journal.fields == {'a': 1}
+    # but no copy is made at the transaction end
+    assert obj._snapshots[sid] is journal
+    assert journal.sealed
+    assert obj._journals == [journal]
+    return obj, sid, journal
+
+
+class TestJournal(object):
+
+    def check(self, obj, sid, journal):
+        # the first change after the transaction makes the copy
+        assert obj._snapshots[sid] is not journal
+        assert not obj._journals
+        assert not obj['s'].journals
+        ret = obj.last_snapshot()
+        assert ret['a'] == 1
+        assert ret['b'] is None
+        assert set(ret['s']) == set([1])
+
+    def test_field(self):
+        obj, sid, journal = snapshot()
+        with obj._direct_state:
+            obj['b'] = 3
+        self.check(obj, sid, journal)
+
+    def test_set(self):
+        obj, sid, journal = snapshot()
+        obj['s'].add(2)
+        self.check(obj, sid, journal)
+        obj['s'].remove(1)
+        assert set(obj.last_snapshot()['s']) == set([1])
+
+    def test_revert(self):
+        obj, sid, journal = snapshot()
+        obj.revert(sid)
+        assert obj.current_tx['a'] == 1
+        assert not obj._journals
+        assert not obj['s'].journals
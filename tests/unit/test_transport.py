@@ -0,0 +1,111 @@
+import os
+import struct
+import threading
+from pyroute2.remote import Transport
+from pyroute2.remote import TRNSP_ACK
+from pyroute2.remote import TRNSP_BROADCAST
+from pyroute2.remote import TRNSP_DATAGRAM
+
+
+def pipe():
+    rfd, wfd = os.pipe()
+    return (Transport(os.fdopen(rfd, 'rb')),
+            Transport(os.fdopen(wfd, 'wb')))
+
+
+def send(func, *argv, **kwarg):
+    # the writer may block on the pipe, so run it in a thread
+    writer = threading.Thread(target=func, args=argv, kwargs=kwarg)
+    writer.start()
+    return writer
+
+
+def transport(test):
+    # run the test with a pair of transports over a pipe
+    def f(self):
+        trnsp_in, trnsp_out = pipe()
+        try:
+            test(self, trnsp_in, trnsp_out)
+        finally:
+            for trnsp in (trnsp_in, trnsp_out):
+                if not trnsp.file_obj.closed:
+                    trnsp.file_obj.close()
+    f.__name__ = test.__name__
+    return f
+
+
+class TestTransport(object):
+
+    @transport
+    def test_pickle(self, trnsp_in, trnsp_out):
+        msg = {'stage': 'command', 'cookie': 1, 'argv': [1, 'a']}
+        send(trnsp_out.send, msg).join()
+        ret = trnsp_in.recv_frame()
+        assert ret.pop('channel') == 0
+        assert ret == msg
+
+    @transport
+    def test_raw(self, trnsp_in, trnsp_out):
+        for frame in (TRNSP_BROADCAST, TRNSP_DATAGRAM):
+            send(trnsp_out.send_raw, frame, b'\x01\x02\x03').join()
+            ret = trnsp_in.recv_frame()
+            assert ret['stage'] == ('broadcast'
+                                    if frame == TRNSP_BROADCAST
+                                    else 'datagram')
+            assert ret['data'] == bytearray(b'\x01\x02\x03')
+            assert ret['error'] is None
+
+    @transport
+    def test_ack(self, trnsp_in, trnsp_out):
+        send(trnsp_out.send_raw, TRNSP_ACK, struct.pack('I', 42)).join()
+        ret = trnsp_in.recv_frame()
+        assert ret['stage'] == 'datagram'
+        assert ret['cookie'] == 42
+        assert ret['error'] is None
+
+    @transport
+    def test_channel(self, trnsp_in, trnsp_out):
+        send(trnsp_out.send, {'stage': 'init'}, 0xffff).join()
+        send(trnsp_out.send_raw, TRNSP_BROADCAST, b'\x00', 5).join()
+        assert trnsp_in.recv_frame()['channel'] == 0xffff
+        ret = trnsp_in.recv_frame()
+        # the channel doesn't affect the frame type
+        assert ret['channel'] == 5
+        assert ret['stage'] == 'broadcast'
+
+    @transport
+    def test_buffer(self, trnsp_in, trnsp_out):
+        # the buffer grows for a large frame, the data is copied out
+        size = len(trnsp_in._buffer) * 2 + 1
+        writer = send(trnsp_out.send_raw, TRNSP_BROADCAST, b'\xaa' * size)
+        large = trnsp_in.recv_frame()
+        writer.join()
+        send(trnsp_out.send_raw, TRNSP_BROADCAST, b'\xbb').join()
+        small = trnsp_in.recv_frame()
+        assert len(trnsp_in._buffer) >= size
+        assert large['data'] == bytearray(b'\xaa' * size)
+        assert small['data'] == bytearray(b'\xbb')
+
+    @transport
+    def test_eof(self, trnsp_in, trnsp_out):
+        # the frame is cut in the middle
+        packet = struct.pack('II', 108, TRNSP_BROADCAST) + b'\x00' * 50
+        trnsp_out.file_obj.write(packet)
+        trnsp_out.file_obj.close()
+        try:
+            trnsp_in.recv_frame()
+        except struct.error:
+            pass
+        else:
+            raise AssertionError('struct.error expected')
+
+    @transport
+    def test_eof_header(self, trnsp_in, trnsp_out):
+        trnsp_out.file_obj.write(b'\x00' * 4)
+        trnsp_out.file_obj.close()
+        try:
+            trnsp_in.recv_frame()
+        except struct.error:
+            pass
+        else:
+            raise AssertionError('struct.error expected')